@@ -145,7 +145,7 @@ def main() -> None:
 
     #输出最终的meta.json的结构
     result = {}
-    result[primary_contract.name]={"entities" : entity.storage_meta, "address": args.contract_source[0], "constants": contract_walker.constants, "utilities": contract_walker.utilities, "function_write_storage": contract_walker.function_write_storage}
+    result[primary_contract.name]={"entities" : entity.storage_meta, "address": args.contract_source[0], "constants": contract_walker.constants, "utilities": contract_walker.utilities, "function_write_storage": contract_walker.function_write_storage, "function_events": contract_walker.function_events}
 
     get_contract_from_name(slither, primary_contract.name)
 
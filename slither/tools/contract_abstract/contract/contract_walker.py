@@ -9,6 +9,10 @@ from slither.core.variables.state_variable import StateVariable
 from slither.slithir.variables.constant import Constant
 from slither.core.solidity_types.elementary_type import ElementaryType
 from slither.slithir.operations.assignment import Assignment
+from slither.slithir.operations.event_call import EventCall
+from slither.slithir.operations.internal_call import InternalCall
+from slither.slithir.operations.library_call import LibraryCall
+from slither.core.declarations.solidity_variables import SolidityVariableComposed
 from slither.core.solidity_types.user_defined_type import UserDefinedType
 import os
 import psutil
@@ -29,6 +33,7 @@ class ContractWalker:
         self.read_storages = {} # 某个function所有的读的storage，key是function的name，value是set(storage_name)
         self.write_storages = {} # 某个function所有的写的storage，key是function的name，value是set(storage_name)
         self.function_write_storage = {} # 某个function所有的写的storage，key是function的name，value是set(storage_name), storage_name精确到字段
+        self.function_events = {} # 某个function（包括内部调用）emit的事件，key是function的signature，value是[{"event": 事件签名, "arguments": 每个参数来自的function参数}]
         self.constants = {} # 某个合约的常量，key是合约，value是数组，每个元素是{"name": name, "value": value, "type": {"dataType": "uint256", "dataMeta": {"size": 256}}}
 
         self.current_function = None
@@ -117,6 +122,7 @@ class ContractWalker:
         self.filter_storage()
         self.parse_utilities()
         self.collect_function_write_storage()
+        self.collect_function_events()
         return
 
     def walk_path(self, path_with_index, walker, all_paths_with_index, path_id):
@@ -329,6 +335,52 @@ class ContractWalker:
             self.function_write_storage[function.solidity_signature] = {"parameters": parameters, "write_storages": list(storage_writes)}
 
 
+    def collect_function_events(self):
+        """记录入口函数emit的事件，以及事件的每个参数直接来自哪个函数参数（或者$msg_sender），用于从日志中发现mapping的key"""
+        for function in self.write_storages:
+            events = []
+            sources = {parameter: parameter.name for parameter in function.parameters}
+            self._collect_events(function, sources, events, {function})
+            if events:
+                self.function_events[function.solidity_signature] = events
+
+    def _collect_events(self, function, sources, events, visited):
+        for node in function.nodes:
+            for ir in node.irs:
+                if isinstance(ir, EventCall):
+                    event = self._find_event(function, ir)
+                    if event is None:
+                        logger.warning(f"Event {ir.name} not found for {function.canonical_name}")
+                        continue
+                    arguments = [self._argument_source(argument, sources) for argument in ir.arguments]
+                    record = {"event": event.full_name, "arguments": arguments}
+                    if record not in events:
+                        events.append(record)
+                elif isinstance(ir, (InternalCall, LibraryCall)) and ir.function is not None and ir.function not in visited:
+                    # 只跟踪参数直接传递的内部调用
+                    callee_sources = {}
+                    for parameter, argument in zip(ir.function.parameters, ir.arguments):
+                        source = self._argument_source(argument, sources)
+                        if source is not None:
+                            callee_sources[parameter] = source
+                    visited.add(ir.function)
+                    self._collect_events(ir.function, callee_sources, events, visited)
+
+    def _find_event(self, function, ir):
+        candidates = list(function.contract_declarer.events) + list(self.contract.events)
+        for event in candidates:
+            if event.name == str(ir.name) and len(event.elems) == len(ir.arguments):
+                return event
+        return None
+
+    @staticmethod
+    def _argument_source(argument, sources):
+        if argument in sources:
+            return sources[argument]
+        if isinstance(argument, SolidityVariableComposed) and argument.name == "msg.sender":
+            return "$msg_sender"
+        return None
+
     @staticmethod
     def get_pattern_mode(patterns):
         pattern_mode = 0 # 记录patter mode， 0表示未识别，1就是连续，2就是隔两个取第一个，3就是隔两个取第二个
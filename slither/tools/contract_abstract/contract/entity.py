@@ -10,8 +10,10 @@ from slither.tools.read_storage.read_storage import SlitherReadStorage
 
 
 class Entity:
-    def __init__(self, address, contract, contract_info, storage_meta={}):
+    def __init__(self, address, contract, contract_info, storage_meta={}, batch_reader=None):
         self.address = address
+        self.batch_reader = batch_reader # BatchStorageReader，用于批量读取storage
+        self.block_identifier = None # 快照模式下所有storage读取固定在该区块，None表示latest
         self.contract = contract
         self.storage_name_to_statevariable = {}
         self.statevariable_to_storage_name = {}
@@ -54,13 +56,47 @@ class Entity:
             slot_info, type_info = self.get_storage_slot_info_from_expr(parsed_expr, slot_info, self.storage_meta[parsed_expr["name"]])
             return slot_info, type_info
 
-    def get_storage_value(self, slot_info, type):
+    def pin_block(self, block_number):
+        """将之后所有的storage读取固定在指定区块"""
+        self.block_identifier = block_number
+
+    def unpin_block(self):
+        self.block_identifier = None
+
+    def get_block_identifier(self, block_identifier=None):
+        """显式指定的区块优先，其次是固定的区块，都没有时为latest"""
+        if block_identifier is not None:
+            return block_identifier
+        return self.block_identifier if self.block_identifier is not None else "latest"
+
+    def get_storage_value(self, slot_info, type, block_identifier=None):
         slot = slot_info["slot"]
         offset = slot_info["offset"]
         slot = int.to_bytes(slot,32,byteorder="big")
-        value_bytes = bytes(self.contract_info.w3.eth.get_storage_at(self.address, slot)).rjust(32, bytes(1))
-        value = self.contract_info.read_storage.convert_value_to_type(value_bytes, type["dataMeta"]["size"]*8, offset, type["dataType"])
-        return value
+        value_bytes = bytes(self.contract_info.w3.eth.get_storage_at(self.address, slot, block_identifier=self.get_block_identifier(block_identifier))).rjust(32, bytes(1))
+        return self.decode_storage_value(value_bytes, offset, type)
+
+    def get_storage_values(self, reads, block_identifier=None):
+        """
+        批量读取多个storage的值
+        Args:
+            reads: (slot_info, type)的列表
+            block_identifier: 读取的区块，None时使用pin_block固定的区块；
+                多个线程在不同区块上读取时需要显式指定，不能共用pin_block
+        Returns:
+            list: 与reads顺序一致的值列表
+        """
+        if self.batch_reader is None:
+            return [self.get_storage_value(slot_info, type, block_identifier) for slot_info, type in reads]
+        raw_values = self.batch_reader.get_storage_at_many([slot_info["slot"] for slot_info, _ in reads], self.get_block_identifier(block_identifier))
+        values = []
+        for slot_info, type in reads:
+            value_bytes = raw_values[slot_info["slot"]].rjust(32, bytes(1))
+            values.append(self.decode_storage_value(value_bytes, slot_info["offset"], type))
+        return values
+
+    def decode_storage_value(self, value_bytes, offset, type):
+        return self.contract_info.read_storage.convert_value_to_type(value_bytes, type["dataMeta"]["size"]*8, offset, type["dataType"])
 
 
     @staticmethod
@@ -230,9 +230,16 @@ class DatabaseManager:
             logger.error(f"创建数据库时发生未知错误: {e}")
             return False
     
-    def setup_database(self) -> bool:
-        """设置数据库环境"""
+    def setup_database(self, check_server=True) -> bool:
+        """
+        设置数据库环境
+        Args:
+            check_server: 是否检查PostgreSQL的安装和运行状态，同一个服务器已经检查过时只需要创建数据库
+        """
         try:
+            if not check_server:
+                return self.create_database_if_not_exists()
+
             # 检查PostgreSQL是否已安装
             if not self.check_postgres_installed():
                 logger.error("PostgreSQL未安装，请先安装PostgreSQL")
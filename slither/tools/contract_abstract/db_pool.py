@@ -0,0 +1,168 @@
+import threading
+import time
+import logging
+import psycopg2
+from psycopg2 import extensions
+from typing import Dict, Any
+from slither.tools.contract_abstract.database_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class ConnectionPool:
+    """
+    同一个数据库(DSN)的连接池，多个线程共享。
+    归还的连接放回空闲列表，空闲超过health_check_interval秒的连接在取出时先检查是否可用，不可用时重新连接
+    """
+
+    def __init__(self, db_config: Dict[str, Any], max_connections=None, health_check_interval=30, timeout=60):
+        """
+        Args:
+            db_config: 数据库配置
+            max_connections: 最多同时打开的连接数，None表示不限制；
+                TransactionInfo等组件在整个生命周期中占用一个连接，限制连接数时要大于组件的数量
+            health_check_interval: 空闲超过多少秒的连接取出时需要检查
+            timeout: 连接都被占用时最多等待的秒数
+        """
+        self.db_config = dict(db_config)
+        self.max_connections = max(1, max_connections) if max_connections else None
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.idle = [] # (连接, 归还的时间)
+        self.opened = 0 # 已经打开的连接数，包括空闲的连接
+        self.condition = threading.Condition()
+
+    def getconn(self):
+        """
+        取出一个连接，autocommit为False，用完后需要通过putconn归还
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.max_connections is not None and self.opened >= self.max_connections:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Exception(f"获取数据库连接超时: {self.db_config['database']} 的 {self.max_connections} 个连接都在使用中")
+                    self.condition.wait(remaining)
+                if self.idle:
+                    connection, idle_since = self.idle.pop()
+                else:
+                    connection, idle_since = None, None
+                    self.opened += 1
+            if connection is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+            if self._is_healthy(connection, idle_since):
+                return connection
+            logger.warning(f"数据库 {self.db_config['database']} 的空闲连接已经不可用，重新连接")
+            self._discard(connection)
+
+    def putconn(self, connection, close=False):
+        """归还连接，没有结束的事务会被回滚，已经断开的连接直接丢弃"""
+        if close or connection.closed:
+            self._discard(connection)
+            return
+        try:
+            status = connection.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(connection)
+                return
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            self._discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def closeall(self):
+        with self.condition:
+            for connection, _ in self.idle:
+                connection.close()
+            self.opened -= len(self.idle)
+            self.idle = []
+
+    def _discard(self, connection):
+        if connection is not None and not connection.closed:
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+        with self.condition:
+            self.opened -= 1
+            self.condition.notify()
+
+    def _is_healthy(self, connection, idle_since):
+        if connection.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _connect(self):
+        """连接数据库，连接失败时指数退避重试，数据库不存在时尝试小写的数据库名称"""
+        max_retries = 3
+        retry_delay = 2
+        for attempt in range(max_retries):
+            try:
+                connection = psycopg2.connect(**self.db_config)
+                connection.autocommit = False
+                return connection
+            except psycopg2.OperationalError as e:
+                error_msg = str(e).lower()
+                logger.error(f"连接数据库 {self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']} 失败 "
+                             f"(尝试 {attempt + 1}/{max_retries}): {e}")
+                if "database" in error_msg and "does not exist" in error_msg and self.db_config['database'] != self.db_config['database'].lower():
+                    # 数据库创建时名称被转换成了小写
+                    logger.info(f"尝试使用小写数据库名称连接: {self.db_config['database'].lower()}")
+                    self.db_config['database'] = self.db_config['database'].lower()
+                    continue
+                if "does not exist" in error_msg or "authentication failed" in error_msg or attempt == max_retries - 1:
+                    raise
+                time.sleep(retry_delay)
+                retry_delay *= 2  # 指数退避
+
+
+_pools = {}
+_verified_servers = set()
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_config: Dict[str, Any], **kwargs) -> ConnectionPool:
+    """
+    获取进程内该DSN共享的连接池，第一次获取时通过DatabaseManager检查PostgreSQL服务并创建数据库，
+    同一个服务器的安装和运行检查只做一次
+    Args:
+        db_config: 数据库配置
+        kwargs: 第一次创建连接池时传给ConnectionPool的参数
+    """
+    key = (db_config['host'], db_config['port'], db_config['database'], db_config['user'])
+    with _pools_lock:
+        if key not in _pools:
+            server = (db_config['host'], db_config['port'])
+            if not DatabaseManager(db_config).setup_database(check_server=server not in _verified_servers):
+                raise Exception("数据库环境设置失败")
+            _verified_servers.add(server)
+            _pools[key] = ConnectionPool(db_config, **kwargs)
+            logger.info(f"创建数据库连接池: {db_config['host']}:{db_config['port']}/{db_config['database']}")
+        return _pools[key]
+
+
+def close_all_pools():
+    """关闭所有连接池中空闲的连接"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+        _verified_servers.clear()
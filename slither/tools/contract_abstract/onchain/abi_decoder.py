@@ -0,0 +1,162 @@
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from eth_abi.registry import registry
+from eth_abi.decoding import ContextFramesBytesIO, TupleDecoder
+from eth_utils import collapse_if_tuple, function_signature_to_4byte_selector, to_checksum_address
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class AbiDecoder:
+    """按4字节selector缓存函数ABI和eth_abi解码器，避免每笔交易都重新解析整个ABI"""
+
+    def __init__(self, abi):
+        """
+        Args:
+            abi: 合约ABI，可以是Etherscan返回的JSON字符串或者已解析的列表
+        """
+        if isinstance(abi, str):
+            abi = json.loads(abi)
+        self.functions = {} # selector -> {"name", "inputs", "types", "decoder"}
+        self.unknown_selectors = set() # ABI中不存在的selector
+        for item in abi or []:
+            if item.get("type", "function") != "function":
+                continue
+            inputs = item.get("inputs", [])
+            types = [collapse_if_tuple(param) for param in inputs]
+            signature = f"{item['name']}({','.join(types)})"
+            selector = "0x" + function_signature_to_4byte_selector(signature).hex()
+            self.functions[selector] = {
+                "name": item["name"],
+                "inputs": inputs,
+                "types": types,
+                "decoder": TupleDecoder(decoders=tuple(registry.get_decoder(t) for t in types))
+            }
+
+    def decode(self, tx_input) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        解码一笔交易的input
+
+        Args:
+            tx_input: 交易input的hex字符串或bytes
+
+        Returns:
+            Tuple[函数名, 参数字典]，无法解码时返回(None, None)
+        """
+        if isinstance(tx_input, (bytes, bytearray)):
+            tx_input = "0x" + bytes(tx_input).hex()
+        if not tx_input or len(tx_input) < 10:
+            return None, None
+        return self._decode_with_selector(tx_input[:10].lower(), tx_input)
+
+    def decode_many(self, rows: Iterable[Dict[str, Any]]) -> List[Tuple[Optional[str], Optional[Dict[str, Any]]]]:
+        """
+        批量解码交易，按method_id分组，每组只查找一次函数ABI
+
+        Args:
+            rows: 交易表中的行，需要有input_data，method_id和decoded_params可选，
+                有decoded_params时直接使用，不再解码
+
+        Returns:
+            List[Tuple[函数名, 参数字典]]，与rows顺序一致，无法解码的为(None, None)
+        """
+        rows = list(rows)
+        results = [(None, None)] * len(rows)
+        groups = {}
+        for i, row in enumerate(rows):
+            tx_input = row.get("input_data")
+            if not tx_input or len(tx_input) < 10:
+                continue
+            selector = (row.get("method_id") or tx_input[:10]).lower()
+            if row.get("decoded_params") is not None:
+                # 入库时已经解码过
+                results[i] = self.from_stored(row["decoded_params"], selector)
+            else:
+                groups.setdefault(selector, []).append(i)
+
+        for selector, indexes in groups.items():
+            if selector not in self.functions:
+                self.unknown_selectors.add(selector)
+                continue
+            for i in indexes:
+                results[i] = self._decode_with_selector(selector, rows[i]["input_data"])
+        return results
+
+    def _decode_with_selector(self, selector, tx_input):
+        if selector in self.unknown_selectors:
+            return None, None
+        function = self.functions.get(selector)
+        if function is None:
+            logger.debug(f"ABI中没有selector {selector}")
+            self.unknown_selectors.add(selector)
+            return None, None
+        try:
+            values = function["decoder"](ContextFramesBytesIO(bytes.fromhex(tx_input[10:])))
+        except Exception as e:
+            # 同一个selector的数据格式可能各不相同，只记录单笔失败，不缓存
+            logger.debug(f"解码交易输入失败 {selector}: {e}")
+            return None, None
+        params = {param["name"]: self._normalize(param, value) for param, value in zip(function["inputs"], values)}
+        return function["name"], params
+
+    @classmethod
+    def _normalize(cls, param, value):
+        """与web3的decode_function_input保持一致：地址转为checksum格式，tuple转为字典"""
+        param_type = param["type"]
+        if param_type.endswith("]"):
+            element = dict(param, type=param_type[:param_type.rindex("[")])
+            return [cls._normalize(element, item) for item in value]
+        if param_type == "tuple":
+            return {component["name"]: cls._normalize(component, item)
+                    for component, item in zip(param["components"], value)}
+        if param_type == "address":
+            return to_checksum_address(value)
+        return value
+
+    def to_stored(self, func_name, params) -> Optional[str]:
+        """将解码结果转换为可以存入JSONB列的字符串，bytes保存为hex字符串"""
+        if func_name is None:
+            return None
+        return json.dumps({"function": func_name, "params": self._to_json(params)})
+
+    def from_stored(self, stored, selector) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        从JSONB列恢复解码结果，根据ABI把hex字符串还原为bytes，与直接解码的结果一致
+
+        Args:
+            stored: decoded_params列的值（dict或者JSON字符串）
+            selector: 交易的method_id
+        """
+        if isinstance(stored, str):
+            stored = json.loads(stored)
+        function = self.functions.get(selector)
+        if function is None:
+            return stored["function"], stored["params"]
+        params = {param["name"]: self._restore(param, stored["params"][param["name"]])
+                  for param in function["inputs"] if param["name"] in stored["params"]}
+        return stored["function"], params
+
+    @classmethod
+    def _to_json(cls, value):
+        if isinstance(value, (bytes, bytearray)):
+            return "0x" + bytes(value).hex()
+        if isinstance(value, dict):
+            return {k: cls._to_json(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [cls._to_json(v) for v in value]
+        return value
+
+    @classmethod
+    def _restore(cls, param, value):
+        param_type = param["type"]
+        if param_type.endswith("]"):
+            element = dict(param, type=param_type[:param_type.rindex("[")])
+            return [cls._restore(element, item) for item in value]
+        if param_type == "tuple":
+            return {component["name"]: cls._restore(component, value[component["name"]])
+                    for component in param["components"]}
+        if param_type.startswith("bytes"):
+            return bytes.fromhex(value[2:])
+        return value
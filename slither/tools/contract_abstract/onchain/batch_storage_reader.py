@@ -0,0 +1,120 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Iterable
+import requests
+from slither.tools.contract_abstract.onchain.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class BatchStorageReader:
+    """通过JSON-RPC批量请求读取合约storage"""
+
+    def __init__(self, rpc_url, address, batch_size=100, max_workers=4, max_retries=3, timeout=30, http_client=None,
+                 rate_limiter=None):
+        self.rpc_url = rpc_url
+        self.http_client = http_client or get_http_client()
+        # 每个批量请求消耗一个令牌，同一个RPC节点的多个合约共享一个TokenBucket
+        self.rate_limiter = rate_limiter
+        self.address = address
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    @staticmethod
+    def slot_to_hex(slot):
+        """将slot转换为32字节的hex字符串"""
+        if isinstance(slot, bytes):
+            slot = int.from_bytes(slot, "big")
+        elif isinstance(slot, str):
+            slot = int(slot, 16)
+        return "0x" + slot.to_bytes(32, byteorder="big").hex()
+
+    @staticmethod
+    def block_to_param(block_identifier):
+        if isinstance(block_identifier, int):
+            return hex(block_identifier)
+        return block_identifier
+
+    def get_storage_at_many(self, slots: Iterable[int], block_identifier="latest") -> Dict[int, bytes]:
+        """
+        批量读取多个slot的原始值
+
+        Args:
+            slots: slot列表（int），重复的slot只会请求一次
+            block_identifier: 区块号或者"latest"等tag
+
+        Returns:
+            Dict[int, bytes]: slot到32字节原始值的映射
+        """
+        unique_slots = list(dict.fromkeys(slots))
+        if not unique_slots:
+            return {}
+
+        batches = [unique_slots[i:i + self.batch_size] for i in range(0, len(unique_slots), self.batch_size)]
+        logger.info(f"批量读取 {len(unique_slots)} 个slot，共 {len(batches)} 个批次，并发数 {self.max_workers}")
+
+        results = {}
+        if self.max_workers == 1 or len(batches) == 1:
+            for batch in batches:
+                results.update(self._request_batch(batch, block_identifier))
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for batch_result in executor.map(lambda b: self._request_batch(b, block_identifier), batches):
+                    results.update(batch_result)
+        return results
+
+    def _request_batch(self, slots: List[int], block_identifier) -> Dict[int, bytes]:
+        """发送一个JSON-RPC批量请求"""
+        block_param = self.block_to_param(block_identifier)
+        payload = [
+            {
+                "jsonrpc": "2.0",
+                "id": i,
+                "method": "eth_getStorageAt",
+                "params": [self.address, self.slot_to_hex(slot), block_param]
+            }
+            for i, slot in enumerate(slots)
+        ]
+
+        retry_delay = 1
+        for attempt in range(self.max_retries):
+            try:
+                resp = self._post(payload)
+                resp.raise_for_status()
+                data = resp.json()
+                if isinstance(data, dict):
+                    # 部分节点不支持批量请求时会返回单个错误对象
+                    raise Exception(f"RPC节点不支持批量请求: {data.get('error', data)}")
+                return self._parse_batch_response(slots, data)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"批量读取storage失败 (尝试 {attempt + 1}/{self.max_retries}): {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(retry_delay)
+                    retry_delay *= 2  # 指数退避
+                else:
+                    raise Exception(f"批量读取storage失败: {e}")
+
+    def _post(self, payload):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return self.http_client.post(self.rpc_url, json=payload, timeout=self.timeout)
+
+    @staticmethod
+    def _parse_batch_response(slots: List[int], data: List[Dict[str, Any]]) -> Dict[int, bytes]:
+        results = {}
+        for item in data:
+            if "error" in item:
+                raise Exception(f"eth_getStorageAt返回错误: {item['error']}")
+            slot = slots[item["id"]]
+            value = item["result"]
+            if value.startswith("0x"):
+                value = value[2:]
+            results[slot] = bytes.fromhex(value.rjust(64, "0"))
+        missing = [slot for slot in slots if slot not in results]
+        if missing:
+            raise Exception(f"批量请求缺少 {len(missing)} 个slot的返回值")
+        return results
@@ -1,19 +1,23 @@
 from web3 import Web3
 import logging
 from slither.tools.read_storage.read_storage import SlitherReadStorage
+from slither.tools.contract_abstract.onchain.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
 class ContractInfo:
-    def __init__(self, rpc_url, contracts=None):
+    def __init__(self, rpc_url, contracts=None, http_client=None, timeout=30):
         self.rpc_url = rpc_url
+        self.http_client = http_client or get_http_client()
         # 连接到以太坊节点
         # 如果您有本地节点，可以使用：
         # w3 = Web3(Web3.HTTPProvider('http://127.0.0.1:8545'))
         # 或者连接到公共节点（例如 Infura，请替换 YOUR_INFURA_PROJECT_ID）
-        w3 = Web3(Web3.HTTPProvider(rpc_url))
+        # 使用共享的HTTP客户端，重试由HTTP客户端负责，关闭web3自带的重试
+        w3 = Web3(Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": timeout}, session=self.http_client,
+                                    exception_retry_configuration=None))
         # # 或者连接到 Alchemy (请替换 YOUR_ALCHEMY_API_KEY)
         # w3 = Web3(Web3.HTTPProvider('https://eth-mainnet.alchemyapi.io/v2/YOUR_ALCHEMY_API_KEY'))
         # 检查是否成功连接
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Generator, List, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class TokenBucket:
+    """令牌桶限流器，多个线程共享，保证请求速率不超过API key的配额"""
+
+    def __init__(self, rate, capacity=1):
+        """
+        Args:
+            rate: 每秒产生的令牌数，即每秒最多请求数
+            capacity: 桶的容量，即允许的突发请求数
+        """
+        self.rate = float(rate)
+        self.capacity = max(1, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """阻塞直到取得令牌"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class EtherscanRangeFetcher:
+    """
+    并发获取一段区块范围内的交易：按窗口切分，txlist和txlistinternal同时请求，
+    某个窗口返回满页时二分该窗口，结果按区块顺序返回
+    """
+
+    def __init__(self, request_page, rate_limiter, max_workers=4, window_size=5000, page_size=10000,
+                 max_retries=5, backoff=1.0, actions=("txlist", "txlistinternal")):
+        """
+        Args:
+            request_page: 请求一页数据的函数，参数为(action, start_block, end_block, page, offset)，返回交易列表
+            rate_limiter: TokenBucket，每次请求前取得令牌
+            max_workers: 并发请求数
+            window_size: 初始窗口的区块数
+            page_size: Etherscan每页最大记录数，返回满页说明窗口内还有更多数据
+            max_retries: 单个请求的最大尝试次数
+            backoff: 第一次重试前等待的秒数，之后指数增长
+            actions: 需要获取的交易类型
+        """
+        self.request_page = request_page
+        self.rate_limiter = rate_limiter
+        self.max_workers = max(1, max_workers)
+        self.window_size = max(1, window_size)
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.actions = actions
+
+    def fetch_range(self, start_block, end_block) -> Generator[Tuple[int, int, List[Dict[str, Any]]], None, None]:
+        """
+        获取[start_block, end_block]内的交易，同时进行的窗口数有上限，内存占用有界
+
+        Yields:
+            (窗口起始区块, 窗口结束区块, 按区块排序的交易列表)，窗口按区块顺序返回
+        """
+        windows = iter(
+            (block, min(block + self.window_size - 1, end_block))
+            for block in range(start_block, end_block + 1, self.window_size)
+        )
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            def submit_next():
+                window = next(windows, None)
+                if window is None:
+                    return False
+                futures = [executor.submit(self._fetch_window, action, *window) for action in self.actions]
+                pending.append((window, futures))
+                return True
+
+            for _ in range(self.max_workers):
+                if not submit_next():
+                    break
+
+            while pending:
+                (window_start, window_end), futures = pending.popleft()
+                transactions = []
+                for future in futures:
+                    transactions.extend(future.result())
+                transactions.sort(key=lambda tx: int(tx.get("blockNumber") or 0))
+                submit_next()
+                logger.info(f"区块范围 {window_start}-{window_end} 获取到 {len(transactions)} 条交易记录")
+                yield window_start, window_end, transactions
+
+    def _fetch_window(self, action, start_block, end_block) -> List[Dict[str, Any]]:
+        transactions = self._request(action, start_block, end_block)
+        if len(transactions) < self.page_size:
+            return transactions
+        if start_block == end_block:
+            raise Exception(f"区块 {start_block} 中 {action} 交易数超过单页上限 {self.page_size}，无法继续拆分")
+
+        # 满页说明窗口内还有更多数据，二分窗口
+        middle = (start_block + end_block) // 2
+        logger.info(f"{action} 区块范围 {start_block}-{end_block} 返回满页，拆分为 {start_block}-{middle} 和 {middle + 1}-{end_block}")
+        return self._fetch_window(action, start_block, middle) + self._fetch_window(action, middle + 1, end_block)
+
+    def _request(self, action, start_block, end_block) -> List[Dict[str, Any]]:
+        retry_delay = self.backoff
+        for attempt in range(self.max_retries):
+            self.rate_limiter.acquire()
+            try:
+                return self.request_page(action, start_block, end_block, 1, self.page_size)
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise Exception(f"获取 {action} 区块范围 {start_block}-{end_block} 失败: {e}")
+                logger.warning(f"获取 {action} 区块范围 {start_block}-{end_block} 失败 (尝试 {attempt + 1}/{self.max_retries}): {e}")
+                time.sleep(retry_delay)
+                retry_delay *= 2  # 指数退避
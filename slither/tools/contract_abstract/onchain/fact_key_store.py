@@ -0,0 +1,104 @@
+import logging
+from psycopg2.extras import execute_values
+from web3 import Web3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class FactKeyStore:
+    """
+    mapping实际出现过的key，保存在fact_keys表中，每个key记录第一次出现的区块，
+    一层mapping的key2为空字符串
+    """
+
+    def __init__(self, get_connection):
+        """
+        Args:
+            get_connection: 返回当前数据库连接的函数
+        """
+        self.get_connection = get_connection
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS fact_keys (
+                entity VARCHAR(128) NOT NULL,
+                key1 TEXT NOT NULL,
+                key2 TEXT NOT NULL DEFAULT '',
+                first_seen_block BIGINT,
+                PRIMARY KEY (entity, key1, key2)
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_fact_keys_first_seen ON fact_keys(entity, first_seen_block)")
+
+    def add_keys(self, cursor, keys):
+        """
+        写入key，已有的key保留较早的first_seen_block，不提交事务
+        Args:
+            cursor: 数据库游标
+            keys: entity名 -> {key: first_seen_block}，两层mapping的key为(key1, key2)，区块未知时为None
+        Returns:
+            int: 写入的key数
+        """
+        rows = []
+        for entity_name, entity_keys in keys.items():
+            for key, block_number in entity_keys.items():
+                if isinstance(key, (tuple, list)):
+                    rows.append((entity_name, self.key_to_text(key[0]), self.key_to_text(key[1]), block_number))
+                else:
+                    rows.append((entity_name, self.key_to_text(key), "", block_number))
+        if not rows:
+            return 0
+        execute_values(cursor, """
+            INSERT INTO fact_keys (entity, key1, key2, first_seen_block) VALUES %s
+            ON CONFLICT (entity, key1, key2) DO UPDATE SET
+                first_seen_block = LEAST(fact_keys.first_seen_block, EXCLUDED.first_seen_block)
+        """, rows, page_size=5000)
+        return len(rows)
+
+    def load(self, key_types):
+        """
+        读取所有key
+        Args:
+            key_types: entity名 -> 每层key的类型列表，用于把文本还原为原来的类型
+        Returns:
+            dict: entity名 -> key集合，两层mapping的key为(key1, key2)
+        """
+        fact_keys = {}
+        with self.get_connection().cursor() as cursor:
+            cursor.execute("SELECT entity, key1, key2 FROM fact_keys")
+            for entity_name, key1, key2 in cursor:
+                if entity_name not in key_types:
+                    continue # meta.json中已经没有该entity
+                types = key_types[entity_name]
+                if len(types) > 1:
+                    key = (self.key_from_text(key1, types[0]), self.key_from_text(key2, types[1]))
+                else:
+                    key = self.key_from_text(key1, types[0])
+                fact_keys.setdefault(entity_name, set()).add(key)
+        return fact_keys
+
+    def count(self):
+        with self.get_connection().cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM fact_keys")
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def key_to_text(key):
+        if isinstance(key, bytes):
+            return "0x" + key.hex()
+        if isinstance(key, str) and Web3.is_address(key):
+            # 交易的from_address是小写，解码出的参数是checksum格式，统一之后同一个地址只保存一次
+            return Web3.to_checksum_address(key)
+        return str(key)
+
+    @staticmethod
+    def key_from_text(text, key_type):
+        if "int" in key_type:
+            return int(text)
+        if key_type.startswith("bytes"):
+            return bytes.fromhex(text[2:])
+        if key_type == "bool":
+            return text == "True"
+        return text
@@ -0,0 +1,78 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class FairScheduler:
+    """
+    多个合约的流水线共享有限的并发数（阻塞的RPC、Etherscan和数据库调用），按stride调度：
+    每次申请时合约的pass增加1/weight，有空闲时执行pass最小的等待者。
+    weight随落后链头的区块数对数增长，落后多的合约得到更多的份额，已经追上链头的合约也不会被饿死
+    """
+
+    def __init__(self, max_concurrency):
+        """
+        Args:
+            max_concurrency: 同时执行的阻塞调用数
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.running = 0
+        self.waiters = [] # (pass, 序号, 合约名, future)的最小堆
+        self.passes = {} # 合约名 -> 下一次申请的起始pass
+        self.virtual_time = 0.0 # 最近一次执行的pass，空闲之后重新申请的合约从这里开始，不能积累份额
+        self.counter = itertools.count()
+        self.granted = {} # 合约名 -> 已经执行的次数
+
+    @staticmethod
+    def get_weight(backlog):
+        return 1 + math.log2(1 + max(backlog or 0, 0))
+
+    async def run(self, name, backlog, func, *args):
+        """
+        轮到该合约时在线程中执行func
+        Args:
+            name: 合约名
+            backlog: 合约落后链头的区块数
+        """
+        await self.acquire(name, backlog)
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self.release()
+
+    async def acquire(self, name, backlog):
+        start = max(self.passes.get(name, 0.0), self.virtual_time)
+        self.passes[name] = start + 1 / self.get_weight(backlog)
+        if self.running < self.max_concurrency and not self.waiters:
+            self._grant(name, start)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (start, next(self.counter), name, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled(): # 已经轮到但是还没有执行
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self):
+        self.running -= 1
+        while self.waiters:
+            start, _, name, future = heapq.heappop(self.waiters)
+            if future.cancelled():
+                continue
+            self._grant(name, start)
+            future.set_result(None)
+            break
+
+    def _grant(self, name, start):
+        self.running += 1
+        self.virtual_time = max(self.virtual_time, start)
+        self.granted[name] = self.granted.get(name, 0) + 1
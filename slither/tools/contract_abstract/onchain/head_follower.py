@@ -0,0 +1,118 @@
+import logging
+import time
+from collections import deque
+from web3.exceptions import BlockNotFound
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class HeadFollower:
+    """
+    通过RPC节点跟踪链头，用环形缓冲区记录最近revert_threshold个区块的hash，
+    缓冲区中的区块hash和链上不一致时说明发生了重组，找到最近的共同祖先，
+    由调用者回滚祖先之后的数据再重新处理
+    """
+
+    def __init__(self, w3, revert_threshold=12, poll_interval=2.0):
+        """
+        Args:
+            w3: Web3实例
+            revert_threshold: 能处理的最大重组深度
+            poll_interval: 没有新区块时等待的秒数
+        """
+        self.w3 = w3
+        self.revert_threshold = revert_threshold
+        self.poll_interval = poll_interval
+        self.blocks = deque(maxlen=revert_threshold + 1) # (block_number, block_hash)，按区块号升序
+
+    def get_block_hash(self, block_number):
+        """链上该高度的区块hash，链还没有这么高时返回None"""
+        try:
+            return self.w3.to_hex(self.w3.eth.get_block(block_number)["hash"])
+        except BlockNotFound:
+            return None
+
+    def start(self, block_number, known_hashes=None):
+        """
+        从已经处理到的区块开始跟踪，检查已经保存的数据对应的区块是否仍然在链上
+        Args:
+            block_number: 已经处理到的区块号
+            known_hashes: 已经保存的数据中最近区块的{block_number: block_hash}，比如交易表中的block_hash
+        Returns:
+            int: 保存的数据已经被重组时返回共同祖先的区块号，调用者需要回滚到该区块，否则返回None
+        """
+        self.blocks.clear()
+        lowest = block_number - self.revert_threshold
+        for number, block_hash in sorted((known_hashes or {}).items()):
+            if lowest <= number <= block_number:
+                self.blocks.append((number, block_hash))
+        if not self.blocks or self.blocks[-1][0] != block_number:
+            self.blocks.append((block_number, self.get_block_hash(block_number)))
+        if all(self.get_block_hash(number) == block_hash for number, block_hash in self.blocks):
+            return None
+        return self._rewind()
+
+    def poll(self):
+        """
+        检查一次链头
+        Returns:
+            tuple: ("reorg", 共同祖先区块号)、("advance", 起始区块号, 最新区块号)，没有变化时返回None
+        """
+        tip_number, tip_hash = self.blocks[-1]
+        if self.get_block_hash(tip_number) != tip_hash:
+            return "reorg", self._rewind()
+
+        latest = self.w3.eth.block_number
+        if latest <= tip_number:
+            return None
+        # 只需要记录最近revert_threshold个区块，更早的区块不会再被重组
+        for number in range(max(tip_number + 1, latest - self.revert_threshold), latest + 1):
+            block = self.w3.eth.get_block(number)
+            previous_number, previous_hash = self.blocks[-1]
+            if previous_number == number - 1 and self.w3.to_hex(block["parentHash"]) != previous_hash:
+                # 获取新区块的过程中发生了重组
+                return "reorg", self._rewind()
+            self.blocks.append((number, self.w3.to_hex(block["hash"])))
+        return "advance", tip_number + 1, latest
+
+    def follow(self):
+        """
+        持续跟踪链头
+        Yields:
+            tuple: 同poll的返回值
+        """
+        while True:
+            event = self.poll()
+            if event is None:
+                time.sleep(self.poll_interval)
+                continue
+            yield event
+
+    def is_canonical(self, block_number, block_hash):
+        """缓冲区中有该区块时检查hash是否一致，更早的区块以及没有hash的数据（比如内部交易）认为已经确定"""
+        if block_hash is None:
+            return True
+        for number, known_hash in self.blocks:
+            if number == block_number:
+                return known_hash == block_hash
+        return True
+
+    def _rewind(self):
+        """
+        找到缓冲区中第一个hash不一致的区块，共同祖先是它之前最近的一致的区块，丢弃祖先之后的记录
+        Returns:
+            int: 共同祖先的区块号
+        """
+        ancestor = None
+        for number, block_hash in list(self.blocks):
+            if self.get_block_hash(number) != block_hash:
+                break
+            ancestor = (number, block_hash)
+        if ancestor is None:
+            raise Exception(f"重组深度超过revert_threshold ({self.revert_threshold})，"
+                            f"区块 {self.blocks[0][0]} 已经不在链上")
+        while self.blocks[-1][0] > ancestor[0]:
+            self.blocks.pop()
+        logger.warning(f"检测到重组，共同祖先为区块 {ancestor[0]} ({ancestor[1]})")
+        return ancestor[0]
@@ -0,0 +1,215 @@
+import logging
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class HistoryStore:
+    """
+    storage表的历史版本，每个表对应一个只追加的{表名}__history表：
+    行的每个版本记录valid_from_block和valid_to_block（不包含，NULL表示当前版本），
+    由BufferedTableWriter在写入当前表的同一个事务中维护，值没有变化的重写不产生新版本。
+    区块号随写入单调增长，因此两个区块列使用BRIN索引，主键(主键..., valid_from_block)用于查询单行的历史
+    """
+
+    suffix = "__history"
+    version_columns = ["valid_from_block", "valid_to_block"]
+
+    def __init__(self, get_connection, catalog, watermark, retain_blocks=None, compact_interval=1000):
+        """
+        Args:
+            get_connection: 返回当前数据库连接的函数
+            catalog: TableCatalog，提供当前表的列、类型和缓存的SQL语句
+            watermark: SyncWatermark，记录历史已经压缩到的区块和每个表历史开始的区块
+            retain_blocks: 保留最近多少个区块的完整历史，None表示不压缩
+            compact_interval: 每写入多少个区块压缩一次
+        """
+        self.get_connection = get_connection
+        self.catalog = catalog
+        self.watermark = watermark
+        self.retain_blocks = retain_blocks
+        self.compact_interval = compact_interval
+        self.watermark_name = "history_compacted"
+        self.started_watermark_prefix = "history_started:"
+        self.tables = {} # 表名 -> {"primary_keys": [...], "data_columns": [...]}
+        self.compacted_block = None
+        self.started_blocks = {} # 表名 -> 历史开始的区块，None表示历史从表的第一行开始
+
+    @classmethod
+    def get_history_table(cls, table_name):
+        return table_name + cls.suffix
+
+    def create_table(self, cursor, table_name, attributes, primary_keys, snapshot_columns):
+        """
+        创建表的历史表，不提交事务。已经同步过的表开启历史时，当前表的行复制为历史表中打开的版本，
+        历史从这些行中最新的区块开始，之前区块的状态不完整
+        Args:
+            attributes: 当前表的(列名, 类型)列表
+            primary_keys: 当前表的主键
+            snapshot_columns: 记录区块的列，只有这些列变化时不产生新版本
+        """
+        history_table = self.get_history_table(table_name)
+        cursor.execute("SELECT to_regclass(%s)", (history_table,))
+        created = cursor.fetchone()[0] is None
+        columns = [f"{attribute[0]} {attribute[1]}" for attribute in attributes]
+        columns += [f"{self.version_columns[0]} BIGINT NOT NULL", f"{self.version_columns[1]} BIGINT"]
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {history_table} (
+                {', '.join(columns)},
+                PRIMARY KEY ({', '.join(primary_keys + self.version_columns[:1])})
+            )
+        """)
+        # 索引名放在前面，表名过长被截断时两个索引的名字也不会相同
+        for column in self.version_columns:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS brin_{column}_{history_table} ON {history_table} USING BRIN ({column})")
+        self.tables[table_name] = {
+            "primary_keys": list(primary_keys),
+            "data_columns": [attribute[0] for attribute in attributes
+                             if attribute[0] not in primary_keys and attribute[0] not in snapshot_columns]
+        }
+        if created:
+            self._copy_current_rows(cursor, table_name, [attribute[0] for attribute in attributes])
+
+    def _copy_current_rows(self, cursor, table_name, columns):
+        """当前表中的每一行从读取它的区块开始有效，没有记录区块的旧行从最新的区块开始"""
+        cursor.execute(f"SELECT count(*), max(block_number) FROM {table_name}")
+        row_count, started_block = cursor.fetchone()
+        if row_count == 0:
+            return
+        if started_block is None:
+            logger.warning(f"表 {table_name} 的行没有记录区块，无法复制到历史表，历史只包括之后的改变")
+            return
+        cursor.execute(
+            f"INSERT INTO {self.get_history_table(table_name)} ({', '.join(columns)}, valid_from_block, valid_to_block) "
+            f"SELECT {', '.join(columns)}, COALESCE(block_number, %s), NULL FROM {table_name}", (started_block,))
+        self.watermark.set(cursor, self.started_watermark_prefix + table_name, started_block)
+        self.started_blocks[table_name] = started_block
+        logger.info(f"表 {table_name} 开启历史: 复制 {row_count} 行，历史从区块 {started_block} 开始")
+
+    def is_versioned(self, table_name):
+        return table_name in self.tables
+
+    def record_versions(self, cursor, table_name, rows):
+        """
+        当前表的行写入之后记录新版本：关闭值发生变化的当前版本，从当前表复制整行作为新版本，
+        只有区块列的写入（比如推进simple_entities的区块）被忽略。
+        缓存合并了同一行的多次写入，因此一次写入中每行只记录最后的版本，增量同步每个区块单独提交，不受影响
+        Args:
+            rows: 本次写入当前表的行，需要包括block_number
+        Returns:
+            int: 记录的行数
+        """
+        table = self.tables.get(table_name)
+        if table is None:
+            return 0
+        keys = {}
+        for row in rows:
+            if row.get("block_number") is not None and any(column in row for column in table["data_columns"]):
+                keys[tuple(row[pk] for pk in table["primary_keys"])] = None
+        if not keys:
+            return 0
+
+        column_types = self.catalog.get_column_types(table_name)
+        # VALUES中的参数没有类型，需要转换成主键列的类型才能和表中的列比较
+        template = "(" + ", ".join(f"%s::{column_types[pk].split(' CHECK')[0]}" for pk in table["primary_keys"]) + ")"
+        close_sql = self.catalog.get_statement(table_name, ("history_close",), lambda: self._build_close_sql(table_name))
+        insert_sql = self.catalog.get_statement(table_name, ("history_insert",), lambda: self._build_insert_sql(table_name))
+        execute_values(cursor, close_sql, list(keys), template=template)
+        execute_values(cursor, insert_sql, list(keys), template=template)
+        return len(keys)
+
+    def _build_close_sql(self, table_name):
+        table = self.tables[table_name]
+        primary_keys = table["primary_keys"]
+        data_columns = table["data_columns"]
+        return (
+            f"UPDATE {self.get_history_table(table_name)} AS h SET valid_to_block = t.block_number "
+            f"FROM {table_name} AS t JOIN (VALUES %s) AS c ({', '.join(primary_keys)}) "
+            f"ON {' AND '.join(f't.{pk} = c.{pk}' for pk in primary_keys)} "
+            f"WHERE {' AND '.join(f'h.{pk} = t.{pk}' for pk in primary_keys)} "
+            f"AND h.valid_to_block IS NULL AND h.valid_from_block < t.block_number "
+            f"AND ROW({', '.join('h.' + column for column in data_columns)}) "
+            f"IS DISTINCT FROM ROW({', '.join('t.' + column for column in data_columns)})"
+        )
+
+    def _build_insert_sql(self, table_name):
+        table = self.tables[table_name]
+        primary_keys = table["primary_keys"]
+        columns = self.catalog.get_columns(table_name)
+        update_columns = [column for column in columns if column not in primary_keys]
+        history_table = self.get_history_table(table_name)
+        # 值没有变化时当前版本仍然打开，不插入新版本；同一个区块重写时覆盖该区块的版本
+        return (
+            f"INSERT INTO {history_table} ({', '.join(columns)}, valid_from_block, valid_to_block) "
+            f"SELECT {', '.join('t.' + column for column in columns)}, t.block_number, NULL "
+            f"FROM {table_name} AS t JOIN (VALUES %s) AS c ({', '.join(primary_keys)}) "
+            f"ON {' AND '.join(f't.{pk} = c.{pk}' for pk in primary_keys)} "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {history_table} AS h "
+            f"WHERE {' AND '.join(f'h.{pk} = t.{pk}' for pk in primary_keys)} "
+            f"AND h.valid_to_block IS NULL AND h.valid_from_block <> t.block_number) "
+            f"ON CONFLICT ({', '.join(primary_keys)}, valid_from_block) DO UPDATE SET "
+            + ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns + ["valid_to_block"])
+        )
+
+    def rollback(self, cursor, block_number):
+        """重组之后删除祖先区块之后的版本，重新打开在祖先区块之后关闭的版本，不提交事务"""
+        for table_name in self.tables:
+            history_table = self.get_history_table(table_name)
+            cursor.execute(f"DELETE FROM {history_table} WHERE valid_from_block > %s", (block_number,))
+            cursor.execute(f"UPDATE {history_table} SET valid_to_block = NULL WHERE valid_to_block > %s", (block_number,))
+
+    def get_compacted_block(self):
+        """
+        Returns:
+            int: 历史已经压缩到的区块，之前区块的状态不再完整，没有压缩过时返回None
+        """
+        if self.compacted_block is None:
+            watermark = self.watermark.get(self.watermark_name)
+            self.compacted_block = watermark[0] if watermark is not None else None
+        return self.compacted_block
+
+    def get_started_block(self, table_name):
+        """
+        Returns:
+            int: 表的历史开始的区块，之前区块的状态不完整，历史从表的第一行开始时返回None
+        """
+        if table_name not in self.started_blocks:
+            watermark = self.watermark.get(self.started_watermark_prefix + table_name)
+            self.started_blocks[table_name] = watermark[0] if watermark is not None else None
+        return self.started_blocks[table_name]
+
+    def check_readable(self, table_name, block_number):
+        started_block = self.get_started_block(table_name)
+        if started_block is not None and block_number < started_block:
+            raise Exception(f"表 {table_name} 的历史从区块 {started_block} 开始记录，无法查询区块 {block_number} 的状态")
+        compacted_block = self.get_compacted_block()
+        if compacted_block is not None and block_number < compacted_block:
+            raise Exception(f"区块 {block_number} 的历史已经被压缩，只能查询区块 {compacted_block} 之后的状态")
+
+    def compact(self, cursor, before_block):
+        """
+        删除在before_block或之前结束的版本，before_block及之后每个区块的状态仍然完整，不提交事务
+        Returns:
+            int: 删除的版本数
+        """
+        if self.get_compacted_block() is not None and before_block <= self.compacted_block:
+            return 0
+        deleted = 0
+        for table_name in self.tables:
+            cursor.execute(f"DELETE FROM {self.get_history_table(table_name)} WHERE valid_to_block <= %s", (before_block,))
+            deleted += cursor.rowcount
+        self.watermark.set(cursor, self.watermark_name, before_block)
+        self.compacted_block = before_block
+        logger.info(f"历史表压缩到区块 {before_block}: 删除 {deleted} 个版本")
+        return deleted
+
+    def compact_if_due(self, cursor, block_number):
+        """写入区块之后调用，距离上次压缩超过compact_interval个区块时压缩到block_number - retain_blocks"""
+        if self.retain_blocks is None:
+            return 0
+        before_block = block_number - self.retain_blocks
+        compacted_block = self.get_compacted_block()
+        if before_block <= 0 or (compacted_block is not None and before_block - compacted_block < self.compact_interval):
+            return 0
+        return self.compact(cursor, before_block)
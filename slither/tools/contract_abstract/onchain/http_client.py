@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from typing import Any, Dict
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class MeteredSession(requests.Session):
+    """
+    带连接池、超时和重试策略的requests.Session，记录每个endpoint的请求延迟和错误数，
+    Etherscan和RPC请求共用，避免每次请求都重新建立TCP/TLS连接
+    """
+
+    def __init__(self, pool_size=20, max_retries=3, backoff_factor=0.5, timeout=30):
+        """
+        Args:
+            pool_size: 每个host保持的连接数
+            max_retries: 连接错误以及429/5xx响应的重试次数
+            backoff_factor: 重试的退避系数，第n次重试前等待backoff_factor * 2^(n-1)秒
+            timeout: 没有指定timeout的请求使用的超时秒数
+        """
+        super().__init__()
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None, # JSON-RPC的读请求也是POST，同样可以重试
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.timeout = timeout
+        self.metrics = {} # endpoint -> {"requests", "errors", "total_latency", "max_latency"}
+        self.metrics_lock = threading.Lock()
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = self.endpoint_name(url)
+        start = time.perf_counter()
+        try:
+            resp = super().request(method, url, *args, **kwargs)
+        except Exception:
+            self._record(endpoint, time.perf_counter() - start, True)
+            raise
+        self._record(endpoint, time.perf_counter() - start, resp.status_code >= 400)
+        return resp
+
+    @staticmethod
+    def endpoint_name(url):
+        """endpoint只保留scheme和host，Infura、Alchemy等把API key放在path中，query和用户信息中也可能有密钥"""
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        if parts.port is not None:
+            host = f"{host}:{parts.port}"
+        return f"{parts.scheme}://{host}"
+
+    def _record(self, endpoint, latency, error):
+        with self.metrics_lock:
+            metric = self.metrics.setdefault(endpoint, {"requests": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0})
+            metric["requests"] += 1
+            metric["errors"] += 1 if error else 0
+            metric["total_latency"] += latency
+            metric["max_latency"] = max(metric["max_latency"], latency)
+
+    def get_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns:
+            Dict[str, Dict]: endpoint -> {"requests", "errors", "avg_latency", "max_latency"}，延迟单位为秒
+        """
+        with self.metrics_lock:
+            return {
+                endpoint: {
+                    "requests": metric["requests"],
+                    "errors": metric["errors"],
+                    "avg_latency": metric["total_latency"] / metric["requests"],
+                    "max_latency": metric["max_latency"]
+                }
+                for endpoint, metric in self.metrics.items()
+            }
+
+    def log_metrics(self):
+        for endpoint, metric in self.get_metrics().items():
+            logger.info(f"{endpoint}: 请求 {metric['requests']} 次，错误 {metric['errors']} 次，"
+                        f"平均延迟 {metric['avg_latency'] * 1000:.1f}ms，最大延迟 {metric['max_latency'] * 1000:.1f}ms")
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def configure_http_client(**kwargs) -> MeteredSession:
+    """使用指定参数重新创建进程内共享的HTTP客户端，参数同MeteredSession"""
+    global _http_client
+    with _http_client_lock:
+        _http_client = MeteredSession(**kwargs)
+        return _http_client
+
+
+def get_http_client() -> MeteredSession:
+    """获取进程内共享的HTTP客户端，第一次调用时使用默认参数创建"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = MeteredSession()
+        return _http_client
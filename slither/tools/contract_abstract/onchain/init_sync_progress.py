@@ -0,0 +1,68 @@
+import logging
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class InitSyncProgress:
+    """
+    初始同步的进度，保存在init_sync_progress表中。初始同步按entity切分为多个分区，
+    大的mapping再按key的哈希分桶，每个分区完成时和它的行在同一个事务中标记完成，
+    分区之间没有顺序，重启之后只处理没有完成的分区
+    """
+
+    def __init__(self, get_connection):
+        """
+        Args:
+            get_connection: 返回当前数据库连接的函数
+        """
+        self.get_connection = get_connection
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS init_sync_progress (
+                unit VARCHAR(128) NOT NULL,
+                part INTEGER NOT NULL,
+                parts INTEGER NOT NULL,
+                block_number BIGINT NOT NULL,
+                row_count INTEGER,
+                completed_at TIMESTAMP,
+                PRIMARY KEY (unit, part)
+            )
+        """)
+
+    def load(self, block_number):
+        """
+        Returns:
+            dict: (unit, part) -> {"parts": 分区数, "completed": 是否完成}，只包含该快照区块的记录
+        """
+        with self.get_connection().cursor() as cursor:
+            cursor.execute("SELECT unit, part, parts, completed_at FROM init_sync_progress WHERE block_number = %s", (block_number,))
+            return {(unit, part): {"parts": parts, "completed": completed_at is not None}
+                    for unit, part, parts, completed_at in cursor.fetchall()}
+
+    def register(self, cursor, block_number, parts):
+        """
+        登记分区，已经登记的分区不变，不提交事务
+        Args:
+            parts: [(unit, part, parts)]
+        """
+        if not parts:
+            return
+        execute_values(cursor, """
+            INSERT INTO init_sync_progress (unit, part, parts, block_number) VALUES %s
+            ON CONFLICT (unit, part) DO NOTHING
+        """, [(unit, part, count, block_number) for unit, part, count in parts])
+
+    def complete(self, cursor, unit, part, row_count):
+        """标记分区完成，不提交事务，由调用者和分区的行一起提交"""
+        cursor.execute("""
+            UPDATE init_sync_progress SET row_count = %s, completed_at = CURRENT_TIMESTAMP
+            WHERE unit = %s AND part = %s
+        """, (row_count, unit, part))
+
+    def clear(self, cursor):
+        """换新的快照区块时清空之前的进度，不提交事务"""
+        cursor.execute("DELETE FROM init_sync_progress")
@@ -0,0 +1,153 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import psycopg2
+from slither.tools.contract_abstract.onchain.abi_decoder import AbiDecoder
+from slither.tools.contract_abstract.onchain.transaction_info import iter_transaction_pages
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 每个进程按ABI缓存一个解码器，同一进程处理多个分区时不需要重新解析ABI
+_decoders = {}
+
+
+def collect_fact_keys(entity_keys, params, tx, fact_keys):
+    """
+    根据一个交易的参数得到实际的key，第一次出现的区块记录在fact_keys中
+    Args:
+        entity_keys: 该交易method_id对应的{entity名: key参数名的集合}，两层mapping为(参数名, 参数名)
+        params: 交易解码出的参数
+        tx: 交易数据
+        fact_keys: 输出，entity名 -> {key: first_seen_block}
+    """
+    def index_values(index):
+        if index == "$msg_sender":
+            return [tx["from_address"]]
+        if index not in params:
+            raise Exception(f"{index} not found in params for function {tx['method_id']}")
+        return params[index] if isinstance(params[index], list) else [params[index]]
+
+    for entity_name, indexes in entity_keys.items():
+        keys = fact_keys.setdefault(entity_name, {})
+        for index in indexes:
+            if isinstance(index, tuple):
+                values = itertools.product(index_values(index[0]), index_values(index[1]))
+            else:
+                values = index_values(index)
+            for key in values:
+                keys.setdefault(key, tx["block_number"])
+
+
+def merge_fact_keys(fact_keys, other):
+    """合并两个分区的结果，同一个key保留较早的区块"""
+    for entity_name, keys in other.items():
+        merged = fact_keys.setdefault(entity_name, {})
+        for key, block_number in keys.items():
+            if key not in merged or block_number < merged[key]:
+                merged[key] = block_number
+    return fact_keys
+
+
+def discover_keys_in_range(db_config, table_name, abi, all_keys, start_block, end_block, page_size=10000):
+    """
+    扫描一个区块范围内的交易，使用自己的数据库连接，可以在子进程中运行
+    Args:
+        db_config: 交易数据库配置
+        table_name: 交易表名
+        abi: 合约ABI
+        all_keys: method_id -> {entity名: key参数名的集合}
+        start_block: 起始区块号
+        end_block: 结束区块号
+    Returns:
+        tuple: (start_block, end_block, entity名 -> {key: first_seen_block}, 扫描的交易数)
+    """
+    abi_key = abi if isinstance(abi, str) else repr(abi)
+    if abi_key not in _decoders:
+        _decoders[abi_key] = AbiDecoder(abi)
+    decoder = _decoders[abi_key]
+
+    fact_keys = {}
+    scanned = 0
+    connection = psycopg2.connect(**db_config)
+    try:
+        for transactions in iter_transaction_pages(connection, table_name, start_block, end_block, page_size=page_size):
+            scanned += len(transactions)
+            # 只解码会写mapping的函数，按method_id分组批量解码
+            transactions = [tx for tx in transactions if tx["is_error"] == 0 and tx["method_id"] in all_keys]
+            for tx, (func_name, params) in zip(transactions, decoder.decode_many(transactions)):
+                if func_name is not None:
+                    collect_fact_keys(all_keys[tx["method_id"]], params, tx, fact_keys)
+    finally:
+        connection.close()
+    return start_block, end_block, fact_keys, scanned
+
+
+def plan_partitions(connection, table_name, start_block, end_block, partitions):
+    """
+    按交易数把区块范围切分成大致相等的分区，交易集中的区块范围会被切得更细
+    Returns:
+        list: [(start_block, end_block)]，相邻分区不重叠
+    """
+    if partitions <= 1:
+        return [(start_block, end_block)]
+    fractions = [i / partitions for i in range(1, partitions)]
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT percentile_disc(%s::float8[]) WITHIN GROUP (ORDER BY block_number)
+            FROM {table_name} WHERE block_number BETWEEN %s AND %s
+        """, (fractions, start_block, end_block))
+        boundaries = cursor.fetchone()[0]
+    if not boundaries:
+        return [(start_block, end_block)]
+
+    ranges = []
+    current = start_block
+    for boundary in sorted(set(boundaries)):
+        if current <= boundary < end_block:
+            ranges.append((current, boundary))
+            current = boundary + 1
+    ranges.append((current, end_block))
+    return ranges
+
+
+def discover_fact_keys(db_config, table_name, abi, all_keys, start_block, end_block, workers=None,
+                       partitions_per_worker=4, page_size=10000):
+    """
+    把区块范围按交易数切分后在进程池中并行发现mapping的key，每个分区完成时输出进度
+    Args:
+        workers: 进程数，默认为CPU核数，为1时在当前进程中运行
+        partitions_per_worker: 每个进程平均分到的分区数，分区越多负载越均衡
+    Returns:
+        dict: entity名 -> {key: first_seen_block}
+    """
+    workers = workers or os.cpu_count() or 1
+    if not all_keys:
+        return {}
+    if workers <= 1:
+        return discover_keys_in_range(db_config, table_name, abi, all_keys, start_block, end_block, page_size)[2]
+
+    connection = psycopg2.connect(**db_config)
+    try:
+        ranges = plan_partitions(connection, table_name, start_block, end_block, workers * partitions_per_worker)
+    finally:
+        connection.close()
+    logger.info(f"并行发现key: 区块 {start_block} - {end_block}，{len(ranges)} 个分区，{workers} 个进程")
+
+    start_time = time.time()
+    fact_keys = {}
+    scanned_total = 0
+    # 调用者可能同时在线程中请求RPC（日志来源），fork会复制该线程持有的锁，使用spawn启动子进程
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(discover_keys_in_range, db_config, table_name, abi, all_keys, start, end, page_size)
+                   for start, end in ranges]
+        for done, future in enumerate(as_completed(futures), 1):
+            start, end, partition_keys, scanned = future.result()
+            merge_fact_keys(fact_keys, partition_keys)
+            scanned_total += scanned
+            logger.info(f"分区 {done}/{len(ranges)} 完成: 区块 {start} - {end}，{scanned} 个交易，"
+                        f"累计 {scanned_total} 个交易，耗时 {time.time() - start_time:.1f}s")
+    return fact_keys
@@ -0,0 +1,266 @@
+import logging
+import time
+import requests
+from eth_abi import decode
+from eth_utils import keccak
+from web3 import Web3
+from slither.tools.contract_abstract.onchain.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# 节点因为区块范围或者结果数过大拒绝eth_getLogs时，错误信息中常见的词，只有这些错误才缩小窗口
+LOG_RANGE_ERRORS = ["more than", "block range", "too many results", "max results", "response size", "range is too large",
+                    "range too large", "limited to a"]
+# 限流时错误信息中常见的词，同一个窗口退避之后重试
+RATE_LIMIT_ERRORS = ["rate limit", "request count", "too many requests", "capacity", "throughput"]
+
+
+def canonical_type(item):
+    """ABI参数的规范类型，tuple展开为(type,...)"""
+    if item["type"].startswith("tuple"):
+        return "(" + ",".join(canonical_type(component) for component in item["components"]) + ")" + item["type"][len("tuple"):]
+    return item["type"]
+
+
+def event_signature(event):
+    return f"{event['name']}({','.join(canonical_type(item) for item in event['inputs'])})"
+
+
+def build_event_key_map(function_events, key_templates, abi):
+    """
+    根据ContractWalker记录的function_events，把写mapping的key参数对应到emit的事件参数上
+    Args:
+        function_events: function签名 -> [{"event": 事件签名, "arguments": 每个参数来自的function参数}]
+        key_templates: StorageInfo.get_key_templates的返回值，method_id -> {entity名: key参数名的集合}
+        abi: 合约ABI（list）
+    Returns:
+        dict: topic0 -> {"event": ABI中的event, "keys": {entity名: 参数位置的集合，两层mapping为(位置, 位置)}}
+    """
+    abi_events = [item for item in abi if item.get("type") == "event" and not item.get("anonymous")]
+    event_map = {}
+    for function_signature, events in function_events.items():
+        method_id = "0x" + keccak(text=function_signature)[:4].hex()
+        entity_keys = key_templates.get(method_id)
+        if not entity_keys:
+            continue
+        for record in events:
+            abi_event = find_abi_event(abi_events, record["event"], len(record["arguments"]))
+            if abi_event is None:
+                logger.warning(f"ABI中没有事件 {record['event']}")
+                continue
+            # 同一个参数可能出现在多个位置，任取一个即可
+            positions = {}
+            for position, source in enumerate(record["arguments"]):
+                if source is not None:
+                    positions.setdefault(source, position)
+            for entity_name, indexes in entity_keys.items():
+                for index in indexes:
+                    if isinstance(index, tuple):
+                        if index[0] not in positions or index[1] not in positions:
+                            continue
+                        key_position = (positions[index[0]], positions[index[1]])
+                    elif index in positions:
+                        key_position = positions[index]
+                    else:
+                        continue
+                    topic = "0x" + keccak(text=event_signature(abi_event)).hex()
+                    entry = event_map.setdefault(topic, {"event": abi_event, "keys": {}})
+                    entry["keys"].setdefault(entity_name, set()).add(key_position)
+    return event_map
+
+
+def find_abi_event(abi_events, signature, argument_count):
+    """先按签名精确匹配，struct等类型在slither中的写法和ABI不同，再按名字和参数个数匹配"""
+    for event in abi_events:
+        if event_signature(event) == signature:
+            return event
+    name = signature.split("(")[0]
+    candidates = [event for event in abi_events if event["name"] == name and len(event["inputs"]) == argument_count]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def decode_log(event, log):
+    """
+    解码日志的参数，indexed的动态类型只有哈希，解码为None
+    Returns:
+        list: 按event参数顺序的值，地址为checksum格式
+    """
+    topics = log["topics"][1:]
+    data_types = [canonical_type(item) for item in event["inputs"] if not item.get("indexed")]
+    data = bytes.fromhex(log["data"][2:]) if log.get("data") else b""
+    data_values = iter(decode(data_types, data) if data_types else [])
+
+    values = []
+    topic_index = 0
+    for item in event["inputs"]:
+        if item.get("indexed"):
+            topic = bytes.fromhex(topics[topic_index][2:])
+            topic_index += 1
+            if item["type"] in ["string", "bytes"] or item["type"].endswith("]") or item["type"].startswith("tuple"):
+                values.append(None)
+                continue
+            value = decode([item["type"]], topic)[0]
+        else:
+            value = next(data_values)
+        if item["type"] == "address":
+            value = Web3.to_checksum_address(value)
+        values.append(value)
+    return values
+
+
+class LogFetcher:
+    """
+    按区块窗口调用eth_getLogs，节点拒绝（区块范围或者结果数超过限制）时窗口减半，结果稀疏时窗口加倍，
+    但不会再超过被拒绝过的窗口；被限流时同一个窗口指数退避后重试
+    """
+
+    def __init__(self, rpc_url, address, initial_window=2000, min_window=1, max_window=100000,
+                 target_logs=5000, max_retries=3, timeout=60, http_client=None, rate_limit_retries=8, rate_limit_delay=1):
+        """
+        Args:
+            initial_window: 初始的区块窗口
+            target_logs: 一个窗口希望返回的日志数，少于一半时窗口加倍
+            rate_limit_retries: 同一个窗口被限流时最多重试的次数
+            rate_limit_delay: 被限流后第一次重试前等待的秒数，之后每次加倍
+        """
+        self.rpc_url = rpc_url
+        self.address = address
+        self.window = initial_window
+        self.min_window = min_window
+        self.max_window = max_window
+        self.target_logs = target_logs
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.http_client = http_client or get_http_client()
+        self.rate_limit_retries = rate_limit_retries
+        self.rate_limit_delay = rate_limit_delay
+
+    def iter_logs(self, start_block, end_block, topics):
+        """
+        Args:
+            topics: 需要的topic0列表
+        Yields:
+            list: 一个窗口中的日志，按区块顺序，被reorg移除的日志已经过滤
+        """
+        current = start_block
+        while current <= end_block:
+            window_end = min(current + self.window - 1, end_block)
+            logs = self.get_logs(current, window_end, topics)
+            if logs is None:
+                if self.window <= self.min_window:
+                    raise Exception(f"eth_getLogs在区块 {current} 上失败，窗口已经是最小值")
+                self.window = max(self.min_window, self.window // 2)
+                self.max_window = self.window
+                logger.info(f"eth_getLogs超过限制，窗口缩小为 {self.window} 个区块")
+                continue
+            yield [log for log in logs if not log.get("removed")]
+            current = window_end + 1
+            if len(logs) < self.target_logs // 2:
+                self.window = min(self.max_window, self.window * 2)
+
+    def get_logs(self, start_block, end_block, topics):
+        """
+        Returns:
+            list: 日志，节点因为范围或者结果过大拒绝时返回None，限流重试次数用完时抛出异常
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "eth_getLogs",
+            "params": [{"address": self.address, "fromBlock": hex(start_block), "toBlock": hex(end_block), "topics": [topics]}]
+        }
+
+        retry_delay = 1
+        rate_limit_delay = self.rate_limit_delay
+        attempt = 0
+        rate_limited = 0
+        while True:
+            try:
+                resp = self._post(payload)
+                if resp.status_code == 413:
+                    return None
+                if resp.status_code == 429:
+                    error = {"code": 429, "message": "too many requests"}
+                else:
+                    resp.raise_for_status()
+                    data = resp.json()
+                    if "error" not in data:
+                        return data["result"]
+                    error = data["error"]
+                    if self.is_range_error(error):
+                        return None
+                    if not self.is_rate_limit_error(error):
+                        raise Exception(f"eth_getLogs返回错误: {error}")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                attempt += 1
+                logger.error(f"eth_getLogs 区块 {start_block} - {end_block} 失败 (尝试 {attempt}/{self.max_retries}): {e}")
+                if attempt >= self.max_retries:
+                    raise Exception(f"eth_getLogs 区块 {start_block} - {end_block} 失败: {e}")
+                time.sleep(retry_delay)
+                retry_delay *= 2  # 指数退避
+                continue
+
+            # 被限流与窗口大小无关，不缩小窗口
+            rate_limited += 1
+            if rate_limited > self.rate_limit_retries:
+                raise Exception(f"eth_getLogs 区块 {start_block} - {end_block} 被限流，重试 {self.rate_limit_retries} 次后仍然失败: {error}")
+            logger.warning(f"eth_getLogs被限流，{rate_limit_delay}秒后重试 ({rate_limited}/{self.rate_limit_retries}): {error}")
+            time.sleep(rate_limit_delay)
+            rate_limit_delay *= 2
+
+    def _post(self, payload):
+        return self.http_client.post(self.rpc_url, json=payload, timeout=self.timeout)
+
+    @staticmethod
+    def is_range_error(error):
+        """区块范围或者结果数超过限制，-32005也用于限流，因此只根据错误信息判断"""
+        message = str(error.get("message", "")).lower()
+        return any(word in message for word in LOG_RANGE_ERRORS)
+
+    @staticmethod
+    def is_rate_limit_error(error):
+        """限流：HTTP 429、不是范围错误的-32005（Infura等的limit exceeded）或者错误信息中有限流的词"""
+        if error.get("code") in (429, -32005):
+            return True
+        message = str(error.get("message", "")).lower()
+        return any(word in message for word in RATE_LIMIT_ERRORS)
+
+
+def discover_keys_from_logs(fetcher, event_map, start_block, end_block):
+    """
+    从合约的事件日志中发现mapping的key，和从calldata发现的key格式相同
+    Args:
+        fetcher: LogFetcher
+        event_map: build_event_key_map的返回值
+    Returns:
+        dict: entity名 -> {key: first_seen_block}
+    """
+    fact_keys = {}
+    if not event_map:
+        return fact_keys
+    start_time = time.time()
+    log_count = 0
+    for logs in fetcher.iter_logs(start_block, end_block, sorted(event_map)):
+        for log in logs:
+            entry = event_map.get(log["topics"][0] if log["topics"] else None)
+            if entry is None:
+                continue
+            values = decode_log(entry["event"], log)
+            block_number = int(log["blockNumber"], 16)
+            for entity_name, positions in entry["keys"].items():
+                keys = fact_keys.setdefault(entity_name, {})
+                for position in positions:
+                    if isinstance(position, tuple):
+                        key = (values[position[0]], values[position[1]])
+                        if None in key:
+                            continue
+                    else:
+                        key = values[position]
+                        if key is None:
+                            continue
+                    if key not in keys or block_number < keys[key]:
+                        keys[key] = block_number
+        log_count += len(logs)
+    logger.info(f"从 {log_count} 条日志中发现key: 区块 {start_block} - {end_block}，耗时 {time.time() - start_time:.1f}s")
+    return fact_keys
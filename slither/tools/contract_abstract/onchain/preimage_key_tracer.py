@@ -0,0 +1,194 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from eth_abi import decode
+from eth_abi.exceptions import DecodingError
+from eth_utils import keccak
+from web3 import Web3
+from slither.tools.contract_abstract.onchain.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# structLogger需要memory才能读到SHA3的输入，storage的内容不需要
+STRUCT_LOGGER_OPTIONS = {"enableMemory": True, "disableStorage": True, "disableStack": False}
+SHA3_OPS = ["SHA3", "KECCAK256"]
+# 调用之后的代码在被调用合约的storage中执行
+CALL_OPS = ["CALL", "STATICCALL"]
+# 调用之后的代码仍然在当前合约的storage中执行
+DELEGATE_OPS = ["DELEGATECALL", "CALLCODE"]
+CREATE_OPS = ["CREATE", "CREATE2"]
+
+
+def get_mapping_slots(entities):
+    """
+    meta.json中顶层mapping的base slot
+    Returns:
+        dict: base slot -> (entity名, 每层key的类型列表)
+    """
+    mapping_slots = {}
+    for entity_name, entity in entities.items():
+        if entity["dataType"] != "mapping" or "storageInfo" not in entity:
+            continue
+        key_types = [entity["dataMeta"]["key"]["dataType"]]
+        if entity["dataMeta"]["value"]["dataType"] == "mapping":
+            key_types.append(entity["dataMeta"]["value"]["dataMeta"]["key"]["dataType"])
+        # string/bytes作为key时哈希的是不补齐的原始数据，不是abi.encode(key, slot)的形状
+        if any(key_type in ["string", "bytes"] for key_type in key_types):
+            continue
+        mapping_slots[entity["storageInfo"]["slot"]] = (entity_name, key_types)
+    return mapping_slots
+
+
+def decode_key(word, key_type):
+    """把32字节的哈希输入还原为key，地址为checksum格式，不是该类型的合法编码时返回None"""
+    try:
+        value = decode([key_type], word)[0]
+    except DecodingError:
+        return None # 其他用途的哈希碰巧以base slot结尾
+    if key_type == "address":
+        return Web3.to_checksum_address(value)
+    return value
+
+
+class PreimageKeyTracer:
+    """
+    在节点上用structLogger重放交易，记录合约storage上下文中所有64字节的SHA3输入，
+    输入为abi.encode(key, slot)且slot是已知mapping的base slot时得到mapping的key，
+    两层mapping的第二层slot是第一层的哈希结果。需要节点开启debug命名空间，一般在本地归档节点上运行
+    """
+
+    def __init__(self, rpc_url, address, entities, max_workers=4, max_retries=3, timeout=300, http_client=None):
+        """
+        Args:
+            rpc_url: 支持debug_traceTransaction的节点
+            address: 合约地址，代理合约时为代理地址
+            entities: meta.json中的entities
+            max_workers: 并行trace的交易数
+        """
+        self.rpc_url = rpc_url
+        self.address = address.lower()
+        self.mapping_slots = get_mapping_slots(entities)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.http_client = http_client or get_http_client()
+
+    def trace_transaction(self, tx_hash):
+        """
+        Returns:
+            list: structLogs
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "debug_traceTransaction",
+            "params": [tx_hash, STRUCT_LOGGER_OPTIONS]
+        }
+
+        retry_delay = 1
+        for attempt in range(self.max_retries):
+            try:
+                resp = self._post(payload)
+                resp.raise_for_status()
+                data = resp.json()
+                if "error" in data:
+                    raise Exception(f"debug_traceTransaction返回错误: {data['error']}")
+                return data["result"]["structLogs"]
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"trace交易 {tx_hash} 失败 (尝试 {attempt + 1}/{self.max_retries}): {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(retry_delay)
+                    retry_delay *= 2  # 指数退避
+                else:
+                    raise Exception(f"trace交易 {tx_hash} 失败: {e}")
+
+    def _post(self, payload):
+        return self.http_client.post(self.rpc_url, json=payload, timeout=self.timeout)
+
+    def get_sha3_inputs(self, struct_logs, to_address):
+        """
+        Args:
+            struct_logs: trace_transaction的返回值
+            to_address: 交易的to地址，第一层调用的storage上下文
+        Returns:
+            list: 在合约storage上下文中执行的64字节SHA3输入，按执行顺序
+        """
+        contexts = {1: to_address.lower() if to_address else None} # 调用深度 -> storage上下文的地址
+        inputs = []
+        for log in struct_logs:
+            depth = log["depth"]
+            op = log["op"]
+            stack = log.get("stack") or []
+            if op in SHA3_OPS and contexts.get(depth) == self.address:
+                offset, size = int(stack[-1], 16), int(stack[-2], 16)
+                if size == 64:
+                    memory = self.get_memory(log)
+                    inputs.append(memory[offset:offset + 64].ljust(64, b"\0"))
+            elif op in CALL_OPS:
+                contexts[depth + 1] = "0x" + int(stack[-2], 16).to_bytes(32, "big")[-20:].hex()
+            elif op in DELEGATE_OPS:
+                contexts[depth + 1] = contexts.get(depth)
+            elif op in CREATE_OPS:
+                contexts[depth + 1] = None
+        return inputs
+
+    @staticmethod
+    def get_memory(log):
+        """geth/anvil返回32字节一组的hex列表，有的客户端返回一个hex字符串"""
+        memory = log.get("memory") or []
+        if isinstance(memory, list):
+            memory = "".join(word[2:] if word.startswith("0x") else word for word in memory)
+        elif memory.startswith("0x"):
+            memory = memory[2:]
+        return bytes.fromhex(memory)
+
+    def match_keys(self, inputs):
+        """
+        Returns:
+            dict: entity名 -> key集合，两层mapping的key为(key1, key2)
+        """
+        keys = {}
+        outer_slots = {} # 两层mapping第一层的哈希结果 -> (entity名, key1, 第二层key的类型)
+        for data in inputs:
+            word, slot = data[:32], int.from_bytes(data[32:], "big")
+            if slot in self.mapping_slots:
+                entity_name, key_types = self.mapping_slots[slot]
+                key = decode_key(word, key_types[0])
+                if key is None:
+                    continue
+                if len(key_types) > 1:
+                    outer_slots[int.from_bytes(keccak(data), "big")] = (entity_name, key, key_types[1])
+                else:
+                    keys.setdefault(entity_name, set()).add(key)
+            elif slot in outer_slots:
+                entity_name, key1, key_type = outer_slots[slot]
+                key2 = decode_key(word, key_type)
+                if key2 is not None:
+                    keys.setdefault(entity_name, set()).add((key1, key2))
+        return keys
+
+    def get_transaction_keys(self, tx):
+        return self.match_keys(self.get_sha3_inputs(self.trace_transaction(tx["hash"]), tx["to_address"]))
+
+    def discover_keys(self, transactions):
+        """
+        并行trace交易并恢复mapping的key，失败的交易没有写storage，跳过
+        Args:
+            transactions: 交易列表
+        Returns:
+            dict: entity名 -> {key: first_seen_block}
+        """
+        fact_keys = {}
+        transactions = [tx for tx in transactions if tx["is_error"] == 0]
+        if not self.mapping_slots:
+            return fact_keys
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for tx, tx_keys in zip(transactions, executor.map(self.get_transaction_keys, transactions)):
+                for entity_name, keys in tx_keys.items():
+                    entity_keys = fact_keys.setdefault(entity_name, {})
+                    for key in keys:
+                        if key not in entity_keys or tx["block_number"] < entity_keys[key]:
+                            entity_keys[key] = tx["block_number"]
+        return fact_keys
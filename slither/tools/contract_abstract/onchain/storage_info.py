@@ -1,21 +1,43 @@
 import logging
-from slither.tools.contract_abstract.database_manager import DatabaseManager
+from slither.tools.contract_abstract.db_pool import get_pool
 import requests
-import psycopg2
 import time
 import re
 import math
 import copy
+import itertools
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from web3 import Web3
 from eth_abi import decode, encode
 from slither.tools.contract_abstract.onchain.storage_proof import StorageProof
 from eth_utils import keccak
 from slither.tools.contract_abstract.contract.entity import Entity
+from slither.tools.contract_abstract.onchain.batch_storage_reader import BatchStorageReader
+from slither.tools.contract_abstract.onchain.table_writer import BufferedTableWriter
+from slither.tools.contract_abstract.onchain.table_catalog import TableCatalog
+from slither.tools.contract_abstract.onchain.abi_decoder import AbiDecoder
+from slither.tools.contract_abstract.onchain.sync_watermark import SyncWatermark
+from slither.tools.contract_abstract.onchain.history_store import HistoryStore
+from slither.tools.contract_abstract.onchain.fact_key_store import FactKeyStore
+from slither.tools.contract_abstract.onchain.init_sync_progress import InitSyncProgress
+from slither.tools.contract_abstract.onchain.head_follower import HeadFollower
+from slither.tools.contract_abstract.onchain.key_discovery import discover_fact_keys, merge_fact_keys
+from slither.tools.contract_abstract.onchain.log_key_discovery import LogFetcher, build_event_key_map, discover_keys_from_logs
+from slither.tools.contract_abstract.onchain.preimage_key_tracer import PreimageKeyTracer
+from slither.tools.contract_abstract.onchain.trace_storage_reader import TraceStorageReader
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 class StorageInfo:
-    def __init__(self, meta_json, target_address, contract_info, db_config, transaction_info):
+    def __init__(self, meta_json, target_address, contract_info, db_config, transaction_info, rpc_batch_size=100, rpc_max_workers=4,
+                 write_batch_size=5000, write_flush_interval=5.0, replay_fetch_size=10000, sync_mode="template",
+                 key_discovery_workers=None, log_key_discovery=True, preimage_key_discovery=False,
+                 init_bucket_size=10000, init_workers=1, rpc_rate_limiter=None, history=False,
+                 history_retain_blocks=None, history_compact_interval=1000):
         self.contract_info = contract_info
         self.w3 = contract_info.w3
         self.address = target_address
@@ -23,85 +45,71 @@ class StorageInfo:
         self.db_config = db_config 
         self.db_connection = None
         self.meta_json = meta_json
-        self.entity = Entity(target_address, None, contract_info, meta_json["entities"])
+        self.batch_reader = BatchStorageReader(contract_info.rpc_url, target_address, batch_size=rpc_batch_size,
+                                               max_workers=rpc_max_workers, rate_limiter=rpc_rate_limiter)
+        self.entity = Entity(target_address, None, contract_info, meta_json["entities"], batch_reader=self.batch_reader)
         self.revert_threshold = 12
         self.abi = self.transaction_info.abi
+        self.abi_decoder = AbiDecoder(self.abi)
 
         self.simple_table_name = "simple_entities"
+        self.snapshot_columns = ["block_number", "block_hash"] # 记录storage快照区块的列
+        self.watermark_name = "storage" # 增量同步的水位线
+        self.fact_keys_watermark_name = "fact_keys" # mapping的key发现到的区块
+        self.init_snapshot_name = "init_snapshot" # 初始同步固定的区块，完成之前重启会继续使用该区块
+        self.init_bucket_size = init_bucket_size # 初始同步时mapping每个分区的key数
+        self.init_workers = init_workers # 初始同步时并行读取的分区数
+        self.key_discovery_workers = key_discovery_workers # 并行发现key的进程数，默认为CPU核数
+        self.log_key_discovery = log_key_discovery # 同时从事件日志中发现key，需要meta.json中有function_events
+        # 用structLogger重放交易，从SHA3的输入中恢复合约内部计算出的key，需要节点支持debug_traceTransaction
+        self.preimage_key_discovery = preimage_key_discovery
+        self.preimage_watermark_name = "fact_keys_preimage"
+        self.replay_fetch_size = replay_fetch_size
+        # template: 根据写storage的模板推断被改变的行并重新读取; trace: 通过debug trace得到被写的slot和值
+        if sync_mode not in ["template", "trace"]:
+            raise Exception(f"不支持的同步模式: {sync_mode}")
+        self.sync_mode = sync_mode
+        self.trace_reader = TraceStorageReader(contract_info.rpc_url, target_address) if sync_mode == "trace" else None
+        self.slot_index = None # trace模式下slot到表中行和列的反向索引
 
         self.storage_proof = StorageProof(0, self.address, self.w3)
         self.function_write_storage = {}
 
         self.deal_with_function_write_storage()
         
-        # 初始化数据库管理器并设置数据库环境
-        self.db_manager = DatabaseManager(self.db_config)
-        if not self.db_manager.setup_database():
-            raise Exception("数据库环境设置失败")
+        # 同一个数据库的连接池在进程内共享，第一次获取时检查数据库环境
+        self.db_pool = get_pool(self.db_config)
         
         self.connect_db()
+        # 表结构缓存，在create_init_tables时根据meta.json中的entities填充
+        self.table_catalog = TableCatalog(load_primary_keys=self._get_table_primary_keys)
+        self.watermark = SyncWatermark(lambda: self.db_connection)
+        # 每个storage表的历史版本保存在{表名}__history表中，压缩时至少保留可能被重组的区块
+        if history_retain_blocks is not None and history_retain_blocks < self.revert_threshold:
+            raise Exception(f"历史保留的区块数 {history_retain_blocks} 不能小于重组阈值 {self.revert_threshold}")
+        self.history_store = HistoryStore(lambda: self.db_connection, self.table_catalog, self.watermark,
+                                          retain_blocks=history_retain_blocks,
+                                          compact_interval=history_compact_interval) if history else None
+        self.table_writer = BufferedTableWriter(lambda: self.db_connection, self.table_catalog,
+                                                batch_size=write_batch_size, flush_interval=write_flush_interval,
+                                                history=self.history_store)
+        self.fact_key_store = FactKeyStore(lambda: self.db_connection)
+        self.init_progress = InitSyncProgress(lambda: self.db_connection)
         self.create_init_tables()
        
+        # mapping实际出现过的key保存在fact_keys表中，启动时只扫描上次之后的新交易
         self.fact_keys = None
-        if not self.import_fact_keys_from_json("output/fact_keys.json"):
-            self.get_all_keys_for_mapping()
-            self.export_fact_keys_to_json("output/fact_keys.json")
+        self.pending_fact_keys = {} # 重放中新出现的key，和该区块的行一起写入
+        self.migrate_fact_keys_from_json("output/fact_keys.json")
+        self.get_all_keys_for_mapping()
 
     def connect_db(self):
-        """连接到PostgreSQL数据库"""
-        max_retries = 3
-        retry_delay = 2
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"尝试连接Storage数据库: {self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}")
-                self.db_connection = psycopg2.connect(**self.db_config)
-                self.db_connection.autocommit = False
-                logger.info("成功连接到Storage数据库")
-                return
-            except psycopg2.OperationalError as e:
-                error_msg = str(e).lower()
-                logger.error(f"数据库连接失败 (尝试 {attempt + 1}/{max_retries}): {e}")
-                
-                if "database" in error_msg and "does not exist" in error_msg:
-                    # 尝试使用小写数据库名称连接
-                    original_db_name = self.db_config['database']
-                    lowercase_db_name = original_db_name.lower()
-                    
-                    if original_db_name != lowercase_db_name:
-                        logger.info(f"尝试使用小写数据库名称连接: {lowercase_db_name}")
-                        try:
-                            temp_config = self.db_config.copy()
-                            temp_config['database'] = lowercase_db_name
-                            self.db_connection = psycopg2.connect(**temp_config)
-                            self.db_connection.autocommit = False
-                            logger.info(f"成功连接到Storage数据库 (使用小写名称: {lowercase_db_name})")
-                            # 更新配置中的数据库名称为小写
-                            self.db_config['database'] = lowercase_db_name
-                            return
-                        except psycopg2.OperationalError as e2:
-                            logger.error(f"使用小写数据库名称连接也失败: {e2}")
-                    
-                    logger.error(f"数据库 {self.db_config['database']} 不存在")
-                    logger.info("请确保数据库已创建，或者检查数据库管理器是否正确运行")
-                    raise
-                elif "authentication failed" in error_msg:
-                    logger.error("数据库认证失败，请检查用户名和密码")
-                    raise
-                elif "connection refused" in error_msg:
-                    logger.error("无法连接到PostgreSQL服务，请确保服务正在运行")
-                    raise
-                elif attempt < max_retries - 1:
-                    logger.info(f"等待 {retry_delay} 秒后重试...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 指数退避
-                else:
-                    logger.error("数据库连接失败，已达到最大重试次数")
-                    raise
-            except Exception as e:
-                logger.error(f"数据库连接时发生未知错误: {e}")
-                raise
-    
+        """从进程内共享的连接池中取出一个连接，关闭时归还到连接池"""
+        self.db_connection = self.db_pool.getconn()
+        # 连接池可能使用了小写的数据库名称
+        self.db_config['database'] = self.db_pool.db_config['database']
+        logger.info(f"成功连接到Storage数据库: {self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}")
+
     def create_init_tables(self):
         """创建合约storage数据表"""
         entities = self.meta_json["entities"]
@@ -123,12 +131,19 @@ class StorageInfo:
         simple_attributes.append(("block_hash", "VARCHAR(66)")) # 用于记录当前storage状态是那个block的hash
         self.create_table(self.simple_table_name, simple_attributes, ["id"]) # 该id后续固定为1
 
+        with self.db_connection.cursor() as cursor:
+            SyncWatermark.create_tables(cursor)
+            FactKeyStore.create_tables(cursor)
+            InitSyncProgress.create_tables(cursor)
+        self.db_connection.commit()
+
     def create_table_for_mapping(self, table_name, entity):
         primary_keys = []
         attributes = []
         self._add_simple_attribute(entity["dataMeta"]["key"], "key1", attributes, "")
         primary_keys.append("key1")
         self._get_mapping_attributes(entity, attributes, primary_keys)
+        attributes.append(("block_number", "BIGINT")) # 用于记录该行是在哪个block读取的
         self.create_table(table_name, attributes, primary_keys)
 
     def create_table_for_array(self, table_name, entity, read=True):
@@ -137,16 +152,56 @@ class StorageInfo:
         attributes.append(("key1", "BIGINT"))
         primary_keys.append("key1")
         self._get_array_attributes(entity, attributes, primary_keys, read)
+        attributes.append(("block_number", "BIGINT")) # 用于记录该行是在哪个block读取的
         self.create_table(table_name, attributes, primary_keys)
 
     def sync_storage(self):
         latest_block = self.transaction_info.get_latest_block_number()
-        current_block = self.storage_proof.get_block_number()
-        contract_creation_block = self.transaction_info.get_contract_creation_block()
-        if contract_creation_block > current_block:
-            self.storage_proof.block_number = contract_creation_block - 1
+        if self.get_synced_block() is None:
+            # 还没有快照，先在一个固定区块上完成初始同步，之后从该区块开始增量同步
+            self.init_syn_storage(latest_block or None)
+        else:
+            self.check_reorg()
         self.sync_storage_to_block(latest_block)
 
+    def check_reorg(self):
+        """
+        检查storage水位线所在的区块是否仍然在链上，已经被重组时回滚revert_threshold个区块，
+        storage表只记录了水位线区块的hash，无法知道更早的区块对应的是哪个分叉
+        Returns:
+            int: 回滚到的区块号，没有重组时返回None
+        """
+        watermark = self.watermark.get(self.watermark_name)
+        if watermark is None or watermark[1] is None:
+            return None
+        if HeadFollower(self.w3).get_block_hash(watermark[0]) == watermark[1]:
+            return None
+        block_number = max(watermark[0] - self.revert_threshold, 0)
+        logger.warning(f"storage水位线区块 {watermark[0]} ({watermark[1]}) 已经被重组，回滚到区块 {block_number}")
+        self.rollback_to_block(block_number)
+        return block_number
+
+    def pin_block(self, block_number):
+        """将Entity和StorageProof的所有storage读取固定在同一个区块"""
+        self.entity.pin_block(block_number)
+        self.storage_proof.block_number = block_number
+
+    def get_synced_block(self):
+        """storage表已经同步到的区块号，优先使用水位线，旧的数据库没有水位线时使用快照区块"""
+        watermark = self.watermark.get(self.watermark_name)
+        if watermark is not None:
+            return watermark[0]
+        if self.watermark.get(self.init_snapshot_name) is not None:
+            return None # 初始同步还没有完成，表中只有部分分区的行
+        return self.get_snapshot_block()
+
+    def get_snapshot_block(self):
+        """获取当前storage表对应的区块号，没有快照时返回None"""
+        results = self.read_elements_from_table(self.simple_table_name, ["block_number"], {"id": 1})
+        if results and results[0]["block_number"] is not None:
+            return int(results[0]["block_number"])
+        return None
+
     def deal_with_function_write_storage(self):
         for function in self.meta_json["function_write_storage"]:
             parameters = self.meta_json["function_write_storage"][function]["parameters"]
@@ -158,71 +213,440 @@ class StorageInfo:
             for write_storage in write_storages:
                 parsed_expr = Entity.parse_expr(write_storage)
                 self.function_write_storage[hash_str]["write_storages"].append(parsed_expr)
+        # 这些函数写的行需要从storage表中读取index才能确定，规划时表中必须已经写入了上一个区块
+        self.table_dependent_methods = {method_id for method_id, function in self.function_write_storage.items()
+                                        if any(self._depends_on_table(write_expr, function["parameters"])
+                                               for write_expr in function["write_storages"])}
 
-    def sync_storage_to_block(self, block_number): # 一个交易一个交易的同步storage
-        changed_slots = set()
-        block = self.storage_proof.get_block_number()
-        while block <= block_number:
-            transactions = self.transaction_info.get_transactions_from_etherscan(block, block)
-            for tx in transactions:
-                if tx["input_data"] != "" and tx["input_data"] is not None and tx["input_data"] != "0x":
-                    func_name, params = self.decode_input(tx["input_data"])
-                    method_id = tx["method_id"]
-                    if method_id in self.function_write_storage:
-                        for write_storage_expr in self.function_write_storage[method_id]["write_storages"]:
-                            self.get_changed_slots(params, write_storage_expr, changed_slots)  
-                    else:
-                        logger.error(f"无法解析交易: {tx['hash']}, with input: {tx['input_data']}")
-        
-       
-    def init_syn_storage(self): # 最开始批量同步合约的storage，因为如果从第一个交易开始同步，存在大量请求的问题
-        for entity_name in self.meta_json["entities"]:
-            entity = self.meta_json["entities"][entity_name]
+    def _depends_on_table(self, write_expr, parameters):
+        """写storage模板的index是否是storage表达式，或者无法解析而需要枚举表中已有的key，和resolve_write_expr一致"""
+        entity = self.entity.storage_meta.get(write_expr["name"]) if isinstance(write_expr["name"], str) else None
+        if entity is None or entity["dataType"] not in ["mapping", "staticArray", "dynamicArray"]:
+            return False
+        depth = 2 if entity["dataType"] == "mapping" and entity["dataMeta"]["value"]["dataType"] == "mapping" else 1
+        node = write_expr
+        for _ in range(depth):
+            if node is None or node["index"] is None:
+                return entity["dataType"] == "mapping" # 数组整个重新读取，mapping要枚举表中的key
+            node = node["index"]
+            if isinstance(node["name"], dict) or node["name"] in self.entity.storage_meta:
+                return True
+            if node["name"] != "$msg_sender" and node["name"] not in parameters:
+                try:
+                    int(node["name"], 0)
+                except ValueError:
+                    return True
+        return False
+
+    def needs_table_state(self, transactions):
+        """区块中是否有交易写的行需要根据storage表的状态确定"""
+        return any(tx["is_error"] == 0 and tx["method_id"] in self.table_dependent_methods for tx in transactions)
+
+    def sync_storage_to_block(self, block_number):
+        """
+        按(block_number, transaction_index)顺序重放本地交易表中已有的交易，
+        每个区块根据写storage的模板得到被改变的行，在该区块上批量重新读取后写入，并推进水位线
+        Args:
+            block_number: 同步到的区块号
+        Returns:
+            int: 同步到的区块号
+        """
+        synced_block = self.get_synced_block()
+        if synced_block is None:
+            raise Exception("storage还没有初始同步")
+        if block_number <= synced_block:
+            return synced_block
+
+        start_time = time.time()
+        replayed_blocks = 0
+        replayed_transactions = 0
+        total_reads = 0
+        for block, transactions in self.transaction_info.iter_blocks(synced_block + 1, block_number,
+                                                                     fetch_size=self.replay_fetch_size):
+            replayed_transactions += len(transactions)
+            if self.sync_mode == "trace":
+                reads = self.apply_block_trace(block, transactions[0]["block_hash"], transactions)
+            else:
+                targets = self.get_changed_slots(transactions)
+                reads = self.apply_block_changes(block, transactions[0]["block_hash"], targets) if targets else None
+            if reads is None: # 该区块没有改变storage
+                continue
+            total_reads += reads
+            replayed_blocks += 1
+            if replayed_blocks % 1000 == 0:
+                logger.info(f"重放进度: 区块 {block}/{block_number}，已重放 {replayed_blocks} 个区块")
+
+        # 剩下的区块没有写storage的交易，直接推进水位线
+        if self.get_synced_block() < block_number:
+            block_hash = self.w3.to_hex(self.w3.eth.get_block(block_number)["hash"])
+            with self.table_writer.transaction():
+                self._write_sync_block(block_number, block_hash)
+        self.pin_block(block_number)
+        logger.info(f"重放完成: 区块 {synced_block + 1} - {block_number}，{replayed_transactions} 个交易，"
+                    f"{replayed_blocks} 个区块有storage改变，共读取 {total_reads} 个slot，耗时 {time.time() - start_time:.2f}s")
+        return block_number
+
+    def rollback_to_block(self, block_number):
+        """
+        重组之后把storage表回滚到共同祖先区块：在祖先区块上重新读取之后被写过的行，
+        storage和key发现的水位线退回到祖先区块，之后由sync_storage_to_block重新重放
+        Args:
+            block_number: 共同祖先的区块号
+        Returns:
+            int: 读取的slot数，storage还没有同步到祖先之后时返回0
+        """
+        synced_block = self.get_synced_block()
+        with self.table_writer.transaction():
+            with self.db_connection.cursor() as cursor:
+                for name in [self.fact_keys_watermark_name, self.preimage_watermark_name]:
+                    watermark = self.watermark.get(name)
+                    if watermark is not None and watermark[0] > block_number:
+                        self.watermark.set(cursor, name, block_number)
+            if synced_block is None or synced_block <= block_number:
+                return 0
+            if self.history_store is not None:
+                with self.db_connection.cursor() as cursor:
+                    self.history_store.rollback(cursor, block_number)
+
+            changed = {"op": ">", "value": block_number}
+            targets = {}
+            for entity_name, entity in self.meta_json["entities"].items():
+                if entity["dataType"] == "mapping":
+                    key_columns = ["key1", "key2"] if entity["dataMeta"]["value"]["dataType"] == "mapping" else ["key1"]
+                    for row in self.read_elements_from_table(entity_name, key_columns, {"block_number": changed}):
+                        targets[(entity_name, tuple(row[column] for column in key_columns))] = {None}
+                elif entity["dataType"] == "staticArray" or entity["dataType"] == "dynamicArray":
+                    # 数组的长度可能也变了，整个数组重新读取
+                    if self.read_elements_from_table(entity_name, ["key1"], {"block_number": changed}):
+                        targets[(entity_name, None)] = {None}
+                else: # 简单类型和struct都在同一行中，没有记录每一列的区块
+                    targets[(entity_name, None)] = {None}
+
+            block_hash = self.w3.to_hex(self.w3.eth.get_block(block_number)["hash"])
+            reads = self.apply_block_changes(block_number, block_hash, targets)
+        logger.info(f"storage回滚到区块 {block_number}: {len(targets)} 行，读取 {reads} 个slot")
+        return reads
+
+    def apply_block_changes(self, block_number, block_hash, targets):
+        """
+        在指定区块上重新读取被改变的行，和水位线在同一个事务中写入
+        Returns:
+            int: 读取的slot数
+        """
+        self.pin_block(block_number)
+        plan = self.plan_changed_reads(targets)
+        values = self.entity.get_storage_values([(read["slot_info"], read["type"]) for read in plan["reads"]])
+        self._write_block_rows(block_number, block_hash, self._fan_in_rows(plan, values), plan["tables"])
+        return len(plan["reads"])
+
+    def apply_block_trace(self, block_number, block_hash, transactions):
+        """
+        trace模式：通过debug_traceBlockByNumber得到区块中合约被写的slot和写入后的值，解码后直接写入对应的行，
+        只有反向索引中还没有的slot（比如第一次出现的mapping key）才根据写storage模板解析出新行并读取新行的其他slot
+        Returns:
+            int: 读取的slot数，区块没有写合约storage时返回None
+        """
+        storage_writes = self.trace_reader.get_block_storage_writes(block_number)
+        if not storage_writes:
+            return None
+        self.pin_block(block_number)
+        slot_index = self.get_slot_index()
+        unknown_slots = {slot for slot in storage_writes if slot not in slot_index}
+        plan = {"reads": [], "rows": [], "tables": []}
+        if unknown_slots:
+            new_plan = self.plan_changed_reads(self.get_changed_slots(transactions))
+            self._add_to_slot_index(new_plan["reads"])
+            row_key = lambda item: (item["table"], tuple(sorted(item["keys"].items())))
+            new_rows = {row_key(read) for read in new_plan["reads"] if read["slot_info"]["slot"] in unknown_slots}
+            plan["reads"] = [read for read in new_plan["reads"]
+                             if row_key(read) in new_rows and read["slot_info"]["slot"] not in storage_writes]
+            plan["rows"] = [row for row in new_plan["rows"] if row_key(row) in new_rows]
+            plan["tables"] = new_plan["tables"]
+            unmatched = [hex(slot) for slot in unknown_slots if slot not in slot_index]
+            if unmatched:
+                logger.warning(f"区块 {block_number} 有 {len(unmatched)} 个被写的slot无法对应到storage表: {unmatched[:10]}")
+
+        read_count = len(plan["reads"])
+        values = self.entity.get_storage_values([(read["slot_info"], read["type"]) for read in plan["reads"]])
+        for slot, value in storage_writes.items():
+            for read in slot_index.get(slot, []):
+                plan["reads"].append(read)
+                values.append(self.entity.decode_storage_value(value, read["slot_info"]["offset"], read["type"]))
+        self._write_block_rows(block_number, block_hash, self._fan_in_rows(plan, values), plan["tables"])
+        return read_count
+
+    def get_slot_index(self):
+        """slot -> 该slot对应的表、行和列，第一次使用时由初始同步的读取规划得到"""
+        if self.slot_index is None:
+            self.slot_index = {}
+            self._add_to_slot_index(self.plan_init_storage_reads()["reads"])
+            logger.info(f"slot反向索引建立完成: 共 {len(self.slot_index)} 个slot")
+        return self.slot_index
+
+    def _add_to_slot_index(self, reads):
+        for read in reads:
+            entries = self.slot_index.setdefault(read["slot_info"]["slot"], [])
+            if read not in entries: # 同一个slot中可能打包了多个列
+                entries.append(read)
+
+    def _write_block_rows(self, block_number, block_hash, rows, tables=None):
+        """
+        将一个区块改变的行和水位线在同一个事务中写入
+        Args:
+            tables: 读取规划中这些行需要的表，见_create_plan_tables
+        """
+        with self._rows_transaction(tables):
+            for (table_name, _), attributes in rows.items():
+                attributes["block_number"] = block_number
+                self.write_elements_to_table(table_name, attributes)
+            self._write_sync_block(block_number, block_hash)
+            if self.pending_fact_keys:
+                keys = {entity_name: dict.fromkeys(entity_keys, block_number) for entity_name, entity_keys in self.pending_fact_keys.items()}
+                with self.db_connection.cursor() as cursor:
+                    self.fact_key_store.add_keys(cursor, keys)
+                self.pending_fact_keys = {}
+
+    @contextmanager
+    def _rows_transaction(self, tables=None):
+        """
+        写入一批行的事务，先在事务中创建这些行需要的表；
+        回滚时表的创建也被回滚，从表结构缓存中移除，下次写入时重新创建
+        """
+        try:
+            with self.table_writer.transaction():
+                self._create_plan_tables(tables)
+                yield
+        except Exception:
+            for table_name, _, _ in tables or []:
+                self.table_catalog.invalidate(table_name)
+            raise
+
+    def _create_plan_tables(self, tables):
+        """
+        创建读取规划中struct的mapping和数组字段对应的table_<slot>表。
+        规划可能在工作线程中执行，因此规划只记录需要的表，由写入的线程在事务中创建
+        Args:
+            tables: [(表名, "mapping"或"array", 字段的类型)]
+        """
+        for table_name, data_type, entity in tables or []:
+            if data_type == "mapping":
+                self.create_table_for_mapping(table_name, entity)
+            else:
+                self.create_table_for_array(table_name, entity)
+
+    def _write_sync_block(self, block_number, block_hash):
+        """记录storage表对应的区块，需要在table_writer的事务中调用"""
+        self.write_elements_to_table(self.simple_table_name, {"id": 1, "block_number": block_number, "block_hash": block_hash})
+        with self.db_connection.cursor() as cursor:
+            self.watermark.set(cursor, self.watermark_name, block_number, block_hash)
+            if self.history_store is not None:
+                self.history_store.compact_if_due(cursor, block_number)
+
+    def init_syn_storage(self, block_number=None): # 最开始批量同步合约的storage，因为如果从第一个交易开始同步，存在大量请求的问题
+        """
+        在一个固定区块上读取所有storage，按分区提交并记录进度，中断之后重新调用会继续之前的快照区块，
+        只处理没有完成的分区
+        Args:
+            block_number: 快照区块，默认为最新区块，继续之前的初始同步时忽略
+        Returns:
+            int: 快照区块号
+        """
+        # 所有读取固定在同一个区块，保证快照的一致性
+        snapshot = self.watermark.get(self.init_snapshot_name)
+        if snapshot is not None and self.w3.to_hex(self.w3.eth.get_block(snapshot[0])["hash"]) == snapshot[1]:
+            block_number, block_hash = snapshot
+            logger.info(f"继续区块 {block_number} ({block_hash}) 上中断的初始同步")
+        else:
+            if snapshot is not None:
+                logger.warning(f"之前的快照区块 {snapshot[0]} 已经被重组，重新开始初始同步")
+            if block_number is None:
+                block_number = self.w3.eth.block_number
+            block_hash = self.w3.to_hex(self.w3.eth.get_block(block_number)["hash"])
+            with self.db_connection.cursor() as cursor:
+                self.init_progress.clear(cursor)
+                self.watermark.set(cursor, self.init_snapshot_name, block_number, block_hash)
+            self.db_connection.commit()
+            logger.info(f"初始同步固定在区块 {block_number} ({block_hash})")
+        self.pin_block(block_number)
+
+        parts = self.plan_init_parts(block_number)
+        pending = [part for part in parts if not part["completed"]]
+        logger.info(f"初始同步共 {len(parts)} 个分区，{len(parts) - len(pending)} 个已经完成")
+
+        # 分区在线程中规划和读取，完成的顺序不固定，每个分区的行和完成标记在主线程中一起提交
+        total_rows = 0
+        with ThreadPoolExecutor(max_workers=self.init_workers) as executor:
+            futures = {executor.submit(self.read_init_part, part): part for part in pending}
+            for done, future in enumerate(as_completed(futures), 1):
+                part = futures[future]
+                try:
+                    rows, tables = future.result()
+                except Exception:
+                    # 已经完成的分区已经提交，取消还没有开始的分区，下次重新调用时继续
+                    for other in futures:
+                        other.cancel()
+                    raise
+                with self._rows_transaction(tables):
+                    for (table_name, _), attributes in rows.items():
+                        attributes["block_number"] = block_number
+                        self.write_elements_to_table(table_name, attributes)
+                    with self.db_connection.cursor() as cursor:
+                        self.init_progress.complete(cursor, part["unit"], part["part"], len(rows))
+                total_rows += len(rows)
+                logger.info(f"分区 {part['unit']}#{part['part']} 完成 ({done}/{len(pending)}): {len(rows)} 行")
+
+        # 简单类型表记录快照的区块，即使合约没有简单类型的storage
+        with self.table_writer.transaction():
+            self._write_sync_block(block_number, block_hash)
+        logger.info(f"初始同步完成: 本次写入 {total_rows} 行，区块 {block_number}")
+        return block_number
+
+    def plan_init_parts(self, block_number):
+        """
+        把初始同步切分为分区：简单类型和struct一个分区，每个数组一个分区，mapping按key的哈希分桶，
+        分桶数第一次登记之后不再改变，保证重启之后每个key仍然在同一个分区中
+        Returns:
+            list: [{"unit", "part", "parts", "entities", "keys", "completed"}]
+        """
+        progress = self.init_progress.load(block_number)
+        stored_parts = {unit: state["parts"] for (unit, _), state in progress.items()}
+        parts = []
+        simple_entities = []
+        for entity_name, entity in self.meta_json["entities"].items():
             if entity["dataType"] == "mapping":
-                if entity_name in self.fact_keys:
-                    if entity["dataMeta"]["value"]["dataType"] == "mapping": # 两层mapping
-                        assert entity["dataMeta"]["value"]["dataType"]["value"]["dataType"] != "mapping"
-                        for key in self.fact_keys[entity_name]:
-                            keys = {"key1": key[0], "key2": key[1]}
-                            self._init_mapping_entity(entity, entity_name, "", entity["storageInfo"], keys)
-                    else:
-                        base_slot = entity["storageInfo"]["slot"]
-                        key_type = entity["dataMeta"]["key"]["dataType"]
-                        for key in self.fact_keys[entity_name]:
-                            slot_bytes = keccak(encode([key_type, "uint256"], [key, base_slot]))
-                            slot_int = int.from_bytes(slot_bytes, "big")
-                            slot_info = {"slot": slot_int, "offset": 0}
-                            keys = {"key1": key}
-                            self._init_mapping_entity(entity, entity_name, "", slot_info, keys)
-            elif entity["dataType"] == "struct":
-                prefix = entity_name + "__"
-                self._init_struct_entity(entity, self.simple_table_name, prefix, entity["storageInfo"], {"id": 1})
+                keys = self.fact_keys.get(entity_name, set())
+                if not keys:
+                    continue
+                count = stored_parts.get(entity_name) or max(1, math.ceil(len(keys) / self.init_bucket_size))
+                buckets = [[] for _ in range(count)]
+                for key in keys:
+                    buckets[self.get_key_bucket(key, count)].append(key)
+                for index, bucket in enumerate(buckets):
+                    parts.append({"unit": entity_name, "part": index, "parts": count, "entities": [entity_name], "keys": bucket})
             elif entity["dataType"] == "staticArray" or entity["dataType"] == "dynamicArray":
-                self._init_array_entity(entity, entity_name, entity["storageInfo"])
-            else: # 简单类型
-                slot_info = entity["storageInfo"]
-                type = entity["dataType"]
-                value = self.entity.get_storage_value(slot_info, type)
-                #将value存入到simple_table中
-                self.write_elements_to_table(self.simple_table_name, {entity_name: value, "id": 1})      
-
-    def _init_array_entity(self, entity, table_name, slot_info):
-        base_slot = slot_info["slot"] 
+                parts.append({"unit": entity_name, "part": 0, "parts": 1, "entities": [entity_name], "keys": None})
+            else:
+                simple_entities.append(entity_name)
+        if simple_entities:
+            parts.append({"unit": self.simple_table_name, "part": 0, "parts": 1, "entities": simple_entities, "keys": None})
+
+        with self.db_connection.cursor() as cursor:
+            self.init_progress.register(cursor, block_number, [(part["unit"], part["part"], part["parts"]) for part in parts])
+        self.db_connection.commit()
+        for part in parts:
+            part["completed"] = progress.get((part["unit"], part["part"]), {}).get("completed", False)
+        return parts
+
+    @staticmethod
+    def get_key_bucket(key, count):
+        """key所在的分桶，使用key的文本形式的哈希，不受进程的hash随机化影响"""
+        if isinstance(key, tuple):
+            text = FactKeyStore.key_to_text(key[0]) + "," + FactKeyStore.key_to_text(key[1])
+        else:
+            text = FactKeyStore.key_to_text(key)
+        return int.from_bytes(keccak(text=text), "big") % count
+
+    def read_init_part(self, part):
+        """
+        规划并读取一个分区的slot，在工作线程中调用，只访问RPC，不访问数据库
+        Returns:
+            tuple: ((表名, 主键) -> 行, 这些行需要的表，由主线程在写入时创建)
+        """
+        plan = {"reads": [], "rows": [], "arrays": [], "tables": []}
+        for entity_name in part["entities"]:
+            self._plan_init_entity(entity_name, part["keys"], plan)
+        self._resolve_array_lengths(plan)
+        values = self.entity.get_storage_values([(read["slot_info"], read["type"]) for read in plan["reads"]])
+        return self._fan_in_rows(plan, values), plan["tables"]
+
+    def plan_init_storage_reads(self):
+        """
+        遍历entity树，收集初始同步需要读取的所有slot
+        Returns:
+            dict: {"reads": 需要读取的slot列表, "rows": 无需读取、直接写入的值}
+                每个元素为{"table": 表名, "keys": 主键, "column": 列名, ...}
+        """
+        plan = {"reads": [], "rows": [], "arrays": [], "tables": []}
+        for entity_name in self.meta_json["entities"]:
+            self._plan_init_entity(entity_name, self.fact_keys.get(entity_name), plan)
+        self._resolve_array_lengths(plan)
+        return plan
+
+    def _plan_init_entity(self, entity_name, keys, plan):
+        """规划一个entity的读取，mapping只规划keys中的key"""
+        entity = self.meta_json["entities"][entity_name]
+        if entity["dataType"] == "mapping":
+            for key in keys or []:
+                self._plan_mapping_row(entity_name, entity, key, plan)
+        elif entity["dataType"] == "struct":
+            prefix = entity_name + "__"
+            self._plan_struct_entity(entity, self.simple_table_name, prefix, entity["storageInfo"], {"id": 1}, plan)
+        elif entity["dataType"] == "staticArray" or entity["dataType"] == "dynamicArray":
+            self._plan_array_entity(entity, entity_name, entity["storageInfo"], plan)
+        else: # 简单类型
+            plan["reads"].append({"table": self.simple_table_name, "keys": {"id": 1}, "column": entity_name,
+                                  "slot_info": entity["storageInfo"], "type": entity})
+
+    def _resolve_array_lengths(self, plan, block_number=None):
+        """动态数组需要先知道长度才能展开元素，按层批量读取长度，block_number为None时在pin_block固定的区块上读取"""
+        while plan["arrays"]:
+            arrays = plan["arrays"]
+            plan["arrays"] = []
+            length_type = {"dataType": "uint256", "dataMeta": {"size": 32}}
+            reads = [(array["slot_info"], length_type) for array in arrays]
+            lengths = self.entity.get_storage_values(reads) if block_number is None else self.entity.get_storage_values(reads, block_number)
+            for array, length in zip(arrays, lengths):
+                self._plan_array_elements(array["entity"], array["table"], array["element_slot"], length, plan)
+        del plan["arrays"]
+
+    @staticmethod
+    def _get_mapping_slot(key_type, key, base_slot):
+        if "int" in key_type:
+            key = int(key)
+        slot_bytes = keccak(encode([key_type, "uint256"], [key, base_slot]))
+        return int.from_bytes(slot_bytes, "big")
+
+    def _plan_mapping_row(self, entity_name, entity, key, plan):
+        """规划mapping中一个key对应的行，两层mapping的key为(key1, key2)"""
+        base_slot = entity["storageInfo"]["slot"]
+        key_type = entity["dataMeta"]["key"]["dataType"]
+        if entity["dataMeta"]["value"]["dataType"] == "mapping": # 两层mapping
+            inner = entity["dataMeta"]["value"]
+            assert inner["dataMeta"]["value"]["dataType"] != "mapping"
+            slot_int = self._get_mapping_slot(key_type, key[0], base_slot)
+            slot_int = self._get_mapping_slot(inner["dataMeta"]["key"]["dataType"], key[1], slot_int)
+            keys = {"key1": key[0], "key2": key[1]}
+            self._plan_mapping_entity(inner, entity_name, "", {"slot": slot_int, "offset": 0}, keys, plan)
+        else:
+            slot_int = self._get_mapping_slot(key_type, key, base_slot)
+            self._plan_mapping_entity(entity, entity_name, "", {"slot": slot_int, "offset": 0}, {"key1": key}, plan)
+
+    @staticmethod
+    def _get_array_element_slot(entity, slot_info):
+        """数组第0个元素所在的slot，动态数组的元素从keccak(slot)开始"""
+        base_slot = slot_info["slot"]
         assert slot_info["offset"] == 0
-        slot = keccak(base_slot)
-        slot_int = int.from_bytes(slot, "big")
-        type = {
-            "dataType": "uint256",
-            "dataMeta": {
-                "size": 32
-            }
-        }
-        length = self.entity.get_storage_value(slot_info, type)
+        if entity["dataType"] == "staticArray":
+            return base_slot
+        return int.from_bytes(keccak(base_slot.to_bytes(32, byteorder="big")), "big")
+
+    def _plan_array_entity(self, entity, table_name, slot_info, plan):
+        slot_int = self._get_array_element_slot(entity, slot_info)
+        if entity["dataType"] == "staticArray":
+            self._plan_array_elements(entity, table_name, slot_int, entity["dataMeta"]["length"], plan)
+        else:
+            plan["arrays"].append({"entity": entity, "table": table_name, "slot_info": slot_info, "element_slot": slot_int})
+
+    def _plan_array_elements(self, entity, table_name, slot_int, length, plan):
+        for i in range(length):
+            self._plan_array_element(entity, table_name, slot_int, i, plan)
+
+    def _plan_array_element(self, entity, table_name, slot_int, i, plan):
         element_type = entity["dataMeta"]["elementType"]
         if element_type["dataType"] == "struct":
-            for i in range(length):
-                slot_info = {"slot": slot_int + i, "offset": 0}
-                self._init_struct_entity(element_type, table_name, "", slot_info, {"key1": i})
+            struct_slots, _, _ = Entity.get_slot_info_for_structure(element_type, "")
+            slot_info = {"slot": slot_int + i * struct_slots, "offset": 0}
+            self._plan_struct_entity(element_type, table_name, "", slot_info, {"key1": i}, plan)
         elif element_type["dataType"] == "staticArray":
             raise Exception("Unimplemented type: staticArray")
         elif element_type["dataType"] == "dynamicArray":
@@ -230,70 +654,64 @@ class StorageInfo:
         elif element_type["dataType"] == "mapping":
             raise Exception("Unimplemented type: "+element_type["dataType"])
         else:
-            for i in range(length):
-                slot_info = {"slot": slot_int + i, "offset": 0}
-                value = self.entity.get_storage_value(slot_info, element_type)
-                self.write_elements_to_table(table_name, {"key1": i, "value": value})
+            slot_info = {"slot": slot_int + i, "offset": 0}
+            plan["reads"].append({"table": table_name, "keys": {"key1": i}, "column": "value",
+                                  "slot_info": slot_info, "type": element_type})
 
-    def _init_struct_entity(self, entity, table_name, prefix, base_slot, keys):
+    def _plan_struct_entity(self, entity, table_name, prefix, base_slot, keys, plan):
         for field in entity["dataMeta"]["fields"]:
+            add_slot, offset, index = Entity.get_slot_info_for_structure(entity, field["name"])
+            assert index != -1
             if field["type"]["dataType"] == "mapping":
-                add_slot, offset, index = Entity.get_slot_info_for_structure(entity, field["name"])
-                assert index != -1
                 value = base_slot["slot"] + add_slot
-                selector = {prefix + field["name"]: value}
-                for key in keys:
-                    selector[key] = keys[key]
-                self.write_elements_to_table(table_name, selector)
-                self.create_table_for_mapping("table_"+str(value), field["type"])
+                plan["rows"].append({"table": table_name, "keys": keys, "column": prefix + field["name"], "value": value})
+                plan["tables"].append(("table_"+str(value), "mapping", field["type"]))
                 #TODO: 向表格中加入内容
             elif field["type"]["dataType"] == "struct":
-                add_slot, offset, index = Entity.get_slot_info_for_structure(entity, field["name"])
-                assert index != -1
                 slot_info = {"slot": base_slot["slot"] + add_slot, "offset": offset}
-                self._init_struct_entity(field["type"], table_name, prefix + field["name"] + "__", slot_info, keys)
+                self._plan_struct_entity(field["type"], table_name, prefix + field["name"] + "__", slot_info, keys, plan)
             elif field["type"]["dataType"] == "staticArray" or field["type"]["dataType"] == "dynamicArray":
-                add_slot, offset, index = Entity.get_slot_info_for_structure(entity, field["name"])
-                assert index != -1
                 value = base_slot["slot"] + add_slot
-                selector = {prefix + field["name"]: value}
-                for key in keys:
-                    selector[key] = keys[key]
-                self.write_elements_to_table(table_name, selector)
-                self.create_table_for_array("table_"+str(value), field["type"])
+                plan["rows"].append({"table": table_name, "keys": keys, "column": prefix + field["name"], "value": value})
+                plan["tables"].append(("table_"+str(value), "array", field["type"]))
                 #向表格中加入内容
-                self._init_array_entity(field["type"], "table_"+str(value), {"slot": value, "offset": 0})
+                self._plan_array_entity(field["type"], "table_"+str(value), {"slot": value, "offset": 0}, plan)
             else:
-                add_slot, offset, index = Entity.get_slot_info_for_structure(entity, field["name"])
-                assert index != -1
                 slot_info = {"slot": base_slot["slot"] + add_slot, "offset": offset}
-                type = field["type"]
-                value = self.entity.get_storage_value(slot_info, type)
-                selector = {prefix + field["name"]: value}
-                for key in keys:
-                    selector[key] = keys[key]
-                self.write_elements_to_table(table_name, selector)
+                plan["reads"].append({"table": table_name, "keys": keys, "column": prefix + field["name"],
+                                      "slot_info": slot_info, "type": field["type"]})
 
-    def _init_mapping_entity(self, entity, table_name, prefix, slot_info, keys):
-        if entity["dataMeta"]["value"]["dataType"] == "mapping":
+    def _plan_mapping_entity(self, entity, table_name, prefix, slot_info, keys, plan):
+        value_type = entity["dataMeta"]["value"]
+        if value_type["dataType"] == "mapping":
             raise Exception("Unimplemented mapping type in mapping type")
-        elif entity["dataMeta"]["value"]["dataType"] == "struct":
-            self._init_struct_entity(entity["dataMeta"]["value"], table_name, prefix, slot_info, keys)
-        elif entity["dataMeta"]["value"]["dataType"] == "staticArray" or entity["dataMeta"]["value"]["dataType"] == "dynamicArray":
+        elif value_type["dataType"] == "struct":
+            self._plan_struct_entity(value_type, table_name, prefix, slot_info, keys, plan)
+        elif value_type["dataType"] == "staticArray" or value_type["dataType"] == "dynamicArray":
             raise Exception("Unimplemented array type in mapping type")
         else:
-            slot_info = entity["storageInfo"]
-            type = entity["dataType"]
-            value = self.entity.get_storage_value(slot_info, type)
-            selector = {prefix + "value": value}
-            for key in keys:
-                selector[key] = keys[key]
             #将value存入到mapping的table中
-            self.write_elements_to_table(table_name, selector) 
-            
+            plan["reads"].append({"table": table_name, "keys": keys, "column": prefix + "value",
+                                  "slot_info": slot_info, "type": value_type})
+
+    @staticmethod
+    def _fan_in_rows(plan, values):
+        """将读取到的值按照(表名, 主键)合并成行"""
+        rows = {}
+        items = [(row, row["value"]) for row in plan["rows"]] + list(zip(plan["reads"], values))
+        for item, value in items:
+            row_key = (item["table"], tuple(sorted(item["keys"].items())))
+            if row_key not in rows:
+                rows[row_key] = dict(item["keys"])
+            rows[row_key][item["column"]] = value
+        return rows
 
-    def get_all_keys_for_mapping(self):
-        # 先分析function_write_storage，得到每个funciton对可能的mapping的entity可能引用的keys
+    def get_key_templates(self):
+        """
+        分析function_write_storage，得到每个function写mapping时作为key的参数
+        Returns:
+            dict: method_id -> {entity名: key参数名的集合}，两层mapping为(参数名, 参数名)
+        """
         all_keys = {}
         for function in self.function_write_storage:
             parameters = self.function_write_storage[function]["parameters"]
@@ -332,67 +750,126 @@ class StorageInfo:
                                         if entity_name not in all_keys[function]:
                                             all_keys[function][entity_name] = set()
                                         all_keys[function][entity_name].add(index["name"]["name"])
-        # 然后实际根据交易参数的实际值得到每个mapping的entity实际的key
-        latest_block = self.transaction_info.get_latest_block_number()
-        contract_creation_block = self.transaction_info.get_contract_creation_block()
-        transactions_gen = self.transaction_info.get_transactions_paginated(contract_creation_block, latest_block, page_size=10000)
-        fact_keys = {}
-        for transactions in transactions_gen:
-            for tx in transactions:
-                if tx["is_error"] == 0 and tx["input_data"] != "" and tx["input_data"] is not None and tx["input_data"] != "0x":
-                    func_name, params = self.decode_input(tx["input_data"])
-                    method_id = tx["method_id"]
-                    if method_id in all_keys:
-                        for entity_name in all_keys[method_id]:
-                            for index in all_keys[method_id][entity_name]:
-                                if isinstance(index, tuple):
-                                    key_1 = []
-                                    key_2 = []
-                                    if index[0] == "$msg_sender":
-                                        key_1.append(tx["from_address"])
-                                    else:
-                                        if index[0] in params:
-                                            if isinstance(params[index[0]], list):
-                                                for param in params[index[0]]:
-                                                    key_1.append(param)
-                                            else:
-                                                key_1.append(params[index[0]])
-                                        else:
-                                            raise Exception(f"{index[0]} not found in params for function {method_id}")
-                                    if index[1] == "$msg_sender":
-                                        key_2.append(tx["from_address"])
-                                    else:
-                                        if index[1] in params:
-                                            if isinstance(params[index[1]], list):
-                                                for param in params[index[1]]:
-                                                    key_2.append(param)
-                                            else:
-                                                key_2.append(params[index[1]])
-                                        else:
-                                            raise Exception(f"{index[1]} not found in params for function {method_id}")
-                                    for index_1 in key_1:
-                                        for index_2 in key_2:
-                                            if entity_name not in fact_keys:
-                                                fact_keys[entity_name] = set()
-                                            fact_keys[entity_name].add((index_1,index_2))
-                                else:
-                                    if index == "$msg_sender":
-                                        if entity_name not in fact_keys:
-                                            fact_keys[entity_name] = set()
-                                        fact_keys[entity_name].add(tx["from_address"])
-                                    else:
-                                        if index in params:
-                                            if entity_name not in fact_keys:
-                                                fact_keys[entity_name] = set()
-                                            if isinstance(params[index], list):
-                                                for param in params[index]:
-                                                    fact_keys[entity_name].add(param)
-                                            else:
-                                                fact_keys[entity_name].add(params[index])
-                                        else:
-                                            raise Exception(f"{index} not found in params for function {method_id}")
-        self.fact_keys = fact_keys
-        return fact_keys
+        return all_keys
+
+    def get_all_keys_for_mapping(self, end_block=None):
+        """
+        增量发现mapping实际出现过的key：只扫描fact_keys水位线之后的交易，新的key写入fact_keys表并推进水位线
+        Args:
+            end_block: 扫描到的区块号，默认为交易表中最新的区块
+        Returns:
+            dict: entity名 -> key集合，两层mapping的key为(key1, key2)
+        """
+        all_keys = self.get_key_templates()
+        watermark = self.watermark.get(self.fact_keys_watermark_name)
+        if watermark is not None:
+            start_block = watermark[0] + 1
+        else:
+            start_block = self.transaction_info.get_contract_creation_block() or 0
+        if end_block is None:
+            end_block = self.transaction_info.get_latest_block_number()
+
+        if start_block <= end_block:
+            logger.info(f"发现mapping的key: 区块 {start_block} - {end_block}")
+            event_map = self.get_event_key_map(all_keys)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                # 日志来源在线程中请求RPC，同时calldata来源在进程池中扫描交易表
+                log_future = executor.submit(discover_keys_from_logs, LogFetcher(self.contract_info.rpc_url, self.address),
+                                             event_map, start_block, end_block) if event_map else None
+                new_keys = discover_fact_keys(self.transaction_info.db_config, self.transaction_info.table_name, self.abi, all_keys,
+                                              start_block, end_block, workers=self.key_discovery_workers)
+                if log_future is not None:
+                    merge_fact_keys(new_keys, log_future.result())
+            with self.db_connection.cursor() as cursor:
+                written = self.fact_key_store.add_keys(cursor, new_keys)
+                self.watermark.set(cursor, self.fact_keys_watermark_name, end_block)
+            self.db_connection.commit()
+            logger.info(f"区块 {start_block} - {end_block} 中发现 {written} 个key")
+
+        if self.preimage_key_discovery:
+            self.discover_keys_from_preimages(end_block)
+
+        self.fact_keys = self.fact_key_store.load(self.get_fact_key_types())
+        return self.fact_keys
+
+    def discover_keys_from_preimages(self, end_block, batch_size=1000):
+        """
+        从交易执行中SHA3的输入恢复mapping的key，每批交易的key和水位线一起提交，中断后从水位线继续
+        Args:
+            end_block: 扫描到的区块号
+            batch_size: 每批trace的交易数
+        Returns:
+            int: 写入的key数
+        """
+        watermark = self.watermark.get(self.preimage_watermark_name)
+        if watermark is not None:
+            start_block = watermark[0] + 1
+        else:
+            start_block = self.transaction_info.get_contract_creation_block() or 0
+        if start_block > end_block:
+            return 0
+
+        logger.info(f"通过SHA3输入发现mapping的key: 区块 {start_block} - {end_block}")
+        tracer = PreimageKeyTracer(self.contract_info.rpc_url, self.address, self.meta_json["entities"])
+        written = 0
+        batch = []
+        # 同一区块的交易放在同一批中，水位线只推进到完整处理的区块
+        for block_number, transactions in self.transaction_info.iter_blocks(start_block, end_block, fetch_size=self.replay_fetch_size):
+            batch.extend(transactions)
+            if len(batch) >= batch_size:
+                written += self._write_preimage_keys(tracer, batch, block_number)
+                batch = []
+        written += self._write_preimage_keys(tracer, batch, end_block)
+        logger.info(f"通过SHA3输入发现 {written} 个key")
+        return written
+
+    def _write_preimage_keys(self, tracer, transactions, block_number):
+        keys = tracer.discover_keys(transactions)
+        with self.db_connection.cursor() as cursor:
+            written = self.fact_key_store.add_keys(cursor, keys)
+            self.watermark.set(cursor, self.preimage_watermark_name, block_number)
+        self.db_connection.commit()
+        return written
+
+    def get_event_key_map(self, all_keys):
+        """
+        根据meta.json中的function_events得到事件日志中作为mapping key的参数
+        Returns:
+            dict: topic0 -> {"event", "keys"}，没有开启或者没有可用的事件时为空
+        """
+        function_events = self.meta_json.get("function_events")
+        if not self.log_key_discovery or not function_events:
+            return {}
+        abi = json.loads(self.abi) if isinstance(self.abi, str) else self.abi
+        return build_event_key_map(function_events, all_keys, abi)
+
+    def get_fact_key_types(self):
+        """entity名 -> 每层key的类型列表"""
+        key_types = {}
+        for entity_name, entity in self.meta_json["entities"].items():
+            if entity["dataType"] == "mapping":
+                key_types[entity_name] = [entity["dataMeta"]["key"]["dataType"]]
+                if entity["dataMeta"]["value"]["dataType"] == "mapping":
+                    key_types[entity_name].append(entity["dataMeta"]["value"]["dataMeta"]["key"]["dataType"])
+        return key_types
+
+    def migrate_fact_keys_from_json(self, input_file):
+        """
+        将旧版本导出的fact_keys.json一次性导入fact_keys表，表中已经有key时不再导入
+        Returns:
+            bool: 是否导入
+        """
+        if self.fact_key_store.count() > 0 or not os.path.exists(input_file):
+            return False
+        if not self.import_fact_keys_from_json(input_file):
+            return False
+        # JSON中没有记录key第一次出现的区块
+        keys = {entity_name: dict.fromkeys(entity_keys) for entity_name, entity_keys in self.fact_keys.items()}
+        with self.db_connection.cursor() as cursor:
+            written = self.fact_key_store.add_keys(cursor, keys)
+        self.db_connection.commit()
+        logger.info(f"从 {input_file} 迁移 {written} 个key到fact_keys表")
+        return True
 
     def export_fact_keys_to_json(self, output_file: str, include_metadata: bool = True) -> bool:
         """
@@ -477,7 +954,8 @@ class StorageInfo:
             # 转换回set格式
             converted_fact_keys = {}
             for entity_name, keys_list in imported_fact_keys.items():
-                converted_fact_keys[entity_name] = set(keys_list)
+                # 两层mapping的key在JSON中是列表
+                converted_fact_keys[entity_name] = set(tuple(key) if isinstance(key, list) else key for key in keys_list)
             
             # 根据合并模式处理数据
             if merge_mode == 'replace':
@@ -533,109 +1011,177 @@ class StorageInfo:
             return False
                                 
 
-    def get_changed_slots(self, params, write_expr, changed_slots):
-        if isinstance(write_expr["name"], str):
-            if write_expr["name"] in self.entity.storage_meta:
-                results = self.deal_with_index(write_expr, params)
-                for result in results:
-                    slot_info, type_info = self.entity.get_storage_slot_info(result["name"])
-                    changed_slots.add({"slot": slot_info["slot"], "expr": result["name"]})
-            else:
-                raise Exception(f"storage {write_expr['name']} not found in meta")
-        else:
-            raise Exception(f"write_expr['name'] is not a string")
-
-    def deal_with_index(self, write_exprs, params):
-        result_exprs = []
-        for write_expr in write_exprs:
-            if write_expr["index"] is not None:
-                if write_expr["index"]["index"] is None: # 一层的index，如a[b]
-                    results = self.deal_with_index_name(write_expr["index"], params)
-                    for result in results:
-                        new_expr = {"name": write_expr["name"]+"["+str(result)+"]", "index": None, "field": write_expr["index"]["field"]}
-                    result_exprs.extend(self.deal_with_index(new_expr, params))
-                else: # 两层的index，如a[b][c]
-                    raise Exception("two layer index is not supported")
-            elif write_expr["field"] is not None:
-                new_expr = {"name": write_expr["name"]+"."+write_expr["field"], "index": write_expr["field"]["index"], "field": write_expr["field"]["field"]}
-                result_exprs.extend(self.deal_with_index(new_expr, params))
+    def get_changed_slots(self, transactions, cache=None):
+        """
+        根据function_write_storage中的写storage模板，计算一个区块的交易会改变的所有行
+        Args:
+            transactions: 同一区块内按顺序排列的交易
+            cache: 同一区块内读取表格的缓存
+        Returns:
+            dict: (entity名, key tuple) -> 列名前缀的集合，前缀为None表示整行；
+                简单类型和结构体的key为None，数组key为None表示整个数组
+        """
+        cache = {} if cache is None else cache
+        targets = {}
+        transactions = [tx for tx in transactions if tx["is_error"] == 0 and tx["method_id"] in self.function_write_storage]
+        for tx, (func_name, params) in zip(transactions, self.abi_decoder.decode_many(transactions)):
+            if func_name is None:
+                logger.error(f"无法解析交易: {tx['hash']}, with input: {tx['input_data']}")
+                continue
+            for write_expr in self.function_write_storage[tx["method_id"]]["write_storages"]:
+                for entity_name, keys, prefix in self.resolve_write_expr(write_expr, params, tx, cache):
+                    targets.setdefault((entity_name, keys), set()).add(prefix)
+        return targets
+
+    def resolve_write_expr(self, write_expr, params, tx, cache):
+        """
+        将写storage的模板解析为具体的行，如_balances[to]、_allowances[$msg_sender][spender]、_reserves[asset].liquidityIndex
+        Args:
+            write_expr: Entity.parse_expr解析出的表达式
+            params: 交易解码出的参数
+            tx: 交易数据，$msg_sender取自from_address
+            cache: 同一区块内读取表格的缓存
+        Returns:
+            list: (entity名, key tuple, 列名前缀)的列表
+        """
+        entity_name = write_expr["name"]
+        if not isinstance(entity_name, str) or entity_name not in self.entity.storage_meta:
+            raise Exception(f"storage {entity_name} not found in meta")
+        entity = self.entity.storage_meta[entity_name]
+        if entity["dataType"] == "struct":
+            return [(entity_name, None, self._get_column_prefix(write_expr["field"]))]
+        elif entity["dataType"] not in ["mapping", "staticArray", "dynamicArray"]:
+            return [(entity_name, None, None)]
+
+        depth = 2 if entity["dataType"] == "mapping" and entity["dataMeta"]["value"]["dataType"] == "mapping" else 1
+        node = write_expr
+        key_values = []
+        for _ in range(depth):
+            if node is None or node["index"] is None: # 模板没有写出这一层的index，比如delete a[b]
+                node = None
+                key_values.append(None)
             else:
-                pass
-        return result_exprs
-
-    def deal_with_index_name(self, index_expr, params):
-        #index["name"]可能是b或者b.c或者b[c]或者b[c].d
-        type_info = self.entity.storage_meta[index_expr["name"]]
-        assert type_info["dataType"] in ["mapping", "staticArray", "dynamicArray"]
-        if isinstance(index_expr["index"]["name"], str): #index为一层，如果可以解析出具体就解析出具体，如果不能就给出所有的index
-            if index_expr["index"]["name"] in self.entity.storage_meta:
-                results =self.read_elements_from_table(self.simple_table_name, index_expr["index"]["name"], {})
-                value = results[0][index_expr["index"]["name"]]
-                return [value]
-            elif index_expr["index"]["name"] in params:
-                return [params[index_expr["index"]["name"]]]
+                node = node["index"]
+                key_values.append(self.resolve_index_values(node["name"], params, tx, cache))
+        prefix = self._get_column_prefix(node["field"]) if node is not None else None
+
+        if entity["dataType"] != "mapping":
+            if key_values[0] is None: # 无法确定写的是哪个元素（比如push），重新读取整个数组
+                return [(entity_name, None, prefix)]
+            return [(entity_name, (int(index),), prefix) for index in key_values[0]]
+
+        if all(values is not None for values in key_values):
+            return [(entity_name, keys, prefix) for keys in itertools.product(*key_values)]
+        # 有无法解析的index时，只能对表中所有已有的key重新读取
+        logger.warning(f"无法解析 {Entity.expr_to_string(write_expr)} 的index，重新读取 {entity_name} 所有已有的key")
+        columns = [f"key{i + 1}" for i in range(depth)]
+        selector = {column: values for column, values in zip(columns, key_values) if values is not None}
+        rows = self._read_table_cached(entity_name, columns, selector, cache)
+        return [(entity_name, tuple(row[column] for column in columns), prefix) for row in rows]
+
+    def resolve_index_values(self, index_name, params, tx, cache):
+        """
+        解析index的所有可能取值
+        Args:
+            index_name: index表达式，可能是参数名、$msg_sender、storage变量名、常数，
+                或者是storage表达式如b.c、b[c]、b[c].d
+        Returns:
+            list: index的取值，无法解析时返回None
+        """
+        if isinstance(index_name, dict):
+            return self.read_storage_expr_values(index_name, params, tx, cache)
+        if index_name == "$msg_sender":
+            return [Web3.to_checksum_address(tx["from_address"])]
+        if index_name in params:
+            value = params[index_name]
+            return list(value) if isinstance(value, (list, tuple)) else [value]
+        if index_name in self.entity.storage_meta:
+            return self.read_storage_expr_values({"name": index_name, "index": None, "field": None}, params, tx, cache)
+        try:
+            return [int(index_name, 0)]
+        except ValueError:
+            return None # 局部变量等无法从交易中得到
+
+    def read_storage_expr_values(self, expr, params, tx, cache):
+        """
+        从storage表中读取作为index使用的storage表达式的值，读到的是上一个已同步区块的状态
+        Returns:
+            list: 表达式所有可能的值
+        """
+        values = []
+        for entity_name, keys, prefix in self.resolve_write_expr(expr, params, tx, cache):
+            entity = self.entity.storage_meta[entity_name]
+            if entity["dataType"] == "struct":
+                table_name, selector, column = self.simple_table_name, {"id": 1}, entity_name + "__" + prefix
+            elif entity["dataType"] not in ["mapping", "staticArray", "dynamicArray"]:
+                table_name, selector, column = self.simple_table_name, {"id": 1}, entity_name
             else:
-                results = self.read_elements_from_table(index_expr["name"], ["key1"], {})
-                return_results = []
-                for x in results:
-                    return_results.append(x["key1"])
-                return return_results
-        elif isinstance(index_expr["index"]["name"], dict): # index内部还有层次机构，比如a[b.c]或则a[b[c]]，其他情况暂时不处理
-            index_name = index_expr["index"]["name"]
-            if isinstance(index_name["name"], str):
-                if index_name["name"] in self.entity.storage_meta:
-                    if index_name["index"] is not None: #a[b[c]]的形式或者a[b[c].d]的形式
-                        assert isinstance(index_name["index"]["name"], str)
-                        assert index_name["index"]["index"] is None
-                        if index_name["index"]["field"] is None: #a[b[c]]的形式
-                            if index_name["index"]["name"] in self.entity.storage_meta:
-                                inner_results =self.read_elements_from_table(self.simple_table_name, index_expr["index"]["name"], {})
-                                value = inner_results[0][index_name["index"]["name"]]
-                                outter_results = self.read_elements_from_table(index_name["name"], ["value"], {"key1": value})
-                                return [outter_results[0]["value"]]
-                            elif index_name["index"]["name"] in params:
-                                value = params[index_expr["index"]["name"]]
-                                outter_results = self.read_elements_from_table(index_name["name"], ["value"], {"key1": value})
-                                return [outter_results[0]["value"]]
-                            else:
-                                outter_results =self.read_elements_from_table(index_name["name"], ["value"], {})
-                                return_results = []
-                                for x in outter_results:
-                                    return_results.append(x["value"])
-                                return return_results
-                        else: # a[b[c].d]的形式
-                            assert isinstance(index_name["index"]["field"]["name"], str)
-                            assert index_name["index"]["field"]["index"] is None
-                            assert index_name["index"]["field"]["field"] is None
-                            field_name = index_name["index"]["field"]["name"]
-                            if index_name["index"]["name"] in self.entity.storage_meta:
-                                inner_results =self.read_elements_from_table(self.simple_table_name, index_expr["index"]["name"], {})
-                                value = inner_results[0][index_name["index"]["name"]]
-                                outter_results = self.read_elements_from_table(index_name["name"], [field_name], {"key1": value})
-                                return [outter_results[0][field_name]]
-                            elif index_name["index"]["name"] in params:
-                                value = params[index_expr["index"]["name"]]
-                                outter_results = self.read_elements_from_table(index_name["name"], [field_name], {"key1": value})
-                                return [outter_results[0][field_name]]
-                            else:
-                                outter_results =self.read_elements_from_table(index_name["name"], [field_name], {})
-                                return_results = []
-                                for x in outter_results:
-                                    return_results.append(x[field_name])
-                                return return_results        
-                    elif index_name["field"] is not None: #a[b.c]的形式
-                        assert isinstance(index_name["field"]["name"])
-                        assert index_name["field"]["index"] is None
-                        assert index_name["field"]["field"] is None
-                        results = self.read_elements_from_table(self.simple_table_name, index_name["name"]+"__"+index_name["field"]["name"], {})
-                        value = results[0][index_name["name"]+"__"+index_name["field"]["name"]]
-                        return [value]
-                    else:
-                        raise Exception(f"index_name['index'] is not None, but {index_name['index']}")
+                table_name, column = entity_name, prefix or "value"
+                selector = {f"key{i + 1}": key for i, key in enumerate(keys)} if keys is not None else {}
+            rows = self._read_table_cached(table_name, [column], selector, cache)
+            values.extend(row[column] for row in rows if row[column] is not None)
+        return values
+
+    def _read_table_cached(self, table_name, columns, selector, cache):
+        cache_key = (table_name, tuple(columns), tuple((column, tuple(value) if isinstance(value, list) else value)
+                                                       for column, value in selector.items()))
+        if cache_key not in cache:
+            cache[cache_key] = self.read_elements_from_table(table_name, columns, selector)
+        return cache[cache_key]
+
+    @staticmethod
+    def _get_column_prefix(field):
+        """结构体字段路径对应的列名前缀，如a.b对应a__b"""
+        names = []
+        while field is not None:
+            names.append(field["name"])
+            if field["index"] is not None: # 结构体中的mapping或数组单独成表，这里只更新记录其slot的列
+                break
+            field = field["field"]
+        return "__".join(names) if names else None
+
+    def plan_changed_reads(self, targets, block_number=None):
+        """
+        规划重新读取被改变的行需要读取的slot，格式同plan_init_storage_reads
+        Args:
+            targets: get_changed_slots的返回值
+            block_number: 读取动态数组长度的区块，None时使用pin_block固定的区块
+        """
+        plan = {"reads": [], "rows": [], "arrays": [], "tables": []}
+        for (entity_name, keys), prefixes in targets.items():
+            entity = self.meta_json["entities"][entity_name]
+            row_plan = {"reads": [], "rows": [], "arrays": [], "tables": []}
+            column_prefix = ""
+            if entity["dataType"] == "mapping":
+                key = keys if len(keys) > 1 else keys[0]
+                self._plan_mapping_row(entity_name, entity, key, row_plan)
+                if key not in self.fact_keys.setdefault(entity_name, set()): # 新出现的key
+                    self.fact_keys[entity_name].add(key)
+                    self.pending_fact_keys.setdefault(entity_name, set()).add(key)
+            elif entity["dataType"] == "staticArray" or entity["dataType"] == "dynamicArray":
+                if keys is None:
+                    self._plan_array_entity(entity, entity_name, entity["storageInfo"], row_plan)
                 else:
-                    raise Exception(f"{index_name} not found in meta")
+                    slot_int = self._get_array_element_slot(entity, entity["storageInfo"])
+                    self._plan_array_element(entity, entity_name, slot_int, keys[0], row_plan)
+            elif entity["dataType"] == "struct":
+                column_prefix = entity_name + "__"
+                self._plan_struct_entity(entity, self.simple_table_name, column_prefix, entity["storageInfo"], {"id": 1}, row_plan)
             else:
-                raise Exception(f"index_expr['index']['name'] is not a string, but {index_name}")
+                row_plan["reads"].append({"table": self.simple_table_name, "keys": {"id": 1}, "column": entity_name,
+                                          "slot_info": entity["storageInfo"], "type": entity})
+
+            if None not in prefixes: # 只写了部分字段
+                columns = [column_prefix + prefix for prefix in prefixes]
+                match = lambda item: any(item["column"] == column or item["column"].startswith(column + "__") for column in columns)
+                row_plan["reads"] = [read for read in row_plan["reads"] if match(read)]
+                row_plan["rows"] = [row for row in row_plan["rows"] if match(row)]
+                tables = {"table_" + str(row["value"]) for row in row_plan["rows"]}
+                row_plan["arrays"] = [array for array in row_plan["arrays"] if array["table"] in tables]
+            for name in plan:
+                plan[name].extend(row_plan[name])
+        self._resolve_array_lengths(plan, block_number)
+        return plan
 
     def read_elements_from_table(self, table_name, attribute_names, selector):
         """
@@ -653,109 +1199,25 @@ class StorageInfo:
         """
         if not self.db_connection:
             self.connect_db()
-        
+
+        # 先写入缓存中的数据，保证读到最新的值
+        self.table_writer.flush()
         cursor = self.db_connection.cursor()
         
         try:
-            # 构建SELECT子句
-            if not attribute_names or len(attribute_names) == 0:
-                # 如果属性名为空数组，则选择所有列
-                select_clause = "*"
+            if isinstance(attribute_names, str):
+                attribute_names = [attribute_names]
+            selector = selector or {}
+
+            if all(not isinstance(value, (dict, list)) for value in selector.values()):
+                # 只有等值条件时SQL语句的结构只取决于列名，使用缓存的语句
+                statement_key = ("select", tuple(attribute_names or []), tuple(selector.keys()))
+                sql_query = self.table_catalog.get_statement(
+                    table_name, statement_key,
+                    lambda: self._build_select_sql(table_name, attribute_names, selector)[0])
+                params = list(selector.values())
             else:
-                # 否则选择指定的属性
-                select_clause = ", ".join(attribute_names)
-            
-            # 构建WHERE子句
-            where_clause = ""
-            params = []
-            
-            if selector and len(selector) > 0:
-                # 如果有选择条件，构建WHERE子句
-                conditions = []
-                for key, value in selector.items():
-                    if isinstance(value, dict):
-                        # 处理不等式和范围查询
-                        if "op" in value:
-                            # 不等式查询: {"column": {"op": "value"}}
-                            op = value["op"]
-                            op_value = value["value"]
-                            if op in [">", "<", ">=", "<=", "!=", "LIKE"]:
-                                conditions.append(f"{key} {op} %s")
-                                params.append(op_value)
-                            else:
-                                raise ValueError(f"不支持的操作符: {op}")
-                        elif "range" in value:
-                            # 范围查询: {"column": {"range": ["min", "max"]}}
-                            range_values = value["range"]
-                            if len(range_values) == 2:
-                                min_val, max_val = range_values
-                                if min_val is not None:
-                                    conditions.append(f"{key} >= %s")
-                                    params.append(min_val)
-                                if max_val is not None:
-                                    conditions.append(f"{key} <= %s")
-                                    params.append(max_val)
-                            else:
-                                raise ValueError("范围查询需要两个值: [min, max]")
-                        elif "between" in value:
-                            # BETWEEN查询: {"column": {"between": ["min", "max"]}}
-                            between_values = value["between"]
-                            if len(between_values) == 2:
-                                conditions.append(f"{key} BETWEEN %s AND %s")
-                                params.extend(between_values)
-                            else:
-                                raise ValueError("BETWEEN查询需要两个值: [min, max]")
-                        elif "in" in value:
-                            # IN查询: {"column": {"in": ["value1", "value2"]}}
-                            in_values = value["in"]
-                            if isinstance(in_values, list) and len(in_values) > 0:
-                                placeholders = ", ".join(["%s"] * len(in_values))
-                                conditions.append(f"{key} IN ({placeholders})")
-                                params.extend(in_values)
-                            else:
-                                raise ValueError("IN查询需要非空列表")
-                        elif "not_in" in value:
-                            # NOT IN查询: {"column": {"not_in": ["value1", "value2"]}}
-                            not_in_values = value["not_in"]
-                            if isinstance(not_in_values, list) and len(not_in_values) > 0:
-                                placeholders = ", ".join(["%s"] * len(not_in_values))
-                                conditions.append(f"{key} NOT IN ({placeholders})")
-                                params.extend(not_in_values)
-                            else:
-                                raise ValueError("NOT IN查询需要非空列表")
-                        elif "is_null" in value:
-                            # IS NULL查询: {"column": {"is_null": True}}
-                            if value["is_null"]:
-                                conditions.append(f"{key} IS NULL")
-                            else:
-                                conditions.append(f"{key} IS NOT NULL")
-                        elif "is_not_null" in value:
-                            # IS NOT NULL查询: {"column": {"is_not_null": True}}
-                            if value["is_not_null"]:
-                                conditions.append(f"{key} IS NOT NULL")
-                            else:
-                                conditions.append(f"{key} IS NULL")
-                        else:
-                            raise ValueError(f"不支持的查询条件格式: {value}")
-                    elif isinstance(value, list):
-                        # 如果值是列表，使用IN操作符
-                        if len(value) > 0:
-                            placeholders = ", ".join(["%s"] * len(value))
-                            conditions.append(f"{key} IN ({placeholders})")
-                            params.extend(value)
-                        else:
-                            # 空列表，不添加条件
-                            continue
-                    else:
-                        # 否则使用等号
-                        conditions.append(f"{key} = %s")
-                        params.append(value)
-                
-                if conditions:
-                    where_clause = "WHERE " + " AND ".join(conditions)
-            
-            # 构建完整的SQL查询
-            sql_query = f"SELECT {select_clause} FROM {table_name} {where_clause}"
+                sql_query, params = self._build_select_sql(table_name, attribute_names, selector)
             
             logger.info(f"执行SQL查询: {sql_query}")
             if params:
@@ -790,9 +1252,199 @@ class StorageInfo:
         finally:
             cursor.close()
 
+    def _build_select_sql(self, table_name, attribute_names, selector):
+        # 构建SELECT子句
+        if not attribute_names or len(attribute_names) == 0:
+            # 如果属性名为空数组，则选择所有列
+            select_clause = "*"
+        else:
+            # 否则选择指定的属性
+            select_clause = ", ".join(attribute_names)
+        where_clause, params = self._build_where_clause(selector)
+        return f"SELECT {select_clause} FROM {table_name} {where_clause}", params
+
+    def _build_where_clause(self, selector):
+        """
+        根据selector构建WHERE子句，格式见read_elements_from_table
+        Returns:
+            tuple: (where_clause, params)
+        """
+        # 构建WHERE子句
+        where_clause = ""
+        params = []
+        
+        if selector and len(selector) > 0:
+            # 如果有选择条件，构建WHERE子句
+            conditions = []
+            for key, value in selector.items():
+                if isinstance(value, dict):
+                    # 处理不等式和范围查询
+                    if "op" in value:
+                        # 不等式查询: {"column": {"op": "value"}}
+                        op = value["op"]
+                        op_value = value["value"]
+                        if op in [">", "<", ">=", "<=", "!=", "LIKE"]:
+                            conditions.append(f"{key} {op} %s")
+                            params.append(op_value)
+                        else:
+                            raise ValueError(f"不支持的操作符: {op}")
+                    elif "range" in value:
+                        # 范围查询: {"column": {"range": ["min", "max"]}}
+                        range_values = value["range"]
+                        if len(range_values) == 2:
+                            min_val, max_val = range_values
+                            if min_val is not None:
+                                conditions.append(f"{key} >= %s")
+                                params.append(min_val)
+                            if max_val is not None:
+                                conditions.append(f"{key} <= %s")
+                                params.append(max_val)
+                        else:
+                            raise ValueError("范围查询需要两个值: [min, max]")
+                    elif "between" in value:
+                        # BETWEEN查询: {"column": {"between": ["min", "max"]}}
+                        between_values = value["between"]
+                        if len(between_values) == 2:
+                            conditions.append(f"{key} BETWEEN %s AND %s")
+                            params.extend(between_values)
+                        else:
+                            raise ValueError("BETWEEN查询需要两个值: [min, max]")
+                    elif "in" in value:
+                        # IN查询: {"column": {"in": ["value1", "value2"]}}
+                        in_values = value["in"]
+                        if isinstance(in_values, list) and len(in_values) > 0:
+                            placeholders = ", ".join(["%s"] * len(in_values))
+                            conditions.append(f"{key} IN ({placeholders})")
+                            params.extend(in_values)
+                        else:
+                            raise ValueError("IN查询需要非空列表")
+                    elif "not_in" in value:
+                        # NOT IN查询: {"column": {"not_in": ["value1", "value2"]}}
+                        not_in_values = value["not_in"]
+                        if isinstance(not_in_values, list) and len(not_in_values) > 0:
+                            placeholders = ", ".join(["%s"] * len(not_in_values))
+                            conditions.append(f"{key} NOT IN ({placeholders})")
+                            params.extend(not_in_values)
+                        else:
+                            raise ValueError("NOT IN查询需要非空列表")
+                    elif "is_null" in value:
+                        # IS NULL查询: {"column": {"is_null": True}}
+                        if value["is_null"]:
+                            conditions.append(f"{key} IS NULL")
+                        else:
+                            conditions.append(f"{key} IS NOT NULL")
+                    elif "is_not_null" in value:
+                        # IS NOT NULL查询: {"column": {"is_not_null": True}}
+                        if value["is_not_null"]:
+                            conditions.append(f"{key} IS NOT NULL")
+                        else:
+                            conditions.append(f"{key} IS NULL")
+                    else:
+                        raise ValueError(f"不支持的查询条件格式: {value}")
+                elif isinstance(value, list):
+                    # 如果值是列表，使用IN操作符
+                    if len(value) > 0:
+                        placeholders = ", ".join(["%s"] * len(value))
+                        conditions.append(f"{key} IN ({placeholders})")
+                        params.extend(value)
+                    else:
+                        # 空列表，不添加条件
+                        continue
+                else:
+                    # 否则使用等号
+                    conditions.append(f"{key} = %s")
+                    params.append(value)
+            
+            if conditions:
+                where_clause = "WHERE " + " AND ".join(conditions)
+        return where_clause, params
+
+    def read_elements_at_block(self, table_name, attribute_names, selector, block_number):
+        """
+        从历史表中获取指定区块时的数据，需要开启history
+        Args:
+            table_name: 表名
+            attribute_names: 要获取的属性名列表，如果为空数组则返回所有属性
+            selector: 选择条件字典，格式见read_elements_from_table
+            block_number: 区块号，返回该区块所有交易执行之后的值
+        Returns:
+            list: 查询结果列表，每个元素是一个字典
+        """
+        self._require_history_store().check_readable(table_name, block_number)
+        condition = "valid_from_block <= %s AND (valid_to_block IS NULL OR valid_to_block > %s)"
+        return self._read_history(table_name, attribute_names, selector, condition, [block_number, block_number])
+
+    def read_element_changes(self, table_name, attribute_names, selector, start_block, end_block):
+        """
+        从历史表中获取在区块范围内发生的所有改变，需要开启history
+        Args:
+            table_name: 表名
+            attribute_names: 要获取的属性名列表，如果为空数组则返回所有属性
+            selector: 选择条件字典，格式见read_elements_from_table
+            start_block: 起始区块（包含）
+            end_block: 结束区块（包含）
+        Returns:
+            list: 按主键和区块排序的版本列表，每个元素是一个字典，
+                包括valid_from_block（改变所在的区块）和valid_to_block（下一次改变的区块，当前的值为None）
+        """
+        self._require_history_store().check_readable(table_name, start_block)
+        condition = "valid_from_block BETWEEN %s AND %s"
+        return self._read_history(table_name, attribute_names, selector, condition, [start_block, end_block], changes=True)
+
+    def _require_history_store(self):
+        if self.history_store is None:
+            raise Exception("没有开启storage历史表，无法查询历史区块的数据")
+        return self.history_store
+
+    def _read_history(self, table_name, attribute_names, selector, condition, condition_params, changes=False):
+        if isinstance(attribute_names, str):
+            attribute_names = [attribute_names]
+        if not self.history_store.is_versioned(table_name):
+            raise Exception(f"表 {table_name} 没有历史表")
+        # 先写入缓存中的数据，保证历史表是最新的
+        self.table_writer.flush()
+
+        history_table = HistoryStore.get_history_table(table_name)
+        column_names = list(attribute_names) if attribute_names else list(self.table_catalog.get_columns(table_name))
+        if changes:
+            column_names += [column for column in HistoryStore.version_columns if column not in column_names]
+        where_clause, params = self._build_where_clause(selector or {})
+        where_clause = (where_clause + " AND " if where_clause else "WHERE ") + condition
+        order_columns = self.table_catalog.get_primary_keys(table_name) + ["valid_from_block"]
+        sql_query = (f"SELECT {', '.join(column_names)} FROM {history_table} {where_clause} "
+                     f"ORDER BY {', '.join(order_columns)}")
+
+        cursor = self.db_connection.cursor()
+        try:
+            logger.info(f"执行SQL查询: {sql_query}")
+            cursor.execute(sql_query, params + condition_params)
+            results = [dict(zip(column_names, row)) for row in cursor.fetchall()]
+            logger.info(f"查询完成，返回 {len(results)} 行数据")
+            return results
+        except Exception as e:
+            logger.error(f"查询历史表 {history_table} 失败: {e}")
+            raise Exception(f"查询历史表 {history_table} 失败: {e}")
+        finally:
+            cursor.close()
+
+    def compact_history(self, before_block):
+        """
+        压缩历史表，删除在before_block或之前已经结束的版本，before_block及之后的历史仍然可以查询
+        Args:
+            before_block: 压缩到的区块，不能超过已经同步的区块减去重组阈值
+        Returns:
+            int: 删除的版本数
+        """
+        synced_block = self.get_synced_block()
+        if synced_block is None or before_block > synced_block - self.revert_threshold:
+            raise Exception(f"只能压缩到已经同步的区块 {synced_block} 减去重组阈值 {self.revert_threshold} 之前的历史")
+        with self.table_writer.transaction():
+            with self.db_connection.cursor() as cursor:
+                return self._require_history_store().compact(cursor, before_block)
+
     def write_elements_to_table(self, table_name, attributes):
         """
-        将元素添加或修改到数据库表格中
+        将元素添加或修改到数据库表格中，写入先进入缓存，按批量通过upsert写入
         Args:
             table_name: 表名
             attributes: 属性名和属性值的对应字典，包括主键的值
@@ -801,49 +1453,21 @@ class StorageInfo:
         """
         if not self.db_connection:
             self.connect_db()
-        
-        cursor = self.db_connection.cursor()
-        
+
         try:
-            # 获取表的主键信息
-            primary_keys = self._get_table_primary_keys(table_name)
-            if not primary_keys:
-                raise Exception(f"无法获取表 {table_name} 的主键信息")
-            
-            # 检查是否提供了所有主键的值
-            missing_keys = [pk for pk in primary_keys if pk not in attributes]
-            if missing_keys:
-                raise Exception(f"缺少主键值: {missing_keys}")
-            
-            # 构建主键条件用于检查记录是否存在
-            pk_conditions = []
-            pk_params = []
-            for pk in primary_keys:
-                pk_conditions.append(f"{pk} = %s")
-                pk_params.append(attributes[pk])
-            
-            # 检查记录是否存在
-            check_sql = f"SELECT COUNT(*) FROM {table_name} WHERE {' AND '.join(pk_conditions)}"
-            cursor.execute(check_sql, pk_params)
-            exists = cursor.fetchone()[0] > 0
-            
-            if exists:
-                # 记录存在，执行UPDATE操作
-                return self._update_record(cursor, table_name, attributes, primary_keys)
-            else:
-                # 记录不存在，执行INSERT操作
-                return self._insert_record(cursor, table_name, attributes)
-                
+            self.table_writer.add(table_name, attributes)
+            return True
         except Exception as e:
             logger.error(f"写入表 {table_name} 失败: {e}")
-            self.db_connection.rollback()
             raise Exception(f"写入表 {table_name} 失败: {e}")
-        finally:
-            cursor.close()
+
+    def flush_writes(self):
+        """将缓存中的所有写入提交到数据库"""
+        return self.table_writer.flush()
 
     def _get_table_primary_keys(self, table_name):
         """
-        获取表的主键信息
+        从information_schema查询表的主键信息，只在表结构缓存中没有该表时调用
         Args:
             table_name: 表名
         Returns:
@@ -874,74 +1498,13 @@ class StorageInfo:
         finally:
             cursor.close()
 
-    def _insert_record(self, cursor, table_name, attributes):
-        """
-        插入新记录
-        Args:
-            cursor: 数据库游标
-            table_name: 表名
-            attributes: 属性字典
-        Returns:
-            bool: 操作是否成功
-        """
-        # 构建INSERT语句
-        columns = list(attributes.keys())
-        values = list(attributes.values())
-        placeholders = ", ".join(["%s"] * len(columns))
-        
-        insert_sql = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
-        
-        logger.info(f"执行INSERT: {insert_sql}")
-        logger.info(f"参数: {values}")
-        
-        cursor.execute(insert_sql, values)
-        self.db_connection.commit()
-        
-        logger.info(f"成功插入记录到表 {table_name}")
-        return True
-
-    def _update_record(self, cursor, table_name, attributes, primary_keys):
-        """
-        更新现有记录
-        Args:
-            cursor: 数据库游标
-            table_name: 表名
-            attributes: 属性字典
-            primary_keys: 主键列表
-        Returns:
-            bool: 操作是否成功
-        """
-        # 分离主键和非主键字段
-        pk_attributes = {pk: attributes[pk] for pk in primary_keys}
-        non_pk_attributes = {k: v for k, v in attributes.items() if k not in primary_keys}
-        
-        if not non_pk_attributes:
-            logger.info(f"没有非主键字段需要更新，跳过UPDATE操作")
-            return True
-        
-        # 构建UPDATE语句
-        set_clause = ", ".join([f"{col} = %s" for col in non_pk_attributes.keys()])
-        where_clause = " AND ".join([f"{pk} = %s" for pk in primary_keys])
-        
-        update_sql = f"UPDATE {table_name} SET {set_clause} WHERE {where_clause}"
-        
-        # 构建参数列表：先是非主键字段的值，然后是主键字段的值
-        params = list(non_pk_attributes.values()) + list(pk_attributes.values())
-        
-        logger.info(f"执行UPDATE: {update_sql}")
-        logger.info(f"参数: {params}")
-        
-        cursor.execute(update_sql, params)
-        self.db_connection.commit()
-        
-        logger.info(f"成功更新记录到表 {table_name}")
-        return True
-
     def create_table(self, table_name, attributes, primary_keys):
+        # 表结构缓存中已经有相同结构的表，说明已经创建过，不需要再访问数据库
+        if self.table_catalog.is_registered(table_name, attributes, primary_keys):
+            return
+
         if not self.db_connection:
             self.connect_db()
-        
-        cursor = self.db_connection.cursor()
 
         attributes_str = []
         has_meaning = False
@@ -951,12 +1514,14 @@ class StorageInfo:
             else:
                 attribute_str = f"{attribute[0]} {attribute[1]}"
             attributes_str.append(attribute_str)
-            if attribute[0] not in primary_keys: # 处理primary keys之外还有其他需要记录的属性，则表示该table有意义
+            if attribute[0] not in primary_keys and attribute[0] not in self.snapshot_columns: # 处理primary keys之外还有其他需要记录的属性，则表示该table有意义
                 has_meaning = True
         
-        if not has_meaning:
+        # simple_entities还记录同步到的区块，合约没有简单变量时也需要创建
+        if not has_meaning and table_name != self.simple_table_name:
             return
         
+        cursor = self.db_connection.cursor()
         primary_keys_str = ""
         if len(primary_keys) > 1:
             primary_keys_str = f"PRIMARY KEY ({', '.join(primary_keys)})"
@@ -977,8 +1542,18 @@ class StorageInfo:
              """
 
         cursor.execute(create_table_sql)
-        self.db_connection.commit()
+        # 旧版本创建的表可能没有快照列
+        for attribute in attributes:
+            if attribute[0] in self.snapshot_columns:
+                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {attribute[0]} {attribute[1]}")
+        if self.history_store is not None:
+            self.history_store.create_table(cursor, table_name, attributes, primary_keys, self.snapshot_columns)
+        # 在写入行的事务中创建时和这些行一起提交
+        if self.table_writer.transaction_depth == 0:
+            self.db_connection.commit()
         cursor.close()
+        # 新建的表（包括嵌套mapping或数组的table_<slot>表）登记到缓存，旧的语句缓存随之失效
+        self.table_catalog.register(table_name, attributes, primary_keys)
 
     def _get_mapping_attributes(self, entity, attributes, primary_keys):
         if entity["dataMeta"]["value"]["dataType"] == "mapping":
@@ -1072,12 +1647,7 @@ class StorageInfo:
                 raise Exception("bitmap is only supported for int type")
 
     def decode_input(self, tx_input):
-        contract = self.w3.eth.contract(abi=self.abi)
-        try:
-            func_obj, params = contract.decode_function_input(tx_input)
-            return func_obj.fn_name, params
-        except Exception:
-            return None, None
+        return self.abi_decoder.decode(tx_input)
 
     def extract_number(self, s):
         match = re.search(r'(\d+)$', s)
@@ -1105,9 +1675,11 @@ class StorageInfo:
         手动关闭数据库连接
         """
         if self.db_connection:
-            self.db_connection.close()
+            if getattr(self, "table_writer", None) is not None:
+                self.table_writer.flush()
+            self.db_pool.putconn(self.db_connection)
             self.db_connection = None
-            logger.info("数据库连接已关闭")
+            logger.info("数据库连接已归还到连接池")
 
     def __del__(self):
         """
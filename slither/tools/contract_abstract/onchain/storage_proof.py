@@ -1,19 +1,20 @@
 import rlp
 import pickle
 from trie import HexaryTrie
-from eth_utils import keccak, to_bytes, decode_hex, encode_hex
-import psycopg2
+from eth_utils import keccak, decode_hex, encode_hex
 from psycopg2.extras import RealDictCursor
 import logging
-import time
-from slither.tools.contract_abstract.database_manager import DatabaseManager
+from concurrent.futures import ThreadPoolExecutor
+from trie.exceptions import MissingTrieNode
+from slither.tools.contract_abstract.db_pool import get_pool
+from slither.tools.contract_abstract.onchain.trie_node_store import TrieNodeStore
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
 class StorageProof:
-    def __init__(self, block_number, contract_address, w3, db_config=None):
+    def __init__(self, block_number, contract_address, w3, db_config=None, node_cache_size=100000):
         self.block_number = block_number
         self.contract_address = contract_address
         self.w3 = w3
@@ -26,70 +27,23 @@ class StorageProof:
         }
         self.db_connection = None
 
-         # 初始化数据库管理器并设置数据库环境
-        self.db_manager = DatabaseManager(self.db_config)
-        if not self.db_manager.setup_database():
-            raise Exception("数据库环境设置失败")
+        # 同一个数据库的连接池在进程内共享，第一次获取时检查数据库环境
+        self.db_pool = get_pool(self.db_config)
+
+        # trie的节点按hash保存在数据库中，按需加载
+        self.node_store = TrieNodeStore(lambda: self.db_connection, cache_size=node_cache_size)
 
         self.init_database()
         if not self.load_trie_from_database():
-            db = {}
-            self.trie = HexaryTrie(db)
+            self.trie = HexaryTrie(self.node_store)
 
     def connect_db(self):
-        """连接到PostgreSQL数据库"""
-        max_retries = 3
-        retry_delay = 2
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"尝试连接MPT数据库: {self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}")
-                self.db_connection = psycopg2.connect(**self.db_config)
-                self.db_connection.autocommit = False
-                logger.info("成功连接到MPT数据库")
-                return self.db_connection
-            except psycopg2.OperationalError as e:
-                error_msg = str(e).lower()
-                logger.error(f"数据库连接失败 (尝试 {attempt + 1}/{max_retries}): {e}")
-                
-                if "database" in error_msg and "does not exist" in error_msg:
-                    # 尝试使用小写数据库名称连接
-                    original_db_name = self.db_config['database']
-                    lowercase_db_name = original_db_name.lower()
-                    
-                    if original_db_name != lowercase_db_name:
-                        logger.info(f"尝试使用小写数据库名称连接: {lowercase_db_name}")
-                        try:
-                            temp_config = self.db_config.copy()
-                            temp_config['database'] = lowercase_db_name
-                            self.db_connection = psycopg2.connect(**temp_config)
-                            self.db_connection.autocommit = False
-                            logger.info(f"成功连接到MPT数据库 (使用小写名称: {lowercase_db_name})")
-                            # 更新配置中的数据库名称为小写
-                            self.db_config['database'] = lowercase_db_name
-                            return self.db_connection
-                        except psycopg2.OperationalError as e2:
-                            logger.error(f"使用小写数据库名称连接也失败: {e2}")
-                    
-                    logger.error(f"数据库 {self.db_config['database']} 不存在")
-                    logger.info("请确保数据库已创建，或者检查数据库管理器是否正确运行")
-                    raise
-                elif "authentication failed" in error_msg:
-                    logger.error("数据库认证失败，请检查用户名和密码")
-                    raise
-                elif "connection refused" in error_msg:
-                    logger.error("无法连接到PostgreSQL服务，请确保服务正在运行")
-                    raise
-                elif attempt < max_retries - 1:
-                    logger.info(f"等待 {retry_delay} 秒后重试...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 指数退避
-                else:
-                    logger.error("数据库连接失败，已达到最大重试次数")
-                    raise
-            except Exception as e:
-                logger.error(f"数据库连接时发生未知错误: {e}")
-                raise
+        """从进程内共享的连接池中取出一个连接，关闭时归还到连接池"""
+        self.db_connection = self.db_pool.getconn()
+        # 连接池可能使用了小写的数据库名称
+        self.db_config['database'] = self.db_pool.db_config['database']
+        logger.info(f"成功连接到MPT数据库: {self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}")
+        return self.db_connection
 
     def init_database(self):
         """初始化数据库表结构"""
@@ -115,6 +69,20 @@ class StorageProof:
                     CREATE INDEX IF NOT EXISTS idx_contract_block 
                     ON storage_tries(contract_address, block_number)
                 """)
+
+                # 按hash保存的trie节点，所有合约和区块共享
+                TrieNodeStore.create_tables(cursor)
+
+                # 每个合约每个快照区块的根节点
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS storage_trie_roots (
+                        contract_address VARCHAR(42) NOT NULL,
+                        block_number BIGINT NOT NULL,
+                        trie_root_hash VARCHAR(66) NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (contract_address, block_number)
+                    )
+                """)
                 
                 self.db_connection.commit()
         except Exception as e:
@@ -122,7 +90,7 @@ class StorageProof:
             raise Exception(f"数据库初始化失败: {e}")
 
     def save_trie_to_database(self):
-        """将当前的storage trie保存到数据库"""
+        """将当前的storage trie保存到数据库，只写入上次保存之后新产生的节点和该区块的根"""
         if not self.db_config:
             raise Exception("数据库配置未设置")
         
@@ -130,59 +98,74 @@ class StorageProof:
             self.connect_db()
         
         try:
-            # 初始化数据库表
-            self.init_database()
-            
-            # 序列化trie数据
-            trie_data = pickle.dumps(self.trie.db)
             trie_root = encode_hex(self.trie.root_hash)
             
             with self.db_connection.cursor() as cursor:
+                written = self.node_store.flush(cursor)
                 cursor.execute("""
-                    INSERT INTO storage_tries 
-                    (contract_address, block_number, trie_data, trie_root_hash)
-                    VALUES (%s, %s, %s, %s)
+                    INSERT INTO storage_trie_roots 
+                    (contract_address, block_number, trie_root_hash)
+                    VALUES (%s, %s, %s)
                     ON CONFLICT (contract_address, block_number) 
                     DO UPDATE SET 
-                        trie_data = EXCLUDED.trie_data,
                         trie_root_hash = EXCLUDED.trie_root_hash,
                         created_at = CURRENT_TIMESTAMP
-                """, (self.contract_address, self.block_number, trie_data, trie_root))
+                """, (self.contract_address, self.block_number, trie_root))
                 
                 self.db_connection.commit()
-                print(f"Trie已保存到数据库: 合约={self.contract_address}, 区块={self.block_number}")
+                self.node_store.mark_saved()
+                print(f"Trie已保存到数据库: 合约={self.contract_address}, 区块={self.block_number}, 新节点={written}")
                 
         except Exception as e:
             self.db_connection.rollback()
             raise Exception(f"保存trie到数据库失败: {e}")
 
     def load_trie_from_database(self):
-        """从数据库加载storage trie"""
+        """从数据库加载storage trie，只读取根，节点在访问时按需加载"""
         if not self.db_connection:
             self.connect_db()
         
         try:
             with self.db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
-                    SELECT trie_data, trie_root_hash 
-                    FROM storage_tries 
+                    SELECT trie_root_hash 
+                    FROM storage_trie_roots 
                     WHERE contract_address = %s AND block_number = %s
                 """, (self.contract_address, self.block_number))
                 
                 result = cursor.fetchone()
                 if result:
-                    # 反序列化trie数据
-                    trie_db = pickle.loads(result['trie_data'])
-                    self.trie = HexaryTrie(trie_db)
+                    self.trie = HexaryTrie(self.node_store, root_hash=decode_hex(result['trie_root_hash']))
                     print(f"Trie已从数据库加载: 合约={self.contract_address}, 区块={self.block_number}")
                     return True
-                else:
-                    print(f"数据库中未找到trie: 合约={self.contract_address}, 区块={self.block_number}")
-                    return False
+
+            if self.migrate_legacy_trie():
+                return True
+            print(f"数据库中未找到trie: 合约={self.contract_address}, 区块={self.block_number}")
+            return False
                     
         except Exception as e:
             raise Exception(f"从数据库加载trie失败: {e}")
 
+    def migrate_legacy_trie(self):
+        """将旧版本storage_tries表中pickle保存的整个trie迁移到节点表"""
+        with self.db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT trie_data, trie_root_hash 
+                FROM storage_tries 
+                WHERE contract_address = %s AND block_number = %s
+            """, (self.contract_address, self.block_number))
+            result = cursor.fetchone()
+        if not result:
+            return False
+
+        # 反序列化trie数据
+        self.node_store.add_nodes(pickle.loads(result['trie_data']))
+        self.trie = HexaryTrie(self.node_store, root_hash=decode_hex(result['trie_root_hash']))
+        self.save_trie_to_database()
+        logger.info(f"已将旧格式的trie迁移到节点表: 合约={self.contract_address}, 区块={self.block_number}")
+        return True
+
     def get_trie_info_from_database(self):
         """从数据库获取trie信息（不加载完整trie）"""
         if not self.db_connection:
@@ -192,7 +175,7 @@ class StorageProof:
             with self.db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
                     SELECT trie_root_hash, created_at 
-                    FROM storage_tries 
+                    FROM storage_trie_roots 
                     WHERE contract_address = %s AND block_number = %s
                 """, (self.contract_address, self.block_number))
                 
@@ -217,7 +200,7 @@ class StorageProof:
             with self.db_connection.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute("""
                     SELECT contract_address, block_number, trie_root_hash, created_at 
-                    FROM storage_tries 
+                    FROM storage_trie_roots 
                     ORDER BY created_at DESC
                 """)
                 
@@ -228,18 +211,23 @@ class StorageProof:
             raise Exception(f"获取trie列表失败: {e}")
 
     def delete_trie_from_database(self):
-        """从数据库删除当前的trie"""
+        """从数据库删除当前区块的trie根，节点可能被其他区块共享，不删除"""
         if not self.db_connection:
             self.connect_db()
         
         try:
             with self.db_connection.cursor() as cursor:
+                cursor.execute("""
+                    DELETE FROM storage_trie_roots 
+                    WHERE contract_address = %s AND block_number = %s
+                """, (self.contract_address, self.block_number))
+                deleted = cursor.rowcount
                 cursor.execute("""
                     DELETE FROM storage_tries 
                     WHERE contract_address = %s AND block_number = %s
                 """, (self.contract_address, self.block_number))
                 
-                if cursor.rowcount > 0:
+                if deleted + cursor.rowcount > 0:
                     self.db_connection.commit()
                     print(f"Trie已从数据库删除: 合约={self.contract_address}, 区块={self.block_number}")
                     return True
@@ -273,18 +261,165 @@ class StorageProof:
         )
         return result
 
+    def get_storage_proofs(self, slots, chunk_size=100, max_workers=4):
+        """
+        一次eth_getProof请求多个slot，按chunk_size拆分以满足节点对key数量的限制
+
+        Args:
+            slots: slot列表，每个元素可以是int、hex字符串或bytes
+            chunk_size: 每个eth_getProof请求的slot数
+            max_workers: 并发请求数
+
+        Returns:
+            dict: {"storageHash": 账户storage根, "storageProof": [{"slot", "value", "proof"}, ...]}，与slots顺序一致
+        """
+        slots = [self.slot_to_hex(slot) for slot in slots]
+        chunks = [slots[i:i + chunk_size] for i in range(0, len(slots), chunk_size)] or [[]]
+
+        def request_chunk(chunk):
+            return self.w3.manager.request_blocking(
+                "eth_getProof",
+                [self.contract_address, chunk, hex(self.block_number)]
+            )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(request_chunk, chunks))
+
+        storage_hash = encode_hex(self._to_bytes(results[0]["storageHash"]))
+        storage_proofs = []
+        for chunk, result in zip(chunks, results):
+            if encode_hex(self._to_bytes(result["storageHash"])) != storage_hash:
+                raise Exception("eth_getProof返回的storageHash不一致")
+            for slot, item in zip(chunk, result["storageProof"]):
+                storage_proofs.append({
+                    "slot": slot,
+                    "value": self._to_int(item["value"]),
+                    "proof": [self._to_bytes(node) for node in item["proof"]]
+                })
+        logger.info(f"通过 {len(chunks)} 次eth_getProof获取了 {len(storage_proofs)} 个slot的proof")
+        return {"storageHash": storage_hash, "storageProof": storage_proofs}
+
+    def verify_storage_proofs(self, storage_proofs, root_hash, max_workers=4):
+        """
+        并行验证多个slot的proof，所有proof的节点放在同一个按hash索引的缓存中，
+        共享的上层节点只解码和hash一次
+
+        Args:
+            storage_proofs: get_storage_proofs返回的storageProof列表
+            root_hash: storage根，hex字符串或bytes
+
+        Returns:
+            list: 每个proof是否有效，与storage_proofs顺序一致
+        """
+        nodes = {}
+        for item in storage_proofs:
+            for node in item["proof"]:
+                if node not in nodes:
+                    nodes[node] = keccak(node)
+        node_cache = {node_hash: node for node, node_hash in nodes.items()}
+        logger.info(f"{len(storage_proofs)} 个proof共 {sum(len(item['proof']) for item in storage_proofs)} 个节点，去重后 {len(node_cache)} 个")
+
+        root_hash = self._to_bytes(root_hash)
+
+        def verify(item):
+            return self._verify_with_nodes(node_cache, root_hash, self.slot_to_key(item["slot"]),
+                                           self.encode_storage_value(item["value"]))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(verify, storage_proofs))
+
+    @staticmethod
+    def _verify_with_nodes(node_cache, root_hash, key, encoded_value):
+        """在proof节点组成的只读trie上查找key，路径上缺少节点说明proof无效"""
+        try:
+            trie = HexaryTrie(node_cache, root_hash=root_hash)
+            return trie.get(key) == (encoded_value or b"")
+        except MissingTrieNode:
+            return False
+
+    @staticmethod
+    def slot_to_hex(slot):
+        if isinstance(slot, (bytes, bytearray)):
+            slot = int.from_bytes(slot, "big")
+        elif isinstance(slot, str):
+            slot = int(slot, 16)
+        return "0x" + slot.to_bytes(32, byteorder="big").hex()
+
+    @staticmethod
+    def _to_bytes(value):
+        if isinstance(value, str):
+            return decode_hex(value)
+        return bytes(value)
+
+    @staticmethod
+    def _to_int(value):
+        if isinstance(value, int):
+            return value
+        if isinstance(value, str):
+            return int(value, 16) if value not in ("", "0x") else 0
+        return int.from_bytes(value, "big")
+
+    @staticmethod
+    def slot_to_key(slot):
+        """slot在storage trie中的key：keccak(pad32(slot))，slot可以是int、hex字符串或bytes"""
+        if isinstance(slot, str):
+            slot = int(slot, 16)
+        if isinstance(slot, int):
+            slot = slot.to_bytes(32, byteorder="big")
+        return keccak(bytes(slot).rjust(32, b"\x00"))
+
+    @staticmethod
+    def encode_storage_value(value):
+        """
+        slot的值在trie中的编码：RLP(去掉前导0的大端bytes)，值为0时返回None表示删除
+        Args:
+            value: int、hex字符串或bytes
+        """
+        if isinstance(value, str):
+            value = int(value, 16) if value not in ("", "0x") else 0
+        elif isinstance(value, (bytes, bytearray)):
+            value = int.from_bytes(value, "big")
+        if value == 0:
+            return None
+        return rlp.encode(value.to_bytes((value.bit_length() + 7) // 8, byteorder="big"))
+
     def update_storage(self, slot, value_hex: str):
         # slot 编码：keccak(pad32(slot))
-        key = keccak(to_bytes(slot).rjust(32, b"\x00"))
+        key = self.slot_to_key(slot)
 
-        # value 编码：RLP(32字节)
-        value = int(value_hex, 16)
-        if value == 0:
+        # value 编码：RLP(去掉前导0的bytes)，与以太坊storage trie一致
+        encoded_value = self.encode_storage_value(value_hex)
+        if encoded_value is None:
             self.trie.delete(key)
         else:
-            encoded_value = rlp.encode(to_bytes(value).rjust(32, b"\x00"))
             self.trie.set(key, encoded_value)
 
+    def update_storage_batch(self, changes):
+        """
+        批量更新一个区块内的所有slot，按key排序后在squash_changes中写入，
+        中间节点不会写入节点存储，区块结束时只计算一次新的根
+
+        Args:
+            changes: (slot, value)列表或者slot到value的字典，同一个slot以最后一次写入为准
+
+        Returns:
+            str: 更新后的根hash，可以与eth_getProof返回的storageHash比较
+        """
+        if isinstance(changes, dict):
+            changes = changes.items()
+        latest = {}
+        for slot, value in changes:
+            latest[self.slot_to_key(slot)] = self.encode_storage_value(value)
+
+        with self.trie.squash_changes() as memory_trie:
+            for key in sorted(latest):
+                encoded_value = latest[key]
+                if encoded_value is None:
+                    memory_trie.delete(key)
+                else:
+                    memory_trie.set(key, encoded_value)
+        return self.get_local_root()
+
     def sync_slot(self, slot: int):
         value = self.get_storage_value(slot)
         self.update_storage(slot, value)
@@ -322,12 +457,12 @@ class StorageProof:
             slot = hex(slot)
         
         # 将slot编码为keccak哈希
-        key = keccak(to_bytes(slot).rjust(32, b"\x00"))
+        key = self.slot_to_key(slot)
         
         try:
             # 从trie中获取value
             encoded_value = self.trie.get(key)
-            if encoded_value is None:
+            if not encoded_value: # 不存在的key返回b''
                 return None
             
             # 解码RLP编码的value
@@ -349,7 +484,7 @@ class StorageProof:
             slot = hex(slot)
         
         # 将slot编码为keccak哈希
-        key = keccak(to_bytes(slot).rjust(32, b"\x00"))
+        key = self.slot_to_key(slot)
         
         try:
             # 生成proof
@@ -362,7 +497,7 @@ class StorageProof:
                 "slot": slot,
                 "key": encode_hex(key),
                 "value": encode_hex(value) if value is not None else None,
-                "proof": [encode_hex(p) for p in proof],
+                "proof": [encode_hex(rlp.encode(p)) for p in proof],
                 "root": encode_hex(self.trie.root_hash)
             }
         except Exception as e:
@@ -387,22 +522,16 @@ class StorageProof:
             value = decode_hex(value)
         
         # 将slot编码为keccak哈希
-        key = keccak(to_bytes(slot).rjust(32, b"\x00"))
+        key = self.slot_to_key(slot)
         
         try:
             # 解码proof
             decoded_proof = [decode_hex(p) for p in proof]
+            node_cache = {keccak(node): node for node in decoded_proof}
             
-            # 验证proof
-            if value is None:
-                # 验证不存在的情况
-                result = self.trie.verify_proof(decode_hex(root_hash), key, None, decoded_proof)
-            else:
-                # 验证存在的情况
-                encoded_value = rlp.encode(value)
-                result = self.trie.verify_proof(decode_hex(root_hash), key, encoded_value, decoded_proof)
-            
-            return result
+            # 验证proof，value为None时验证不存在的情况
+            encoded_value = rlp.encode(value) if value is not None else None
+            return self._verify_with_nodes(node_cache, decode_hex(root_hash), key, encoded_value)
         except Exception as e:
             logger.error(f"验证proof失败: {e}")
             return False
@@ -443,27 +572,42 @@ class StorageProof:
         Returns:
             dict: 比较结果
         """
-        if isinstance(slot, int):
-            slot = hex(slot)
-        
-        # 获取本地trie的value
-        local_value = self.get_value_from_trie(slot)
-        
-        # 获取链上的value
-        onchain_value = self.get_storage_value(slot)
-        
-        # 获取链上的proof
-        onchain_proof = self.get_storage_proof(slot)
-        
-        return {
-            "slot": slot,
-            "local_value": encode_hex(local_value) if local_value is not None else None,
-            "onchain_value": encode_hex(onchain_value) if onchain_value is not None else None,
-            "values_match": local_value == onchain_value,
-            "onchain_proof": onchain_proof
-        }
+        return self.batch_compare_with_onchain([slot])[0]
 
-    def batch_get_storage_with_proofs(self, slots):
+    def batch_compare_with_onchain(self, slots, chunk_size=100, max_workers=4):
+        """
+        批量比较本地trie和链上数据：通过少量多key的eth_getProof获取链上的值和proof，
+        并行验证proof后与本地trie的值比较
+        Args:
+            slots: slot列表，每个元素可以是int或hex字符串
+            chunk_size: 每个eth_getProof请求的slot数
+            max_workers: 并发数
+        Returns:
+            list: 每个slot的比较结果
+        """
+        onchain = self.get_storage_proofs(slots, chunk_size=chunk_size, max_workers=max_workers)
+        proofs_valid = self.verify_storage_proofs(onchain["storageProof"], onchain["storageHash"], max_workers=max_workers)
+        roots_match = onchain["storageHash"] == self.get_local_root()
+
+        results = []
+        for slot, item, proof_valid in zip(slots, onchain["storageProof"], proofs_valid):
+            local_value = self.get_value_from_trie(item["slot"])
+            onchain_value = self.encode_storage_value(item["value"])
+            onchain_value = rlp.decode(onchain_value) if onchain_value is not None else None
+            results.append({
+                "slot": hex(slot) if isinstance(slot, int) else slot,
+                "local_value": encode_hex(local_value) if local_value is not None else None,
+                "onchain_value": encode_hex(onchain_value) if onchain_value is not None else None,
+                "values_match": local_value == onchain_value,
+                "proof_valid": proof_valid,
+                "roots_match": roots_match,
+                "onchain_proof": [encode_hex(node) for node in item["proof"]]
+            })
+        mismatched = sum(1 for result in results if not result["values_match"] or not result["proof_valid"])
+        logger.info(f"比较了 {len(results)} 个slot，{mismatched} 个不一致或proof无效")
+        return results
+
+    def batch_get_storage_with_proofs(self, slots, max_workers=4):
         """
         批量获取多个slot的value和proof
         Args:
@@ -471,16 +615,32 @@ class StorageProof:
         Returns:
             list: 包含每个slot的value和proof的列表
         """
+        root = self.get_local_root()
         results = []
+        storage_proofs = []
         for slot in slots:
-            result = self.get_storage_with_proof(slot)
-            if result is not None:
-                results.append(result)
-            else:
-                results.append({
-                    "slot": hex(slot) if isinstance(slot, int) else slot,
-                    "error": "Failed to get storage with proof"
-                })
+            slot_hex = hex(slot) if isinstance(slot, int) else slot
+            try:
+                key = self.slot_to_key(slot)
+                proof = self.trie.get_proof(key)
+                value = self.get_value_from_trie(slot)
+            except Exception as e:
+                logger.error(f"生成proof失败: {e}")
+                results.append({"slot": slot_hex, "error": "Failed to get storage with proof"})
+                continue
+            storage_proofs.append({"slot": slot, "value": value or b"", "proof": [rlp.encode(node) for node in proof]})
+            results.append({
+                "slot": slot_hex,
+                "value": encode_hex(value) if value is not None else None,
+                "proof": [encode_hex(rlp.encode(node)) for node in proof],
+                "root": root
+            })
+
+        # 所有proof一起验证，共享的节点只处理一次
+        verified = iter(self.verify_storage_proofs(storage_proofs, root, max_workers=max_workers))
+        for result in results:
+            if "error" not in result:
+                result["verified"] = next(verified)
         return results
 
     def export_proof_data(self, slot, output_file=None):
@@ -508,9 +668,9 @@ class StorageProof:
         手动关闭数据库连接
         """
         if self.db_connection:
-            self.db_connection.close()
+            self.db_pool.putconn(self.db_connection)
             self.db_connection = None
-            logger.info("数据库连接已关闭")
+            logger.info("数据库连接已归还到连接池")
 
     def __del__(self):
         """
@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import threading
+from slither.tools.contract_abstract.onchain.fair_scheduler import FairScheduler
+from slither.tools.contract_abstract.onchain.head_follower import HeadFollower
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STAGES = ["head", "ingest", "plan", "read", "write"]
+
+
+class SyncPipeline:
+    """
+    在同一个asyncio事件循环中把一个合约的交易获取和storage同步连成流水线：
+    ingest(从Etherscan获取交易并写入交易表) -> plan(解码交易，规划被改变的行和slot)
+    -> read(在交易所在区块上批量读取slot) -> write(写入storage表并推进水位线)
+    链头事件由SyncCoordinator送入ingest队列，阶段之间是有界队列，下游处理不过来时上游在put上等待；
+    RPC和数据库调用是阻塞的，在线程中执行，有调度器时由调度器在多个合约之间分配并发数。
+    队列中除了区块还有两种标记：("tip", 区块号, hash)表示交易表已经完整到该区块，("reorg", 祖先区块号)表示需要回滚，
+    它们和区块按顺序经过所有阶段，所以回滚总是发生在之前排队的区块写入之后
+    """
+
+    def __init__(self, transaction_info, storage_info, follower, name=None, queue_size=16, ingest_window=10000):
+        """
+        Args:
+            transaction_info: TransactionInfo，只在ingest阶段使用
+            storage_info: StorageInfo，plan和write阶段共用数据库连接，通过db_lock串行
+            follower: 多个合约共享的HeadFollower，由SyncCoordinator跟踪链头
+            name: 合约名，用于日志和调度
+            queue_size: 每个队列最多缓存的条目数
+            ingest_window: 追赶时每次从Etherscan获取的区块数
+        """
+        self.transaction_info = transaction_info
+        self.storage_info = storage_info
+        self.follower = follower
+        self.name = name or transaction_info.address
+        self.queue_size = queue_size
+        self.ingest_window = ingest_window
+        self.progress = dict.fromkeys(STAGES) # 每个阶段已经处理完的最高区块
+        self.queues = {}
+        self.db_lock = threading.Lock() # StorageInfo的数据库连接和table_writer不能在多个线程中同时使用
+        self.follower_lock = threading.Lock() # 由SyncCoordinator替换为和poll共用的锁
+        self.scheduler = None # FairScheduler，由SyncCoordinator设置
+        self.written = None # write阶段推进时通知plan阶段
+        self.rollbacks_written = 0 # write阶段已经完成的回滚次数
+        self.tx_synced = None
+
+    def get_backlog(self):
+        """storage落后链头的区块数"""
+        if self.progress["head"] is None or self.progress["write"] is None:
+            return 0
+        return max(self.progress["head"] - self.progress["write"], 0)
+
+    def get_status(self):
+        """
+        Returns:
+            dict: 链头区块、各阶段处理到的区块和落后链头的区块数、各队列中等待的条目数
+        """
+        head = self.progress["head"]
+        stages = {stage: {"block": block, "lag": head - block if head is not None and block is not None else None}
+                  for stage, block in self.progress.items()}
+        return {"head": head, "stages": stages, "queues": {name: queue.qsize() for name, queue in self.queues.items()}}
+
+    async def _call(self, func, *args):
+        """在线程中执行阻塞调用，有调度器时按落后的区块数排队"""
+        if self.scheduler is None:
+            return await asyncio.to_thread(func, *args)
+        return await self.scheduler.run(self.name, self.get_backlog(), func, *args)
+
+    async def start(self):
+        """
+        创建队列，检查启动时已经保存的交易是否被重组，送入追赶到链头的事件；
+        需要在共享的follower开始跟踪之后、on_head_event之前调用
+        """
+        # 链头事件很小，ingest队列不限长度，一个合约处理得慢时不会阻塞其他合约的链头事件
+        self.queues = {stage: asyncio.Queue(maxsize=0 if stage == "ingest" else self.queue_size) for stage in STAGES[1:]}
+        self.written = asyncio.Condition()
+        self.tx_synced, ancestor, tip = await asyncio.to_thread(self._start)
+        if ancestor is not None:
+            self.queues["ingest"].put_nowait(("reorg", ancestor))
+        self.queues["ingest"].put_nowait(("advance", self.tx_synced + 1, tip))
+
+    def _start(self):
+        """
+        确定交易表和storage表已经完整的区块
+        Returns:
+            tuple: (交易表已经完整的区块, 启动时发现的重组的共同祖先，没有重组时为None, 链头区块)
+        """
+        storage_synced = self.storage_info.get_synced_block()
+        if storage_synced is None:
+            raise Exception(f"{self.name}: storage还没有初始同步")
+        self.storage_info.check_reorg()
+        storage_synced = self.storage_info.get_synced_block()
+        self.progress.update(plan=storage_synced, read=storage_synced, write=storage_synced)
+
+        # 最新区块的交易可能只保存了一部分，从该区块开始重新获取，重复的交易在写入时跳过
+        latest_block = self.transaction_info.get_latest_block_number()
+        if latest_block is None:
+            raise Exception(f"{self.name}: 无法获取本地最新区块号")
+        deployment_block = self.transaction_info.get_contract_creation_block()
+        if deployment_block is None:
+            raise Exception(f"{self.name}: 无法获取合约部署区块号")
+        tx_synced = max(latest_block, deployment_block) - 1
+        # 共享的follower从链头开始跟踪，用单独的follower检查该合约已经保存的交易所在区块
+        threshold = self.transaction_info.revert_threshold
+        checker = HeadFollower(self.follower.w3, revert_threshold=threshold)
+        ancestor = checker.start(tx_synced, self.transaction_info.get_block_hashes(tx_synced - threshold, tx_synced))
+        with self.follower_lock:
+            tip = self.follower.blocks[-1][0]
+        self.progress.update(head=tip, ingest=tx_synced)
+        logger.info(f"{self.name}: 交易表完整到区块 {tx_synced}，storage同步到区块 {storage_synced}")
+        return tx_synced, ancestor, tip
+
+    def on_head_event(self, event, head):
+        """SyncCoordinator收到链头事件时调用"""
+        self.progress["head"] = head
+        self.queues["ingest"].put_nowait(event)
+
+    async def run(self):
+        """运行各个阶段，任意阶段抛出异常时取消其他阶段并抛出该异常"""
+        await run_tasks([self.ingest_stage(self.tx_synced), self.plan_stage(), self.read_stage(), self.write_stage()])
+
+    def _find_orphaned(self, txs):
+        with self.follower_lock:
+            return [tx for tx in txs if not self.follower.is_canonical(int(tx["blockNumber"]), tx.get("blockHash"))]
+
+    async def ingest_stage(self, tx_synced):
+        # 先把交易表中已有而storage还没有重放的区块送入下游
+        storage_synced = self.progress["write"]
+        if storage_synced < tx_synced:
+            await self._emit_blocks(storage_synced + 1, tx_synced)
+        while True:
+            event = await self.queues["ingest"].get()
+            if event[0] == "reorg":
+                if event[1] < tx_synced:
+                    await self._call(self.transaction_info.rollback_to_block, event[1])
+                    tx_synced = event[1]
+                    self.progress["ingest"] = tx_synced
+                await self.queues["plan"].put(event)
+                continue
+
+            # Etherscan可能落后于RPC节点，只获取Etherscan已经索引的区块
+            etherscan_latest = await self._call(self.transaction_info.get_etherscan_latest_block)
+            if etherscan_latest is None:
+                raise Exception("无法获取Etherscan最新区块号")
+            latest_block = min(event[2], etherscan_latest)
+            while tx_synced < latest_block:
+                end_block = min(tx_synced + self.ingest_window, latest_block)
+                txs = await self._call(self.transaction_info.get_transactions_from_etherscan, tx_synced + 1, end_block)
+                orphaned = await asyncio.to_thread(self._find_orphaned, txs)
+                if orphaned:
+                    # Etherscan还没有更新重组之后的区块，下一个链头事件时再获取
+                    logger.warning(f"{self.name}: Etherscan返回了 {len(orphaned)} 条已经被重组的交易，稍后重试")
+                    break
+                if txs:
+                    saved_count = await self._call(self.transaction_info.save_transactions_to_db, txs)
+                    logger.info(f"{self.name}: 区块 {tx_synced + 1} - {end_block} 保存 {saved_count} 条交易")
+                await self._emit_blocks(tx_synced + 1, end_block)
+                tx_synced = end_block
+
+    async def _emit_blocks(self, start_block, end_block):
+        """从交易表中按区块读取交易送入plan队列，最后送入tip标记"""
+        blocks = self.transaction_info.iter_blocks(start_block, end_block, fetch_size=self.storage_info.replay_fetch_size)
+        while True:
+            item = await self._call(next, blocks, None)
+            if item is None:
+                break
+            await self.queues["plan"].put(("block", item[0], item[1]))
+        block_hash = await asyncio.to_thread(self.follower.get_block_hash, end_block)
+        await self.queues["plan"].put(("tip", end_block, block_hash))
+        self.progress["ingest"] = end_block
+
+    async def plan_stage(self):
+        planned = self.progress["plan"]
+        rollbacks = 0
+        while True:
+            item = await self.queues["plan"].get()
+            if item[0] == "reorg":
+                planned = min(planned, item[1])
+                rollbacks += 1
+            elif item[0] == "block":
+                block, transactions = item[1], item[2]
+                if block <= planned: # 重新获取的最新区块已经重放过
+                    continue
+                if self.storage_info.sync_mode == "trace":
+                    item = ("block", block, transactions[0]["block_hash"], transactions)
+                else:
+                    if self.storage_info.needs_table_state(transactions):
+                        # index要从storage表中读取，等上一个区块（以及之前的回滚）写入之后再规划
+                        async with self.written:
+                            await self.written.wait_for(lambda: self.rollbacks_written >= rollbacks
+                                                        and self.progress["write"] >= planned)
+                    plan, pending_fact_keys = await self._call(self._plan_block, block, transactions)
+                    item = ("block", block, transactions[0]["block_hash"], plan, pending_fact_keys)
+                planned = block
+            await self.queues["read"].put(item)
+            self.progress["plan"] = planned if item[0] != "tip" else max(planned, item[1])
+
+    def _plan_block(self, block_number, transactions):
+        """
+        Returns:
+            tuple: (读取规划，区块没有改变storage时为None, 该区块新出现的key)
+        """
+        with self.db_lock:
+            targets = self.storage_info.get_changed_slots(transactions)
+            plan = self.storage_info.plan_changed_reads(targets, block_number) if targets else None
+            pending_fact_keys, self.storage_info.pending_fact_keys = self.storage_info.pending_fact_keys, {}
+        return plan, pending_fact_keys
+
+    async def read_stage(self):
+        while True:
+            item = await self.queues["read"].get()
+            if item[0] == "block" and self.storage_info.sync_mode != "trace" and item[3] is not None:
+                block, plan = item[1], item[3]
+                reads = [(read["slot_info"], read["type"]) for read in plan["reads"]]
+                values = await self._call(self.storage_info.entity.get_storage_values, reads, block)
+                # 行需要的表由写入阶段在事务中创建
+                item = item[:3] + (self.storage_info._fan_in_rows(plan, values), item[4], plan["tables"])
+            await self.queues["write"].put(item)
+            self.progress["read"] = item[1] if item[0] != "reorg" else min(self.progress["read"], item[1])
+
+    async def write_stage(self):
+        while True:
+            item = await self.queues["write"].get()
+            block = await self._call(self._write_item, item)
+            async with self.written:
+                self.progress["write"] = block
+                if item[0] == "reorg":
+                    self.rollbacks_written += 1
+                self.written.notify_all()
+
+    def _write_item(self, item):
+        """
+        Returns:
+            int: storage表写到的区块
+        """
+        with self.db_lock:
+            if item[0] == "reorg":
+                self.storage_info.rollback_to_block(item[1])
+                return min(self.progress["write"], item[1])
+            if item[0] == "tip":
+                if item[1] > self.progress["write"]:
+                    with self.storage_info.table_writer.transaction():
+                        self.storage_info._write_sync_block(item[1], item[2])
+                return max(self.progress["write"], item[1])
+            block, block_hash = item[1], item[2]
+            if self.storage_info.sync_mode == "trace":
+                self.storage_info.apply_block_trace(block, block_hash, item[3])
+            elif item[3] is not None:
+                self.storage_info.pending_fact_keys = item[4]
+                self.storage_info._write_block_rows(block, block_hash, item[3], item[5])
+            return block
+
+
+async def run_tasks(coroutines):
+    """并发运行多个不会结束的协程，任意一个抛出异常时取消其他协程并抛出该异常"""
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class SyncCoordinator:
+    """
+    在一个进程中同步多个合约：所有合约共享一个HeadFollower跟踪链头，链头事件广播给每个合约的流水线，
+    有max_concurrency时各合约的阻塞调用由FairScheduler按落后的区块数分配并发数
+    """
+
+    def __init__(self, follower, pipelines, max_concurrency=None, status_interval=30):
+        """
+        Args:
+            follower: 共享的HeadFollower
+            pipelines: 每个合约的SyncPipeline
+            max_concurrency: 所有合约同时执行的阻塞调用数，None表示不限制
+            status_interval: 每隔多少秒输出一次各合约各阶段的进度和延迟
+        """
+        self.follower = follower
+        self.pipelines = pipelines
+        self.status_interval = status_interval
+        self.follower_lock = threading.Lock() # poll在线程中修改follower的区块缓冲区
+        self.scheduler = FairScheduler(max_concurrency) if max_concurrency else None
+        for pipeline in pipelines:
+            pipeline.follower_lock = self.follower_lock
+            pipeline.scheduler = self.scheduler
+
+    def get_status(self):
+        """
+        Returns:
+            dict: 合约名 -> SyncPipeline.get_status()
+        """
+        return {pipeline.name: pipeline.get_status() for pipeline in self.pipelines}
+
+    async def run(self):
+        """从当前链头开始跟踪，启动所有合约的流水线，任意合约出错时停止所有流水线并抛出异常"""
+        head = await asyncio.to_thread(lambda: self.follower.w3.eth.block_number)
+        await asyncio.to_thread(self.follower.start, head)
+        await asyncio.gather(*(pipeline.start() for pipeline in self.pipelines))
+        await run_tasks([self.head_stage(), self.status_stage()] + [pipeline.run() for pipeline in self.pipelines])
+
+    def _poll(self):
+        with self.follower_lock:
+            event = self.follower.poll()
+            return event, self.follower.blocks[-1][0]
+
+    async def head_stage(self):
+        while True:
+            event, head = await asyncio.to_thread(self._poll)
+            if event is None:
+                await asyncio.sleep(self.follower.poll_interval)
+                continue
+            for pipeline in self.pipelines:
+                pipeline.on_head_event(event, head)
+
+    async def status_stage(self):
+        while True:
+            await asyncio.sleep(self.status_interval)
+            for name, status in self.get_status().items():
+                lags = ", ".join(f"{stage} {info['lag']}" for stage, info in status["stages"].items() if stage != "head")
+                queues = ", ".join(f"{queue} {size}" for queue, size in status["queues"].items())
+                logger.info(f"{name}: 链头区块 {status['head']}，各阶段落后区块数: {lags}；队列长度: {queues}")
@@ -0,0 +1,52 @@
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class SyncWatermark:
+    """
+    同步进度的水位线，按名字记录已经处理到的区块号和区块hash，保存在sync_watermarks表中，
+    和对应的数据在同一个事务中写入，重启之后从水位线之后继续
+    """
+
+    def __init__(self, get_connection):
+        """
+        Args:
+            get_connection: 返回当前数据库连接的函数
+        """
+        self.get_connection = get_connection
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_watermarks (
+                name VARCHAR(128) PRIMARY KEY,
+                block_number BIGINT NOT NULL,
+                block_hash VARCHAR(66),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+    def get(self, name):
+        """
+        Returns:
+            tuple: (block_number, block_hash)，没有记录时返回None
+        """
+        with self.get_connection().cursor() as cursor:
+            cursor.execute("SELECT block_number, block_hash FROM sync_watermarks WHERE name = %s", (name,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return int(row[0]), row[1]
+
+    def set(self, cursor, name, block_number, block_hash=None):
+        """写入水位线，不提交事务，由调用者和数据一起提交"""
+        cursor.execute("""
+            INSERT INTO sync_watermarks (name, block_number, block_hash, updated_at)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (name) DO UPDATE SET
+                block_number = EXCLUDED.block_number,
+                block_hash = EXCLUDED.block_hash,
+                updated_at = EXCLUDED.updated_at
+        """, (name, block_number, block_hash))
@@ -0,0 +1,93 @@
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class TableCatalog:
+    """进程内的表结构缓存，保存每个表的列、主键以及生成好的SQL语句"""
+
+    def __init__(self, load_primary_keys=None):
+        """
+        Args:
+            load_primary_keys: 缓存中没有该表时，从数据库查询主键的函数
+        """
+        self.load_primary_keys = load_primary_keys
+        self.tables = {} # 表名 -> {"columns": [...], "column_types": {...}, "primary_keys": [...], "statements": {...}}
+
+    def register(self, table_name, attributes, primary_keys):
+        """
+        登记表结构，结构变化时清空该表缓存的SQL语句
+        Args:
+            table_name: 表名
+            attributes: (列名, 类型)列表
+            primary_keys: 主键列表
+        Returns:
+            bool: 表结构是新的或者发生了变化
+        """
+        if self.is_registered(table_name, attributes, primary_keys):
+            return False
+        self.tables[table_name] = {
+            "columns": [attribute[0] for attribute in attributes],
+            "column_types": {attribute[0]: attribute[1] for attribute in attributes},
+            "primary_keys": list(primary_keys),
+            "statements": {}
+        }
+        return True
+
+    def is_registered(self, table_name, attributes, primary_keys):
+        """判断表是否已经以相同的结构登记过"""
+        entry = self.tables.get(table_name)
+        if entry is None:
+            return False
+        return entry["columns"] == [attribute[0] for attribute in attributes] \
+            and entry["column_types"] == {attribute[0]: attribute[1] for attribute in attributes} \
+            and entry["primary_keys"] == list(primary_keys)
+
+    def invalidate(self, table_name=None):
+        """使某个表（或所有表）的缓存失效"""
+        if table_name is None:
+            self.tables = {}
+        else:
+            self.tables.pop(table_name, None)
+
+    def get_primary_keys(self, table_name):
+        entry = self.tables.get(table_name)
+        if entry is None:
+            if self.load_primary_keys is None:
+                return []
+            primary_keys = self.load_primary_keys(table_name)
+            if not primary_keys:
+                return []
+            # 由数据库中已有的表得到，列信息未知
+            entry = {"columns": None, "column_types": None, "primary_keys": primary_keys, "statements": {}}
+            self.tables[table_name] = entry
+        return entry["primary_keys"]
+
+    def get_columns(self, table_name):
+        entry = self.tables.get(table_name)
+        if entry is None:
+            return None
+        return entry["columns"]
+
+    def get_column_types(self, table_name):
+        entry = self.tables.get(table_name)
+        if entry is None:
+            return None
+        return entry["column_types"]
+
+    def get_statement(self, table_name, key, builder):
+        """
+        获取缓存的SQL语句，没有时调用builder生成并缓存
+        Args:
+            table_name: 表名
+            key: 语句的标识，比如("upsert", columns)
+            builder: 生成SQL语句的函数
+        """
+        entry = self.tables.get(table_name)
+        if entry is None:
+            return builder()
+        statements = entry["statements"]
+        if key not in statements:
+            statements[key] = builder()
+        return statements[key]
@@ -0,0 +1,142 @@
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class BufferedTableWriter:
+    """按表缓存待写入的行，批量通过INSERT ... ON CONFLICT DO UPDATE写入数据库"""
+
+    def __init__(self, get_connection, catalog, batch_size=5000, flush_interval=5.0, history=None):
+        """
+        Args:
+            get_connection: 返回当前数据库连接的函数
+            catalog: TableCatalog，提供表的主键和缓存的SQL语句
+            batch_size: 缓存的行数达到该值时自动写入
+            flush_interval: 距离上次写入超过该秒数时自动写入
+            history: HistoryStore，不为None时在同一个事务中记录每一行的历史版本
+        """
+        self.get_connection = get_connection
+        self.catalog = catalog
+        self.history = history
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffers = OrderedDict() # 表名 -> {主键值tuple: 属性字典}
+        self.pending_rows = 0
+        self.last_flush_time = time.time()
+        self.transaction_depth = 0
+
+    def add(self, table_name, attributes):
+        """
+        缓存一行数据，相同主键的多次写入会合并为一行
+        Args:
+            table_name: 表名
+            attributes: 属性名和属性值的对应字典，包括主键的值
+        """
+        primary_keys = self._get_primary_keys(table_name)
+        missing_keys = [pk for pk in primary_keys if pk not in attributes]
+        if missing_keys:
+            raise Exception(f"缺少主键值: {missing_keys}")
+
+        buffer = self.buffers.setdefault(table_name, OrderedDict())
+        row_key = tuple(attributes[pk] for pk in primary_keys)
+        if row_key in buffer:
+            buffer[row_key].update(attributes)
+        else:
+            buffer[row_key] = dict(attributes)
+            self.pending_rows += 1
+
+        if self.pending_rows >= self.batch_size or time.time() - self.last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """将缓存的所有行写入数据库，不在事务中时立即提交"""
+        if self.pending_rows == 0:
+            self.last_flush_time = time.time()
+            return 0
+
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        written = 0
+        try:
+            for table_name, buffer in self.buffers.items():
+                rows = list(buffer.values())
+                written += self._flush_table(cursor, table_name, rows)
+                if self.history is not None:
+                    self.history.record_versions(cursor, table_name, rows)
+            if self.transaction_depth == 0:
+                connection.commit()
+        except Exception as e:
+            logger.error(f"批量写入失败: {e}")
+            connection.rollback()
+            self._clear()
+            raise Exception(f"批量写入失败: {e}")
+        finally:
+            cursor.close()
+
+        logger.info(f"批量写入 {written} 行到 {len(self.buffers)} 个表")
+        self._clear()
+        return written
+
+    @contextmanager
+    def transaction(self):
+        """
+        事务边界：在该上下文中自动触发的写入不会提交，退出时统一写入并提交，
+        发生异常时回滚并丢弃缓存
+        """
+        self.transaction_depth += 1
+        try:
+            yield self
+        except Exception:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.get_connection().rollback()
+                self._clear()
+            raise
+        self.transaction_depth -= 1
+        if self.transaction_depth == 0:
+            self.flush()
+            self.get_connection().commit()
+
+    def _flush_table(self, cursor, table_name, rows):
+        primary_keys = self._get_primary_keys(table_name)
+        # execute_values要求每一行的列相同，因此按列集合分组
+        groups = OrderedDict()
+        for row in rows:
+            groups.setdefault(tuple(sorted(row.keys())), []).append(row)
+
+        written = 0
+        for columns, group in groups.items():
+            upsert_sql = self.catalog.get_statement(table_name, ("upsert", columns),
+                                                    lambda: self._build_upsert_sql(table_name, columns, primary_keys))
+            values = [tuple(row[column] for column in columns) for row in group]
+            execute_values(cursor, upsert_sql, values, page_size=self.batch_size)
+            written += len(values)
+        return written
+
+    @staticmethod
+    def _build_upsert_sql(table_name, columns, primary_keys):
+        update_columns = [column for column in columns if column not in primary_keys]
+        if update_columns:
+            conflict_action = "DO UPDATE SET " + ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+        else:
+            conflict_action = "DO NOTHING"
+        return (
+            f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES %s "
+            f"ON CONFLICT ({', '.join(primary_keys)}) {conflict_action}"
+        )
+
+    def _get_primary_keys(self, table_name):
+        primary_keys = self.catalog.get_primary_keys(table_name)
+        if not primary_keys:
+            raise Exception(f"无法获取表 {table_name} 的主键信息")
+        return primary_keys
+
+    def _clear(self):
+        self.buffers = OrderedDict()
+        self.pending_rows = 0
+        self.last_flush_time = time.time()
@@ -0,0 +1,95 @@
+import logging
+import time
+from typing import Dict, List, Any
+import requests
+from slither.tools.contract_abstract.onchain.http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# prestateTracer的diff模式只返回交易修改过的状态
+PRESTATE_DIFF_TRACER = {"tracer": "prestateTracer", "tracerConfig": {"diffMode": True}}
+
+
+class TraceStorageReader:
+    """
+    通过debug_traceBlockByNumber的prestateTracer(diffMode)得到区块中合约storage的所有写入，
+    包括其他合约内部调用造成的写入，需要节点开启debug命名空间（geth、erigon、anvil、hardhat）
+    """
+
+    def __init__(self, rpc_url, address, max_retries=3, timeout=120, http_client=None):
+        self.rpc_url = rpc_url
+        self.http_client = http_client or get_http_client()
+        self.address = address.lower()
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    def trace_block(self, block_number) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            List[Dict]: 每个交易的{"txHash", "result": {"pre", "post"}}，按交易在区块中的顺序
+        """
+        payload = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "debug_traceBlockByNumber",
+            "params": [hex(block_number), PRESTATE_DIFF_TRACER]
+        }
+
+        retry_delay = 1
+        for attempt in range(self.max_retries):
+            try:
+                resp = self._post(payload)
+                resp.raise_for_status()
+                data = resp.json()
+                if "error" in data:
+                    raise Exception(f"debug_traceBlockByNumber返回错误: {data['error']}")
+                return data["result"]
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.error(f"trace区块 {block_number} 失败 (尝试 {attempt + 1}/{self.max_retries}): {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(retry_delay)
+                    retry_delay *= 2  # 指数退避
+                else:
+                    raise Exception(f"trace区块 {block_number} 失败: {e}")
+
+    def _post(self, payload):
+        return self.http_client.post(self.rpc_url, json=payload, timeout=self.timeout)
+
+    def get_block_storage_writes(self, block_number) -> Dict[int, bytes]:
+        """
+        Returns:
+            Dict[int, bytes]: 区块执行完之后合约被写过的slot及其32字节的值，被清零的slot值为0
+        """
+        return self.merge_storage_diffs(self.trace_block(block_number), self.address)
+
+    @staticmethod
+    def merge_storage_diffs(traces, address) -> Dict[int, bytes]:
+        """
+        按交易顺序合并每个交易的storage diff，同一个slot以最后一次写入为准
+        Args:
+            traces: trace_block的返回值
+            address: 合约地址
+        """
+        address = address.lower()
+        writes = {}
+        for trace in traces:
+            if "error" in trace:
+                raise Exception(f"交易 {trace.get('txHash')} trace失败: {trace['error']}")
+            result = trace["result"]
+            pre_storage = TraceStorageReader._get_storage(result["pre"], address)
+            post_storage = TraceStorageReader._get_storage(result["post"], address)
+            # diff模式下被清零的slot（以及自毁合约的所有slot）只出现在pre中
+            for slot in pre_storage:
+                if slot not in post_storage:
+                    writes[slot] = bytes(32)
+            for slot, value in post_storage.items():
+                writes[slot] = value
+        return writes
+
+    @staticmethod
+    def _get_storage(accounts, address):
+        for account_address, account in accounts.items():
+            if account_address.lower() == address:
+                return {int(slot, 16): bytes.fromhex(value[2:].rjust(64, "0")) for slot, value in account.get("storage", {}).items()}
+        return {}
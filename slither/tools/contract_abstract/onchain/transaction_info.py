@@ -1,21 +1,111 @@
 import requests
 import psycopg2
-import time
 import json
-from psycopg2.extras import RealDictCursor
+import csv
+import io
+from psycopg2.extras import RealDictCursor, execute_values
 from typing import List, Dict, Any, Optional, Generator
 import logging
 import sys
 import os
-from slither.tools.contract_abstract.database_manager import DatabaseManager
+from slither.tools.contract_abstract.db_pool import get_pool
+from slither.tools.contract_abstract.onchain.abi_decoder import AbiDecoder
+from slither.tools.contract_abstract.onchain.etherscan_fetcher import TokenBucket, EtherscanRangeFetcher
+from slither.tools.contract_abstract.onchain.http_client import get_http_client
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 BASE_URL = "https://api.etherscan.io/api"
 
+# 交易表中由Etherscan数据写入的列
+TRANSACTION_COLUMNS = [
+    "block_hash", "block_number", "time_stamp", "hash", "nonce", "transaction_index",
+    "from_address", "to_address", "value", "gas", "gas_price", "input_data",
+    "method_id", "function_name", "contract_address", "cumulative_gas_used",
+    "tx_receipt_status", "gas_used", "confirmations", "is_error", "decoded_params"
+]
+
+# 键集分页使用的排序键，transaction_index可能为空
+KEYSET_ORDER = "block_number, COALESCE(transaction_index, -1), hash"
+
+
+def fetch_transaction_page(connection, table_name, start_block=None, end_block=None, after=None,
+                           page_size=10000, ascending=True) -> List[Dict[str, Any]]:
+    """
+    按(block_number, transaction_index, hash)做键集分页，读取after之后的一页交易
+
+    Args:
+        connection: 数据库连接
+        table_name: 交易表名
+        start_block: 起始区块号
+        end_block: 结束区块号
+        after: 上一页最后一行的排序键(block_number, transaction_index, hash)，None表示第一页
+        page_size: 每页大小
+        ascending: 是否按区块升序
+
+    Returns:
+        List[Dict[str, Any]]: 该页的交易数据
+    """
+    query = f"SELECT * FROM {table_name} WHERE 1=1"
+    params = []
+
+    if start_block:
+        query += " AND block_number >= %s"
+        params.append(start_block)
+
+    if end_block:
+        query += " AND block_number <= %s"
+        params.append(end_block)
+
+    if after is not None:
+        query += f" AND ({KEYSET_ORDER}) {'>' if ascending else '<'} (%s, %s, %s)"
+        params.extend(after)
+
+    direction = "ASC" if ascending else "DESC"
+    query += f" ORDER BY block_number {direction}, COALESCE(transaction_index, -1) {direction}, hash {direction} LIMIT %s"
+    params.append(page_size)
+
+    cursor = connection.cursor(cursor_factory=RealDictCursor)
+    try:
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def transaction_keyset(transaction) -> tuple:
+    """交易行对应的键集分页排序键"""
+    transaction_index = transaction["transaction_index"]
+    return (
+        transaction["block_number"],
+        -1 if transaction_index is None else transaction_index,
+        transaction["hash"]
+    )
+
+
+def iter_transaction_pages(connection, table_name, start_block=None, end_block=None,
+                           page_size=10000, ascending=True) -> Generator[List[Dict[str, Any]], None, None]:
+    """
+    键集分页流式读取交易表，每一页的代价与偏移量无关，内存占用不超过一页
+
+    Yields:
+        List[Dict[str, Any]]: 每页的交易数据
+    """
+    after = None
+    while True:
+        transactions = fetch_transaction_page(connection, table_name, start_block, end_block,
+                                              after, page_size, ascending)
+        if not transactions:
+            break
+        yield transactions
+        if len(transactions) < page_size:
+            break
+        after = transaction_keyset(transactions[-1])
+
 class TransactionInfo:
-    def __init__(self, target_address, etherscan_api_key, contract_info, db_config=None, logic_address=None):
+    def __init__(self, target_address, etherscan_api_key, contract_info, db_config=None, logic_address=None,
+                 etherscan_rate=5, etherscan_workers=4, rate_limiter=None):
         self.contract_info = contract_info
         self.etherscan_api_key = etherscan_api_key
         self.address = target_address
@@ -30,11 +120,14 @@ class TransactionInfo:
         }
         self.db_connection = None
         self.contract_creation_block = None
+        self.http_client = get_http_client()
+        # 同一个API key的限流器，可以在多个TransactionInfo之间共享
+        self.rate_limiter = rate_limiter or TokenBucket(etherscan_rate)
+        self.etherscan_fetcher = EtherscanRangeFetcher(self.request_etherscan_page, self.rate_limiter,
+                                                       max_workers=etherscan_workers)
         
-        # 初始化数据库管理器并设置数据库环境
-        self.db_manager = DatabaseManager(self.db_config)
-        if not self.db_manager.setup_database():
-            raise Exception("数据库环境设置失败")
+        # 同一个数据库的连接池在进程内共享，第一次获取时检查数据库环境
+        self.db_pool = get_pool(self.db_config)
         
         self.connect_db()
         self.create_tables()
@@ -43,61 +136,15 @@ class TransactionInfo:
             self.abi = self.get_contract_abi(self.logic_address)
         else:
             self.abi = self.get_contract_abi(self.address)
+        self.abi_decoder = AbiDecoder(self.abi)
+        self.abi_decoders = {} # 其他ABI的解码器缓存
 
     def connect_db(self):
-        """连接到PostgreSQL数据库"""
-        max_retries = 3
-        retry_delay = 2
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"尝试连接数据库: {self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}")
-                self.db_connection = psycopg2.connect(**self.db_config)
-                self.db_connection.autocommit = False
-                logger.info("成功连接到PostgreSQL数据库")
-                return
-            except psycopg2.OperationalError as e:
-                error_msg = str(e).lower()
-                logger.error(f"数据库连接失败 (尝试 {attempt + 1}/{max_retries}): {e}")
-                
-                if "database" in error_msg and "does not exist" in error_msg:
-                    # 尝试使用小写数据库名称连接
-                    original_db_name = self.db_config['database']
-                    lowercase_db_name = original_db_name.lower()
-                    
-                    if original_db_name != lowercase_db_name:
-                        logger.info(f"尝试使用小写数据库名称连接: {lowercase_db_name}")
-                        try:
-                            temp_config = self.db_config.copy()
-                            temp_config['database'] = lowercase_db_name
-                            self.db_connection = psycopg2.connect(**temp_config)
-                            self.db_connection.autocommit = False
-                            logger.info(f"成功连接到数据库 (使用小写名称: {lowercase_db_name})")
-                            # 更新配置中的数据库名称为小写
-                            self.db_config['database'] = lowercase_db_name
-                            return
-                        except psycopg2.OperationalError as e2:
-                            logger.error(f"使用小写数据库名称连接也失败: {e2}")
-                    
-                    logger.error(f"数据库 {self.db_config['database']} 不存在")
-                    logger.info("请确保数据库已创建，或者检查数据库管理器是否正确运行")
-                    raise
-                elif "authentication failed" in error_msg:
-                    logger.error("数据库认证失败，请检查用户名和密码")
-                    raise
-                elif "connection refused" in error_msg:
-                    logger.error("无法连接到PostgreSQL服务，请确保服务正在运行")
-                    raise
-                elif attempt < max_retries - 1:
-                    logger.info(f"等待 {retry_delay} 秒后重试...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # 指数退避
-                else:
-                    logger.error("数据库连接失败，已达到最大重试次数")
-                    raise
-            except Exception as e:
-                logger.error(f"数据库连接时发生未知错误: {e}")
-                raise
+        """从进程内共享的连接池中取出一个连接，关闭时归还到连接池"""
+        self.db_connection = self.db_pool.getconn()
+        # 连接池可能使用了小写的数据库名称
+        self.db_config['database'] = self.db_pool.db_config['database']
+        logger.info(f"成功连接到PostgreSQL数据库: {self.db_config['host']}:{self.db_config['port']}/{self.db_config['database']}")
 
     def create_tables(self):
         """创建交易数据表"""
@@ -129,21 +176,28 @@ class TransactionInfo:
             gas_used BIGINT,
             confirmations BIGINT,
             is_error INTEGER,
+            decoded_params JSONB,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """
         
         # 创建索引以提高查询性能
+        # 表名已接近PostgreSQL标识符63字节的上限，索引名如果以表名开头会被截断成同一个名字，
+        # 导致只有第一个索引被创建，因此索引名只使用地址
+        index_prefix = f"idx_tx_{self.address.lower().replace('0x', '')}"
         create_indexes_sql = f"""
-        CREATE INDEX IF NOT EXISTS idx_{self.table_name}_block_hash ON {self.table_name}(block_hash);
-        CREATE INDEX IF NOT EXISTS idx_{self.table_name}_block_number ON {self.table_name}(block_number);
-        CREATE INDEX IF NOT EXISTS idx_{self.table_name}_from_address ON {self.table_name}(from_address);
-        CREATE INDEX IF NOT EXISTS idx_{self.table_name}_to_address ON {self.table_name}(to_address);
-        CREATE INDEX IF NOT EXISTS idx_{self.table_name}_time_stamp ON {self.table_name}(time_stamp);
+        CREATE INDEX IF NOT EXISTS {index_prefix}_block_hash ON {self.table_name}(block_hash);
+        CREATE INDEX IF NOT EXISTS {index_prefix}_block_number ON {self.table_name}(block_number);
+        CREATE INDEX IF NOT EXISTS {index_prefix}_from_address ON {self.table_name}(from_address);
+        CREATE INDEX IF NOT EXISTS {index_prefix}_to_address ON {self.table_name}(to_address);
+        CREATE INDEX IF NOT EXISTS {index_prefix}_time_stamp ON {self.table_name}(time_stamp);
+        CREATE INDEX IF NOT EXISTS {index_prefix}_keyset ON {self.table_name}({KEYSET_ORDER});
         """
         
         try:
             cursor.execute(create_table_sql)
+            # 旧版本创建的表没有decoded_params列
+            cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS decoded_params JSONB")
             cursor.execute(create_indexes_sql)
             # 提交事务
             self.db_connection.commit()
@@ -162,133 +216,117 @@ class TransactionInfo:
             "address": address,
             "apikey": self.etherscan_api_key
         }
-        resp = requests.get(BASE_URL, params=params).json()
+        resp = self.http_client.get(BASE_URL, params=params).json()
         abi_json = resp.get("result")
         if abi_json and abi_json != 'Contract source code not verified':
             return self.contract_info.w3.codec.decode_abi if abi_json is None else abi_json
         else:
             raise Exception("ABI not available or contract not verified on Etherscan")
 
-    def _get_transactions(self, address, start_block, end_block, action):
-        """获取指定地址的交易记录（支持分页）
-        
+    def decode_input(self, abi, tx_input):
+        func_name, params = self.get_abi_decoder(abi).decode(tx_input)
+        if func_name is None:
+            raise Exception(f"解码交易输入失败: {tx_input}")
+        return func_name, params
+
+    def get_abi_decoder(self, abi=None) -> AbiDecoder:
+        """获取ABI对应的解码器，同一个ABI只解析一次"""
+        if abi is None or abi is self.abi or abi == self.abi:
+            return self.abi_decoder
+        key = abi if isinstance(abi, str) else json.dumps(abi, sort_keys=True)
+        if key not in self.abi_decoders:
+            self.abi_decoders[key] = AbiDecoder(abi)
+        return self.abi_decoders[key]
+
+    def backfill_decoded_params(self, start_block=None, end_block=None, batch_size=10000) -> int:
+        """
+        为decoded_params为空的交易补充解码结果，用于该列加入之前已经入库的交易
+
+        Returns:
+            int: 更新的交易数量
+        """
+        if not self.db_connection:
+            self.connect_db()
+
+        update_sql = f"""
+        UPDATE {self.table_name} AS t SET decoded_params = v.decoded_params::jsonb
+        FROM (VALUES %s) AS v(hash, decoded_params)
+        WHERE t.hash = v.hash
+        """
+        updated = 0
+        for transactions in iter_transaction_pages(self.db_connection, self.table_name, start_block, end_block,
+                                                   page_size=batch_size, ascending=True):
+            transactions = [tx for tx in transactions if tx["decoded_params"] is None]
+            decoded = self.abi_decoder.decode_many(transactions)
+            values = [
+                (tx["hash"], self.abi_decoder.to_stored(func_name, params))
+                for tx, (func_name, params) in zip(transactions, decoded) if func_name is not None
+            ]
+            if not values:
+                continue
+            cursor = self.db_connection.cursor()
+            try:
+                execute_values(cursor, update_sql, values, page_size=batch_size)
+                self.db_connection.commit()
+            except Exception as e:
+                logger.error(f"补充交易解码结果失败: {e}")
+                self.db_connection.rollback()
+                raise
+            finally:
+                cursor.close()
+            updated += len(values)
+            logger.info(f"已补充 {updated} 条交易的解码结果")
+        return updated
+
+    def request_etherscan_page(self, action, start_block, end_block, page=1, offset=10000) -> List[Dict[str, Any]]:
+        """
+        请求一页交易记录，不做重试和限流，由EtherscanRangeFetcher负责
+
         Args:
-            address: 合约地址
+            action: API动作类型 ("txlist" 或 "txlistinternal")
             start_block: 起始区块号
             end_block: 结束区块号
-            action: API动作类型 ("txlist" 或 "txlistinternal")
-            
+            page: 页码
+            offset: 每页记录数
+
         Returns:
-            List[Dict]: 交易记录列表，失败时返回空列表
+            List[Dict]: 交易记录列表
         """
-        all_transactions = []
-        page = 1
-        offset = 10000  # Etherscan API每页最大记录数
-        max_pages = 100  # 最大页数限制，防止无限循环
-        
-        logger.info(f"开始获取 {action} 交易记录，区块范围: {start_block}-{end_block}")
-        
-        while page <= max_pages:
-            params = {
-                "module": "account",
-                "action": action,
-                "address": address,
-                "startblock": start_block,
-                "endblock": end_block,
-                "sort": "asc",
-                "page": page,
-                "offset": offset,
-                "apikey": self.etherscan_api_key
-            }
-            
-            try:
-                # 发送HTTP请求
-                logger.info(f"请求Etherscan API: {action}, 地址: {address}, 区块范围: {start_block}-{end_block}, 页码: {page}")
-                resp = requests.get(BASE_URL, params=params, timeout=30)
-                resp.raise_for_status()  # 检查HTTP状态码
-                
-                # 解析JSON响应
-                data = resp.json()
-                
-                # 检查API响应状态
-                if data.get("status") == "1":
-                    result = data.get("result", [])
-                    if isinstance(result, list):
-                        if len(result) == 0:
-                            logger.info(f"第 {page} 页没有更多数据，停止分页")
-                            break
-                        
-                        all_transactions.extend(result)
-                        logger.info(f"第 {page} 页获取到 {len(result)} 条 {action} 交易记录，累计: {len(all_transactions)} 条")
-                        
-                        # 如果返回的记录数少于offset，说明已经是最后一页
-                        if len(result) < offset:
-                            logger.info(f"第 {page} 页记录数 ({len(result)}) 少于每页限制 ({offset})，已获取所有数据")
-                            break
-                        # 如果返回的记录数大于offset, 也无法继续下一页，因为当前账号限制因此需要raise Exception
-                        if len(result) >= offset:
-                            logger.error(f"第 {page} 页记录数 ({len(result)}) 大于每页限制 ({offset})，无法继续下一页")
-                            raise Exception(f"第 {page} 页记录数 ({len(result)}) 大于每页限制 ({offset})，无法继续下一页")
-                        
-                        page += 1
-                        
-                        # 添加延迟避免API限流
-                        time.sleep(0.2)
-                        
-                    else:
-                        logger.error(f"API返回的result不是列表格式: {type(result)}")
-                        raise Exception(f"API返回的result不是列表格式: {type(result)}")
-                else:
-                    # API返回错误状态
-                    error_message = data.get("message", "未知错误")
-                    logger.error(f"Etherscan API返回错误: {error_message}")
-                    
-                    # 处理特定的API错误
-                    if "rate limit" in error_message.lower():
-                        logger.warning("达到API速率限制，等待后重试...")
-                        time.sleep(1)  # 等待1秒后重试
-                        continue
-                    elif "invalid api key" in error_message.lower():
-                        logger.error("API密钥无效")
-                        raise Exception("API密钥无效")
-                    elif "no transactions found" in error_message.lower():
-                        logger.info(f"区块范围 {start_block}-{end_block} 中没有找到 {action} 交易")
-                        break
-                    else:
-                        raise Exception(f"Etherscan API返回错误: {error_message}")
-                        
-            except requests.exceptions.Timeout:
-                logger.error(f"请求Etherscan API超时: {action}, 页码: {page}")
-                raise Exception(f"请求Etherscan API超时: {action}")
-            except requests.exceptions.ConnectionError as e:
-                logger.error(f"网络连接错误: {e}")
-                raise Exception(f"网络连接错误: {e}")
-            except requests.exceptions.HTTPError as e:
-                logger.error(f"HTTP请求错误: {e}")
-                raise Exception(f"HTTP请求错误: {e}")
-            except requests.exceptions.RequestException as e:
-                logger.error(f"请求异常: {e}")
-                raise Exception(f"请求异常: {e}")
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON解析错误: {e}")
-                raise Exception(f"JSON解析错误: {e}")
-            except Exception as e:
-                logger.error(f"获取 {action} 交易时发生未知错误: {e}")
-                raise Exception(f"获取 {action} 交易时发生未知错误: {e}")
-        
-        if page > max_pages:
-            logger.warning(f"达到最大页数限制 ({max_pages})，可能还有更多数据未获取")
-        
-        logger.info(f"总共获取到 {len(all_transactions)} 条 {action} 交易记录")
-        return all_transactions
+        params = {
+            "module": "account",
+            "action": action,
+            "address": self.address,
+            "startblock": start_block,
+            "endblock": end_block,
+            "sort": "asc",
+            "page": page,
+            "offset": offset,
+            "apikey": self.etherscan_api_key
+        }
+        resp = self.http_client.get(BASE_URL, params=params, timeout=30)
+        resp.raise_for_status()
+        data = resp.json()
 
-    def decode_input(self, abi, tx_input):
-        contract = self.contract_info.w3.eth.contract(abi=abi)
-        try:
-            func_obj, params = contract.decode_function_input(tx_input)
-            return func_obj.fn_name, params
-        except Exception:
-            raise Exception(f"解码交易输入失败: {tx_input}")
+        if data.get("status") == "1":
+            result = data.get("result", [])
+            if not isinstance(result, list):
+                raise Exception(f"API返回的result不是列表格式: {type(result)}")
+            return result
+
+        # 没有交易时status为0，result为空列表
+        error_message = f"{data.get('message', '')} {data.get('result', '')}"
+        if "no transactions found" in error_message.lower():
+            return []
+        raise Exception(f"Etherscan API返回错误: {error_message}")
+
+    def iter_etherscan_windows(self, start_block, end_block) -> Generator[tuple, None, None]:
+        """
+        并发、限流地获取区块范围内的普通交易和内部交易，满页的窗口会自动二分
+
+        Yields:
+            (窗口起始区块, 窗口结束区块, 交易列表)，按区块顺序
+        """
+        yield from self.etherscan_fetcher.fetch_range(start_block, end_block)
 
     def get_transactions_from_etherscan(self, start_block, end_block):
         """获取指定区块范围内的所有交易记录（包括普通交易和内部交易）
@@ -298,92 +336,138 @@ class TransactionInfo:
             end_block: 结束区块号
             
         Returns:
-            List[Dict]: 合并后的交易记录列表
+            List[Dict]: 合并后的交易记录列表，按区块排序
         """
         try:
             logger.info(f"开始获取区块范围 {start_block}-{end_block} 的所有交易记录")
-            
-            # 获取普通交易
-            logger.info("=== 获取普通交易 ===")
-            normal_txs = self._get_transactions(self.address, start_block, end_block, "txlist")
-            logger.info(f"✅ 普通交易获取完成，共 {len(normal_txs)} 条")
-            
-            # 获取内部交易
-            logger.info("=== 获取内部交易 ===")
-            internal_txs = self._get_transactions(self.address, start_block, end_block, "txlistinternal")
-            logger.info(f"✅ 内部交易获取完成，共 {len(internal_txs)} 条")
-            
-            # 合并交易记录
-            all_txs = normal_txs + internal_txs
+            all_txs = []
+            for _, _, txs in self.iter_etherscan_windows(start_block, end_block):
+                all_txs.extend(txs)
             logger.info(f"🎉 区块范围 {start_block}-{end_block} 总共获取到 {len(all_txs)} 条交易记录")
-            logger.info(f"   - 普通交易: {len(normal_txs)} 条")
-            logger.info(f"   - 内部交易: {len(internal_txs)} 条")
-            
             return all_txs
             
         except Exception as e:
             raise Exception(f"获取交易记录时发生错误: {e}")
 
     def save_transactions_to_db(self, transactions: List[Dict[str, Any]]) -> int:
-        """将交易数据保存到PostgreSQL数据库"""
+        """将交易数据保存到PostgreSQL数据库，返回新插入的记录数"""
+        return self.bulk_save_transactions(transactions)["inserted"]
+
+    def bulk_save_transactions(self, transactions: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        批量保存交易数据：通过COPY FROM STDIN写入临时表，再用一条语句合并到交易表，
+        COPY失败时回退到execute_values
+
+        Args:
+            transactions: Etherscan返回的交易数据列表
+
+        Returns:
+            Dict[str, int]: {"total": 总数, "inserted": 新插入数, "duplicates": 已存在而跳过的数量}
+        """
         if not self.db_connection:
             self.connect_db()
-        
+
+        # 入库时解码交易参数，读取时不再需要ABI解码
+        decoded = self.abi_decoder.decode_many(
+            [{"input_data": tx.get('input'), "method_id": tx.get('methodId')} for tx in transactions]
+        )
+        rows = [
+            self._convert_transaction(tx, self.abi_decoder.to_stored(func_name, params))
+            for tx, (func_name, params) in zip(transactions, decoded)
+        ]
+        stats = {"total": len(rows), "inserted": 0, "duplicates": 0}
+        if not rows:
+            return stats
+
         cursor = self.db_connection.cursor()
-        saved_count = 0
-        
-        insert_sql = f"""
-        INSERT INTO {self.table_name} (
-            block_hash, block_number, time_stamp, hash, nonce, transaction_index,
-            from_address, to_address, value, gas, gas_price, input_data,
-            method_id, function_name, contract_address, cumulative_gas_used,
-            tx_receipt_status, gas_used, confirmations, is_error
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-        ) ON CONFLICT (hash) DO NOTHING
-        """
-        
         try:
-            for tx in transactions:
-                # 处理数据转换
-                values = (
-                    tx.get('blockHash'),
-                    int(tx.get('blockNumber', 0)) if tx.get('blockNumber') else None,
-                    int(tx.get('timeStamp', 0)) if tx.get('timeStamp') else None,
-                    tx.get('hash'),
-                    int(tx.get('nonce', 0)) if tx.get('nonce') else None,
-                    int(tx.get('transactionIndex', 0)) if tx.get('transactionIndex') else None,
-                    tx.get('from'),
-                    tx.get('to'),
-                    tx.get('value'),
-                    int(tx.get('gas', 0)) if tx.get('gas') else None,
-                    int(tx.get('gasPrice', 0)) if tx.get('gasPrice') else None,
-                    tx.get('input'),
-                    tx.get('methodId'),
-                    tx.get('functionName'),
-                    tx.get('contractAddress'),
-                    int(tx.get('cumulativeGasUsed', 0)) if tx.get('cumulativeGasUsed') else None,
-                    int(tx.get('txreceipt_status', 0)) if tx.get('txreceipt_status') else None,
-                    int(tx.get('gasUsed', 0)) if tx.get('gasUsed') else None,
-                    int(tx.get('confirmations', 0)) if tx.get('confirmations') else None,
-                    int(tx.get('isError', 0)) if tx.get('isError') else None
-                )
-                
-                cursor.execute(insert_sql, values)
-                saved_count += cursor.rowcount
-            
+            try:
+                inserted = self._copy_transactions(cursor, rows)
+            except psycopg2.Error as e:
+                logger.warning(f"COPY写入交易数据失败，回退到execute_values: {e}")
+                self.db_connection.rollback()
+                inserted = self._insert_transactions_values(cursor, rows)
+
             # 提交事务
             self.db_connection.commit()
-            logger.info(f"成功保存 {saved_count} 条交易记录到数据库")
-            return saved_count
-            
         except Exception as e:
-            logger.error(f"保存第{saved_count}个交易数据失败: {e}")
+            logger.error(f"保存交易数据失败: {e}")
             self.db_connection.rollback()
             raise
         finally:
             cursor.close()
 
+        stats["inserted"] = inserted
+        stats["duplicates"] = len(rows) - inserted
+        logger.info(f"成功保存 {inserted} 条交易记录到数据库，跳过 {stats['duplicates']} 条重复记录")
+        return stats
+
+    def _copy_transactions(self, cursor, rows) -> int:
+        """通过COPY写入临时表并合并到交易表，返回新插入的记录数"""
+        columns = ", ".join(TRANSACTION_COLUMNS)
+        cursor.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS tmp_transactions_ingest
+        (LIKE {self.table_name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+        """)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(["\\N" if value is None else value for value in row])
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY tmp_transactions_ingest ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+
+        cursor.execute(f"""
+        INSERT INTO {self.table_name} ({columns})
+        SELECT DISTINCT ON (hash) {columns} FROM tmp_transactions_ingest
+        ON CONFLICT (hash) DO NOTHING
+        """)
+        inserted = cursor.rowcount
+        # 同一个事务中可能多次写入，清空临时表
+        cursor.execute("TRUNCATE tmp_transactions_ingest")
+        return inserted
+
+    def _insert_transactions_values(self, cursor, rows) -> int:
+        """使用execute_values批量插入，返回新插入的记录数"""
+        insert_sql = f"""
+        INSERT INTO {self.table_name} ({", ".join(TRANSACTION_COLUMNS)})
+        VALUES %s
+        ON CONFLICT (hash) DO NOTHING
+        RETURNING hash
+        """
+        inserted = execute_values(cursor, insert_sql, rows, page_size=1000, fetch=True)
+        return len(inserted)
+
+    @staticmethod
+    def _convert_transaction(tx: Dict[str, Any], decoded_params: Optional[str] = None) -> tuple:
+        """将Etherscan返回的交易转换为交易表的一行，顺序与TRANSACTION_COLUMNS一致"""
+        return (
+            tx.get('blockHash'),
+            int(tx.get('blockNumber', 0)) if tx.get('blockNumber') else None,
+            int(tx.get('timeStamp', 0)) if tx.get('timeStamp') else None,
+            tx.get('hash'),
+            int(tx.get('nonce', 0)) if tx.get('nonce') else None,
+            int(tx.get('transactionIndex', 0)) if tx.get('transactionIndex') else None,
+            tx.get('from'),
+            tx.get('to'),
+            tx.get('value'),
+            int(tx.get('gas', 0)) if tx.get('gas') else None,
+            int(tx.get('gasPrice', 0)) if tx.get('gasPrice') else None,
+            tx.get('input'),
+            tx.get('methodId'),
+            tx.get('functionName'),
+            tx.get('contractAddress'),
+            int(tx.get('cumulativeGasUsed', 0)) if tx.get('cumulativeGasUsed') else None,
+            int(tx.get('txreceipt_status', 0)) if tx.get('txreceipt_status') else None,
+            int(tx.get('gasUsed', 0)) if tx.get('gasUsed') else None,
+            int(tx.get('confirmations', 0)) if tx.get('confirmations') else None,
+            int(tx.get('isError', 0)) if tx.get('isError') else None,
+            decoded_params
+        )
+
     def get_transactions_from_db(self, start_block, end_block, limit = 10000, page = 1) -> List[Dict[str, Any]]:
         """从数据库查询交易数据（支持分页）"""
         if not self.db_connection:
@@ -421,9 +505,9 @@ class TransactionInfo:
             cursor.close()
 
     def get_transactions_paginated(self, start_block, end_block, page_size=10000, 
-                                 max_pages=None, callback=None) -> Generator[List[Dict[str, Any]], None, None]:
+                                 max_pages=None, callback=None, ascending=False) -> Generator[List[Dict[str, Any]], None, None]:
         """
-        分页查询交易数据，支持回调函数处理每页数据
+        分页查询交易数据，支持回调函数处理每页数据，使用键集分页，不再随页数增加而变慢
         
         Args:
             start_block: 起始区块号
@@ -431,6 +515,7 @@ class TransactionInfo:
             page_size: 每页大小，默认10000
             max_pages: 最大页数限制，None表示无限制
             callback: 回调函数，用于处理每页数据，参数为(page_num, transactions)
+            ascending: 是否按区块升序返回，默认降序
         
         Yields:
             List[Dict[str, Any]]: 每页的交易数据
@@ -441,22 +526,8 @@ class TransactionInfo:
         page = 1
         total_processed = 0
         
-        while True:
-            if max_pages and page > max_pages:
-                logger.info(f"已达到最大页数限制: {max_pages}")
-                break
-                
-            transactions = self.get_transactions_from_db(
-                start_block=start_block, 
-                end_block=end_block, 
-                limit=page_size, 
-                page=page
-            )
-            
-            if not transactions:
-                logger.info(f"第{page}页无数据，查询结束")
-                break
-                
+        for transactions in iter_transaction_pages(self.db_connection, self.table_name, start_block, end_block,
+                                                   page_size=page_size, ascending=ascending):
             total_processed += len(transactions)
             logger.info(f"处理第{page}页，本页{len(transactions)}条，累计{total_processed}条")
             
@@ -471,6 +542,55 @@ class TransactionInfo:
             yield transactions
             
             page += 1
+            if max_pages and page > max_pages:
+                logger.info(f"已达到最大页数限制: {max_pages}")
+                break
+        logger.info(f"分页查询结束，共{page - 1}页，{total_processed}条")
+
+    def iter_transactions(self, start_block=None, end_block=None, fetch_size=10000,
+                          ascending=True) -> Generator[Dict[str, Any], None, None]:
+        """
+        按区块顺序逐条流式返回交易，默认升序，供重放等需要按顺序处理的场景使用
+        
+        Args:
+            start_block: 起始区块号
+            end_block: 结束区块号
+            fetch_size: 每次从数据库读取的行数
+            ascending: 是否按区块升序
+        
+        Yields:
+            Dict[str, Any]: 交易数据
+        """
+        if not self.db_connection:
+            self.connect_db()
+        
+        for transactions in iter_transaction_pages(self.db_connection, self.table_name, start_block, end_block,
+                                                   page_size=fetch_size, ascending=ascending):
+            for tx in transactions:
+                yield tx
+
+    def iter_blocks(self, start_block=None, end_block=None, fetch_size=10000) -> Generator[tuple, None, None]:
+        """
+        按区块升序流式返回交易，同一区块的交易按transaction_index排好序放在一起，供逐区块重放使用
+
+        Args:
+            start_block: 起始区块号
+            end_block: 结束区块号
+            fetch_size: 每次从数据库读取的行数
+
+        Yields:
+            tuple: (block_number, 该区块的交易列表)，没有交易的区块不会返回
+        """
+        block_number = None
+        block_transactions = []
+        for tx in self.iter_transactions(start_block, end_block, fetch_size=fetch_size, ascending=True):
+            if tx["block_number"] != block_number and block_transactions:
+                yield block_number, block_transactions
+                block_transactions = []
+            block_number = tx["block_number"]
+            block_transactions.append(tx)
+        if block_transactions:
+            yield block_number, block_transactions
 
     def get_total_transaction_count(self, start_block=None, end_block=None) -> int:
         """
@@ -512,7 +632,7 @@ class TransactionInfo:
             cursor.close()
 
     def get_transactions_by_batch(self, start_block=None, end_block=None, batch_size=10000, 
-                                callback=None) -> Generator[List[Dict[str, Any]], None, None]:
+                                callback=None, ascending=False) -> Generator[List[Dict[str, Any]], None, None]:
         """
         批量查询交易数据，适合大数据量处理
         
@@ -521,6 +641,7 @@ class TransactionInfo:
             end_block: 结束区块号
             batch_size: 批次大小，默认10000
             callback: 回调函数，用于处理每批数据，参数为(batch_num, transactions)
+            ascending: 是否按区块升序返回，默认降序
         
         Yields:
             List[Dict[str, Any]]: 每批的交易数据
@@ -531,18 +652,8 @@ class TransactionInfo:
         batch_num = 1
         total_processed = 0
         
-        while True:
-            transactions = self.get_transactions_from_db(
-                start_block=start_block, 
-                end_block=end_block, 
-                limit=batch_size, 
-                page=batch_num
-            )
-            
-            if not transactions:
-                logger.info(f"第{batch_num}批无数据，查询结束")
-                break
-                
+        for transactions in iter_transaction_pages(self.db_connection, self.table_name, start_block, end_block,
+                                                   page_size=batch_size, ascending=ascending):
             total_processed += len(transactions)
             logger.info(f"处理第{batch_num}批，本批{len(transactions)}条，累计{total_processed}条")
             
@@ -557,6 +668,7 @@ class TransactionInfo:
             yield transactions
             
             batch_num += 1
+        logger.info(f"批量查询结束，共{batch_num - 1}批，{total_processed}条")
 
     def save_single_transaction(self, transaction: Dict[str, Any]) -> bool:
         """保存单条交易数据"""
@@ -593,6 +705,45 @@ class TransactionInfo:
         finally:
             cursor.close()
 
+    def get_block_hashes(self, start_block, end_block) -> Dict[int, str]:
+        """
+        获取已经保存的交易所在区块的hash，用于检查这些区块是否被重组
+
+        Returns:
+            Dict[int, str]: block_number -> block_hash
+        """
+        if not self.db_connection:
+            self.connect_db()
+
+        with self.db_connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT DISTINCT block_number, block_hash FROM {self.table_name}
+                WHERE block_number BETWEEN %s AND %s
+            """, (start_block, end_block))
+            return {int(block_number): block_hash for block_number, block_hash in cursor.fetchall()}
+
+    def rollback_to_block(self, block_number) -> int:
+        """
+        删除区块block_number之后的交易，用于重组之后重新获取
+
+        Returns:
+            int: 删除的交易数
+        """
+        if not self.db_connection:
+            self.connect_db()
+
+        try:
+            with self.db_connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {self.table_name} WHERE block_number > %s", (block_number,))
+                deleted = cursor.rowcount
+            self.db_connection.commit()
+        except Exception as e:
+            self.db_connection.rollback()
+            logger.error(f"回滚交易到区块 {block_number} 失败: {e}")
+            raise
+        logger.info(f"回滚到区块 {block_number}: 删除 {deleted} 条交易")
+        return deleted
+
     def get_latest_block_info(self) -> Optional[Dict[str, Any]]:
         """获取最新区块的详细信息"""
         if not self.db_connection:
@@ -684,7 +835,7 @@ class TransactionInfo:
         }
         
         try:
-            resp = requests.get(BASE_URL, params=params)
+            resp = self.http_client.get(BASE_URL, params=params)
             resp.raise_for_status()  # 检查HTTP错误
             data = resp.json()
             
@@ -718,7 +869,7 @@ class TransactionInfo:
         }
         
         try:
-            resp = requests.get(BASE_URL, params=params)
+            resp = self.http_client.get(BASE_URL, params=params)
             resp.raise_for_status()
             data = resp.json()
             
@@ -765,7 +916,7 @@ class TransactionInfo:
         }
         
         try:
-            resp = requests.get(BASE_URL, params=params)
+            resp = self.http_client.get(BASE_URL, params=params)
             resp.raise_for_status()
             data = resp.json()
             
@@ -803,8 +954,9 @@ class TransactionInfo:
     def close_db_connection(self):
         """关闭数据库连接"""
         if self.db_connection:
-            self.db_connection.close()
-            logger.info("数据库连接已关闭")
+            self.db_pool.putconn(self.db_connection)
+            self.db_connection = None
+            logger.info("数据库连接已归还到连接池")
 
     def __del__(self):
         """析构函数，确保关闭数据库连接"""
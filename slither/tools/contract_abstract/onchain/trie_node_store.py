@@ -0,0 +1,108 @@
+import logging
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class TrieNodeStore(MutableMapping):
+    """
+    以节点hash为key的MPT节点存储，作为HexaryTrie的db使用：
+    读取时按需从storage_trie_nodes表加载并放入LRU缓存，新写入的节点先放在内存中，
+    flush时只写入上次保存之后新产生的节点
+    """
+
+    def __init__(self, get_connection, cache_size=100000):
+        """
+        Args:
+            get_connection: 返回当前数据库连接的函数
+            cache_size: LRU缓存的最大节点数
+        """
+        self.get_connection = get_connection
+        self.cache_size = cache_size
+        self.cache = OrderedDict() # 已经在数据库中的节点
+        self.dirty = {} # 还没有写入数据库的节点
+
+    @staticmethod
+    def create_tables(cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS storage_trie_nodes (
+                node_hash BYTEA PRIMARY KEY,
+                node_data BYTEA NOT NULL
+            )
+        """)
+
+    def __getitem__(self, node_hash):
+        node_hash = bytes(node_hash)
+        if node_hash in self.dirty:
+            return self.dirty[node_hash]
+        if node_hash in self.cache:
+            self.cache.move_to_end(node_hash)
+            return self.cache[node_hash]
+
+        with self.get_connection().cursor() as cursor:
+            cursor.execute("SELECT node_data FROM storage_trie_nodes WHERE node_hash = %s", (node_hash,))
+            row = cursor.fetchone()
+        if row is None:
+            raise KeyError(node_hash)
+        node_data = bytes(row[0])
+        self._cache_put(node_hash, node_data)
+        return node_data
+
+    def __setitem__(self, node_hash, node_data):
+        node_hash = bytes(node_hash)
+        # 节点按内容寻址，已经保存过的节点不需要再写
+        if node_hash not in self.cache:
+            self.dirty[node_hash] = bytes(node_data)
+
+    def __delitem__(self, node_hash):
+        # 数据库中的节点可能被其他区块的trie引用，只删除未保存的节点
+        self.dirty.pop(bytes(node_hash), None)
+
+    def __contains__(self, node_hash):
+        try:
+            self[node_hash]
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        """只遍历内存中的节点"""
+        yield from self.dirty
+        yield from (node_hash for node_hash in list(self.cache) if node_hash not in self.dirty)
+
+    def __len__(self):
+        return len(self.dirty) + sum(1 for node_hash in self.cache if node_hash not in self.dirty)
+
+    def add_nodes(self, nodes):
+        """批量加入节点，比如迁移旧的pickle数据"""
+        for node_hash, node_data in nodes.items():
+            self[node_hash] = node_data
+
+    def flush(self, cursor):
+        """
+        将新产生的节点写入数据库，不提交事务，提交之后需要调用mark_saved
+        Returns:
+            int: 写入的节点数
+        """
+        if not self.dirty:
+            return 0
+        execute_values(cursor, """
+            INSERT INTO storage_trie_nodes (node_hash, node_data) VALUES %s
+            ON CONFLICT (node_hash) DO NOTHING
+        """, list(self.dirty.items()), page_size=5000)
+        return len(self.dirty)
+
+    def mark_saved(self):
+        """事务提交之后，把已写入的节点移到缓存中"""
+        for node_hash, node_data in self.dirty.items():
+            self._cache_put(node_hash, node_data)
+        self.dirty = {}
+
+    def _cache_put(self, node_hash, node_data):
+        self.cache[node_hash] = node_data
+        self.cache.move_to_end(node_hash)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
@@ -23,6 +23,25 @@ def parse_args():
     parser.add_argument("--tranaction-db-name", default="ethereum_transactions", help="transaction数据库名称")
     parser.add_argument("--tranaction-db-user", default="zhiqiang", help="transaction数据库用户名")
     parser.add_argument("--tranaction-db-password", default="password", help="transaction数据库密码")
+
+    # RPC批量读取参数
+    parser.add_argument("--rpc-batch-size", type=int, default=100, help="每个JSON-RPC批量请求包含的storage读取数")
+    parser.add_argument("--rpc-max-workers", type=int, default=4, help="并发的JSON-RPC批量请求数")
+
+    # 数据库批量写入参数
+    parser.add_argument("--write-batch-size", type=int, default=5000, help="缓存多少行后批量写入storage数据库")
+    parser.add_argument("--write-flush-interval", type=float, default=5.0, help="缓存的行最多等待多少秒后写入")
+
+    # 增量同步参数
+    parser.add_argument("--replay-fetch-size", type=int, default=10000, help="重放交易时每次从交易表读取的行数")
+    parser.add_argument("--key-discovery-workers", type=int, default=None, help="并行发现mapping的key的进程数，默认为CPU核数")
+    parser.add_argument("--init-bucket-size", type=int, default=10000, help="初始同步时mapping每个分区的key数，每个分区完成后提交并记录进度")
+    parser.add_argument("--init-workers", type=int, default=1, help="初始同步时并行读取的分区数")
+    parser.add_argument("--preimage-key-discovery", action="store_true",
+                        help="用structLogger重放交易，从SHA3的输入中恢复mapping的key，需要节点支持debug_traceTransaction")
+    parser.add_argument("--no-log-key-discovery", action="store_true", help="不从事件日志(eth_getLogs)中发现mapping的key，只扫描交易的calldata")
+    parser.add_argument("--sync-mode", choices=["template", "trace"], default="template",
+                        help="template: 根据写storage的模板推断被改变的slot并重新读取; trace: 通过debug_traceBlockByNumber得到被写的slot和值，需要节点支持debug接口")
     
     return parser.parse_args()
 
@@ -94,7 +113,18 @@ def main() -> None:
         meta_json["address"], 
         contract_info, 
         storage_db_config,
-        transaction_info
+        transaction_info,
+        rpc_batch_size=args.rpc_batch_size,
+        rpc_max_workers=args.rpc_max_workers,
+        write_batch_size=args.write_batch_size,
+        write_flush_interval=args.write_flush_interval,
+        replay_fetch_size=args.replay_fetch_size,
+        sync_mode=args.sync_mode,
+        key_discovery_workers=args.key_discovery_workers,
+        log_key_discovery=not args.no_log_key_discovery,
+        preimage_key_discovery=args.preimage_key_discovery,
+        init_bucket_size=args.init_bucket_size,
+        init_workers=args.init_workers
     )
     logger.info("storage信息初始化成功")
 
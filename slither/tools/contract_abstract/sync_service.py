@@ -0,0 +1,211 @@
+from argparse import ArgumentParser
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from slither.tools.contract_abstract.onchain.contract_info import ContractInfo
+from slither.tools.contract_abstract.onchain.transaction_info import TransactionInfo
+from slither.tools.contract_abstract.onchain.storage_info import StorageInfo
+from slither.tools.contract_abstract.onchain.head_follower import HeadFollower
+from slither.tools.contract_abstract.onchain.sync_pipeline import SyncPipeline, SyncCoordinator
+from slither.tools.contract_abstract.onchain.etherscan_fetcher import TokenBucket
+from slither.tools.contract_abstract.onchain.http_client import get_http_client
+from slither.tools.contract_abstract.db_pool import close_all_pools
+
+def parse_args():
+    parser = ArgumentParser(description="在同一个进程中流水线式地同步一个或多个合约的交易和storage")
+    parser.add_argument("--meta-path", required=True, nargs="+", help="元数据文件路径，可以是多个文件或者包含元数据文件的目录")
+    parser.add_argument("--rpc-url", required=True, action="store", help="以太坊RPC URL")
+    parser.add_argument("--etherscan-apikey", required=True, action="store", help="Etherscan API密钥")
+
+    # 数据库配置参数
+    parser.add_argument("--storage-db-host", default="localhost", help="storage数据库主机地址")
+    parser.add_argument("--storage-db-port", type=int, default=5432, help="storage数据库端口")
+    parser.add_argument("--storage-db-user", default="zhiqiang", help="storage数据库用户名")
+    parser.add_argument("--storage-db-password", default="password", help="storage数据库密码")
+
+    parser.add_argument("--transaction-db-host", default="localhost", help="transaction数据库主机地址")
+    parser.add_argument("--transaction-db-port", type=int, default=5432, help="transaction数据库端口")
+    parser.add_argument("--transaction-db-name", default="ethereum_transactions", help="transaction数据库名称")
+    parser.add_argument("--transaction-db-user", default="postgres", help="transaction数据库用户名")
+    parser.add_argument("--transaction-db-password", default="password", help="transaction数据库密码")
+
+    # Etherscan请求参数
+    parser.add_argument("--etherscan-rate", type=float, default=5, help="Etherscan API每秒最多请求数")
+    parser.add_argument("--etherscan-workers", type=int, default=4, help="并发请求Etherscan的线程数")
+
+    # RPC批量读取和数据库批量写入参数
+    parser.add_argument("--rpc-batch-size", type=int, default=100, help="每个JSON-RPC批量请求包含的storage读取数")
+    parser.add_argument("--rpc-max-workers", type=int, default=4, help="并发的JSON-RPC批量请求数")
+    parser.add_argument("--rpc-rate", type=float, default=None, help="所有合约每秒最多发送的JSON-RPC批量请求数，默认不限制")
+    parser.add_argument("--write-batch-size", type=int, default=5000, help="缓存多少行后批量写入storage数据库")
+    parser.add_argument("--write-flush-interval", type=float, default=5.0, help="缓存的行最多等待多少秒后写入")
+    parser.add_argument("--replay-fetch-size", type=int, default=10000, help="重放交易时每次从交易表读取的行数")
+    parser.add_argument("--init-bucket-size", type=int, default=10000, help="初始同步时mapping每个分区的key数，每个分区完成后提交并记录进度")
+    parser.add_argument("--init-workers", type=int, default=1, help="初始同步时并行读取的分区数")
+    parser.add_argument("--sync-mode", choices=["template", "trace"], default="template",
+                        help="template: 根据写storage的模板推断被改变的slot并重新读取; trace: 通过debug_traceBlockByNumber得到被写的slot和值，需要节点支持debug接口")
+    parser.add_argument("--history", action="store_true", help="在{表名}__history表中保存每一行的历史版本，支持查询历史区块的值")
+    parser.add_argument("--history-retain-blocks", type=int, default=None, help="历史表保留最近多少个区块的完整历史，默认不压缩")
+    parser.add_argument("--history-compact-interval", type=int, default=1000, help="每同步多少个区块压缩一次历史表")
+
+    # 流水线参数
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="没有新区块时每隔多少秒查询一次RPC节点的最新区块")
+    parser.add_argument("--queue-size", type=int, default=16, help="流水线每个阶段之间的队列最多缓存的区块数")
+    parser.add_argument("--ingest-window", type=int, default=10000, help="追赶时每次从Etherscan获取的区块数")
+    parser.add_argument("--max-concurrency", type=int, default=8,
+                        help="所有合约同时执行的RPC、Etherscan和数据库调用数，按各合约落后的区块数公平分配")
+    parser.add_argument("--status-interval", type=float, default=30, help="每隔多少秒输出一次各阶段落后链头的区块数")
+
+    return parser.parse_args()
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+def backfill_transactions(transaction_info):
+    """storage还没有初始同步时，需要先获取全部历史交易才能发现mapping的key"""
+    local_latest_block = transaction_info.get_latest_block_number()
+    etherscan_latest_block = transaction_info.get_etherscan_latest_block()
+    deployment_block = transaction_info.get_contract_creation_block()
+    if local_latest_block is None or etherscan_latest_block is None or deployment_block is None:
+        raise Exception("无法获取本地最新区块号、Etherscan最新区块号或合约部署区块号")
+    start_block = max(local_latest_block, deployment_block)
+    logger.info(f"获取历史交易: {start_block} - {etherscan_latest_block}")
+    for window_start, window_end, txs in transaction_info.iter_etherscan_windows(start_block, etherscan_latest_block):
+        if txs:
+            saved_count = transaction_info.save_transactions_to_db(txs)
+            logger.info(f"区块 {window_start} - {window_end}: 保存 {saved_count} 条交易")
+
+def load_meta_files(paths):
+    """
+    读取多个meta.json文件，或者目录中的所有.json文件
+    Returns:
+        list: (合约名, meta_json)的列表，按地址去重
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json")))
+        else:
+            files.append(path)
+    contracts = {}
+    for file in files:
+        with open(file, "r") as f:
+            meta_json = json.load(f)
+        for name, contract_meta in meta_json.items():
+            if contract_meta["address"].lower() in contracts:
+                logger.warning(f"{file}: 合约 {contract_meta['address']} 已经加载，跳过")
+                continue
+            contracts[contract_meta["address"].lower()] = (name, contract_meta)
+        logger.info(f"成功读取元数据文件: {file}")
+    return list(contracts.values())
+
+def build_contract(args, meta_json, contract_info, etherscan_rate_limiter, rpc_rate_limiter):
+    """
+    创建一个合约的TransactionInfo和StorageInfo，storage还没有初始同步时先获取全部历史交易再初始同步
+    Returns:
+        tuple: (TransactionInfo, StorageInfo)
+    """
+    transaction_db_config = {
+        'host': args.transaction_db_host,
+        'port': args.transaction_db_port,
+        'database': args.transaction_db_name,
+        'user': args.transaction_db_user,
+        'password': args.transaction_db_password
+    }
+    transaction_info = TransactionInfo(
+        meta_json["address"],
+        args.etherscan_apikey,
+        contract_info,
+        db_config=transaction_db_config,
+        logic_address=meta_json.get("logic_address"),
+        etherscan_workers=args.etherscan_workers,
+        rate_limiter=etherscan_rate_limiter
+    )
+    storage_db_config = {
+        'host': args.storage_db_host,
+        'port': args.storage_db_port,
+        'database': "storage_" + meta_json["address"],
+        'user': args.storage_db_user,
+        'password': args.storage_db_password
+    }
+    storage_info = StorageInfo(
+        meta_json,
+        meta_json["address"],
+        contract_info,
+        storage_db_config,
+        transaction_info,
+        rpc_batch_size=args.rpc_batch_size,
+        rpc_max_workers=args.rpc_max_workers,
+        write_batch_size=args.write_batch_size,
+        write_flush_interval=args.write_flush_interval,
+        replay_fetch_size=args.replay_fetch_size,
+        sync_mode=args.sync_mode,
+        init_bucket_size=args.init_bucket_size,
+        init_workers=args.init_workers,
+        rpc_rate_limiter=rpc_rate_limiter,
+        history=args.history,
+        history_retain_blocks=args.history_retain_blocks,
+        history_compact_interval=args.history_compact_interval
+    )
+    if storage_info.get_synced_block() is None:
+        backfill_transactions(transaction_info)
+        storage_info.get_all_keys_for_mapping()
+        storage_info.init_syn_storage(transaction_info.get_latest_block_number() or None)
+    return transaction_info, storage_info
+
+def main() -> None:
+    args = parse_args()
+    contracts = load_meta_files(args.meta_path)
+    if not contracts:
+        logger.error(f"没有找到元数据文件: {args.meta_path}")
+        sys.exit(1)
+
+    # 所有合约共享一个RPC连接、Etherscan限流和RPC限流
+    contract_info = ContractInfo(args.rpc_url)
+    etherscan_rate_limiter = TokenBucket(args.etherscan_rate)
+    rpc_rate_limiter = TokenBucket(args.rpc_rate, capacity=args.rpc_max_workers) if args.rpc_rate else None
+    infos = []
+    try:
+        for name, meta_json in contracts:
+            logger.info(f"初始化合约 {name} ({meta_json['address']})...")
+            infos.append((name,) + build_contract(args, meta_json, contract_info, etherscan_rate_limiter, rpc_rate_limiter))
+
+        # 流水线出错时从数据库中的水位线重新启动，连续出错时退出
+        consecutive_errors = 0
+        max_consecutive_errors = 5
+        while True:
+            follower = HeadFollower(contract_info.w3, revert_threshold=infos[0][1].revert_threshold,
+                                    poll_interval=args.poll_interval)
+            pipelines = [SyncPipeline(transaction_info, storage_info, follower, name=name, queue_size=args.queue_size,
+                                      ingest_window=args.ingest_window)
+                         for name, transaction_info, storage_info in infos]
+            coordinator = SyncCoordinator(follower, pipelines, max_concurrency=args.max_concurrency,
+                                          status_interval=args.status_interval)
+            synced_blocks = [storage_info.get_synced_block() for _, _, storage_info in infos]
+            try:
+                asyncio.run(coordinator.run())
+            except KeyboardInterrupt:
+                logger.info("收到中断信号，程序正在退出...")
+                break
+            except Exception as e:
+                if any(pipeline.progress["write"] is not None and pipeline.progress["write"] > synced_block
+                       for pipeline, synced_block in zip(pipelines, synced_blocks)):
+                    consecutive_errors = 0 # 出错之前storage有进展，不算连续错误
+                consecutive_errors += 1
+                logger.error(f"流水线发生错误: {e} (错误次数: {consecutive_errors})")
+                if consecutive_errors >= max_consecutive_errors:
+                    logger.error(f"连续 {max_consecutive_errors} 次发生错误，程序退出")
+                    sys.exit(1)
+                time.sleep(args.poll_interval)
+    finally:
+        get_http_client().log_metrics()
+        for _, transaction_info, storage_info in infos:
+            storage_info.close_connection()
+            transaction_info.close_db_connection()
+        close_all_pools()
+
+if __name__ == "__main__":
+    main()
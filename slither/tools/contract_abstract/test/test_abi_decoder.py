@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+测试AbiDecoder与web3的decode_function_input结果一致
+"""
+
+import sys
+import os
+import json
+from web3 import Web3
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+
+from slither.tools.contract_abstract.onchain.abi_decoder import AbiDecoder
+
+ABI = [
+    {"type": "function", "name": "supply", "inputs": [
+        {"name": "asset", "type": "address"},
+        {"name": "amount", "type": "uint256"},
+        {"name": "onBehalfOf", "type": "address"},
+        {"name": "referralCode", "type": "uint16"}
+    ]},
+    {"type": "function", "name": "batch", "inputs": [
+        {"name": "orders", "type": "tuple[]", "components": [
+            {"name": "user", "type": "address"},
+            {"name": "amounts", "type": "uint256[2]"}
+        ]},
+        {"name": "data", "type": "bytes"}
+    ]},
+    {"type": "event", "name": "Supply", "inputs": []}
+]
+ASSET = Web3.to_checksum_address("0x" + "ab" * 20)
+USER = Web3.to_checksum_address("0x" + "cd" * 20)
+
+
+def test_decode_same_as_web3():
+    """测试解码结果与web3一致"""
+    contract = Web3().eth.contract(abi=ABI)
+    decoder = AbiDecoder(json.dumps(ABI))
+    inputs = [
+        contract.encode_abi("supply", [ASSET, 10 ** 20, USER, 7]),
+        contract.encode_abi("batch", [[(ASSET, [1, 2]), (USER, [3, 4])], b"\x01\x02"])
+    ]
+    for tx_input in inputs:
+        func_obj, params = contract.decode_function_input(tx_input)
+        func_name, decoded = decoder.decode(tx_input)
+        assert func_name == func_obj.fn_name
+        assert decoded == dict(params)
+    print("✓ 解码结果与web3一致")
+
+
+def test_decode_many():
+    """测试批量解码保持顺序并缓存未知selector"""
+    contract = Web3().eth.contract(abi=ABI)
+    decoder = AbiDecoder(ABI)
+    supply_input = contract.encode_abi("supply", [ASSET, 1, USER, 0])
+    rows = [
+        {"input_data": supply_input, "method_id": supply_input[:10]},
+        {"input_data": "0xdeadbeef" + "00" * 32, "method_id": "0xdeadbeef"},
+        {"input_data": "0x", "method_id": "0x"},
+        {"input_data": supply_input[:20], "method_id": supply_input[:10]}
+    ]
+    results = decoder.decode_many(rows)
+    assert results[0] == ("supply", {"asset": ASSET, "amount": 1, "onBehalfOf": USER, "referralCode": 0})
+    assert results[1:] == [(None, None)] * 3
+    assert decoder.unknown_selectors == {"0xdeadbeef"}
+    print("✓ 批量解码测试通过")
+
+
+def test_stored_params():
+    """测试存入JSONB的解码结果可以还原为与直接解码相同的结果"""
+    contract = Web3().eth.contract(abi=ABI)
+    decoder = AbiDecoder(ABI)
+    tx_input = contract.encode_abi("batch", [[(ASSET, [1, 2 ** 255])], b"\x01\x02"])
+    func_name, params = decoder.decode(tx_input)
+    stored = json.loads(decoder.to_stored(func_name, params))
+    assert stored["params"]["data"] == "0x0102"
+
+    rows = [{"input_data": tx_input, "method_id": tx_input[:10], "decoded_params": stored}]
+    assert decoder.decode_many(rows) == [(func_name, params)]
+    assert decoder.to_stored(None, None) is None
+    print("✓ 解码结果存储测试通过")
+
+
+if __name__ == "__main__":
+    test_decode_same_as_web3()
+    test_decode_many()
+    test_stored_params()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+测试BatchStorageReader批量读取功能
+"""
+
+import sys
+import os
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+
+from slither.tools.contract_abstract.onchain.batch_storage_reader import BatchStorageReader
+
+
+class MockResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class MockBatchStorageReader(BatchStorageReader):
+    """不发送HTTP请求，slot的值就是slot本身"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.payloads = []
+
+    def _post(self, payload):
+        self.payloads.append(payload)
+        # 打乱返回顺序，模拟节点不按id顺序返回
+        results = [{"jsonrpc": "2.0", "id": item["id"], "result": item["params"][1]} for item in payload]
+        return MockResponse(results[::-1])
+
+
+def test_batch_split():
+    """测试按batch_size拆分请求并去重"""
+    reader = MockBatchStorageReader("http://localhost:8545", "0x1234567890123456789012345678901234567890", batch_size=3, max_workers=2)
+    slots = [1, 2, 3, 4, 5, 5, 6, 7]
+    results = reader.get_storage_at_many(slots, block_identifier=100)
+
+    assert len(reader.payloads) == 3
+    assert all(len(payload) <= 3 for payload in reader.payloads)
+    assert all(item["params"][2] == hex(100) for payload in reader.payloads for item in payload)
+    for slot in set(slots):
+        assert int.from_bytes(results[slot], "big") == slot
+    print("✓ 批量拆分测试通过")
+
+
+def test_error_item():
+    """测试单个请求返回错误时抛出异常"""
+    class ErrorReader(MockBatchStorageReader):
+        def _post(self, payload):
+            return MockResponse([{"jsonrpc": "2.0", "id": 0, "error": {"code": -32000, "message": "header not found"}}])
+
+    reader = ErrorReader("http://localhost:8545", "0x1234567890123456789012345678901234567890")
+    try:
+        reader.get_storage_at_many([1])
+    except Exception as e:
+        print(f"✓ 错误处理测试通过: {e}")
+        return
+    raise AssertionError("应该抛出异常")
+
+
+if __name__ == "__main__":
+    test_batch_split()
+    test_error_item()
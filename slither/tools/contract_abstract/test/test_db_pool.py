@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+测试进程内共享的数据库连接池：每个DSN只检查一次数据库环境，连接复用，空闲连接的健康检查以及连接数限制
+"""
+
+import sys
+import os
+import psycopg2
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+sys.path.append(os.path.dirname(__file__))
+
+from slither.tools.contract_abstract import db_pool
+from slither.tools.contract_abstract.db_pool import ConnectionPool, get_pool, close_all_pools
+from test_init_sync_progress import DB_CONFIG
+
+
+def test_bootstrap_once():
+    calls = []
+    setup_database = db_pool.DatabaseManager.setup_database
+    db_pool.DatabaseManager.setup_database = lambda self, check_server=True: calls.append((self.db_config["database"], check_server)) or True
+    try:
+        close_all_pools()
+        pool = get_pool(DB_CONFIG)
+        assert get_pool(dict(DB_CONFIG)) is pool
+        # 同一个服务器上的其他数据库只需要创建数据库
+        other = get_pool(dict(DB_CONFIG, database="other_database"))
+        assert other is not pool
+        assert calls == [(DB_CONFIG["database"], True), ("other_database", False)]
+    finally:
+        db_pool.DatabaseManager.setup_database = setup_database
+        close_all_pools()
+    print("✓ 数据库环境只检查一次测试通过")
+
+
+def test_reuse_and_health_check():
+    pool = ConnectionPool(DB_CONFIG, health_check_interval=0)
+    try:
+        connection = pool.getconn()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            pid = cursor.fetchone()[0]
+        # 没有结束的事务在归还时回滚，之后复用同一个连接
+        pool.putconn(connection)
+        assert connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        assert pool.getconn() is connection
+        pool.putconn(connection)
+
+        # 服务端断开空闲连接之后，取出时通过健康检查发现并重新连接
+        admin = psycopg2.connect(**DB_CONFIG)
+        admin.autocommit = True
+        with admin.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+        admin.close()
+        connection = pool.getconn()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid()")
+            assert cursor.fetchone()[0] != pid
+        pool.putconn(connection)
+        assert pool.opened == 1 and len(pool.idle) == 1
+    finally:
+        pool.closeall()
+    print("✓ 连接复用和健康检查测试通过")
+
+
+def test_max_connections():
+    pool = ConnectionPool(DB_CONFIG, max_connections=1, timeout=0.1)
+    try:
+        connection = pool.getconn()
+        try:
+            pool.getconn()
+            assert False, "应该超时"
+        except Exception as e:
+            assert "超时" in str(e)
+        # 断开的连接归还时被丢弃，释放连接数
+        connection.close()
+        pool.putconn(connection)
+        assert pool.opened == 0
+        pool.putconn(pool.getconn())
+        assert pool.opened == 1
+    finally:
+        pool.closeall()
+    print("✓ 连接数限制测试通过")
+
+
+if __name__ == "__main__":
+    test_bootstrap_once()
+    test_reuse_and_health_check()
+    test_max_connections()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+测试fact_keys表的写入和读取
+"""
+
+import sys
+import os
+import psycopg2
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+
+from slither.tools.contract_abstract.onchain.fact_key_store import FactKeyStore
+
+DB_CONFIG = {
+    'host': os.environ.get('PGHOST', 'localhost'),
+    'database': os.environ.get('PGDATABASE', 'test_ethereum_transactions'),
+    'user': 'postgres',
+    'password': os.environ.get('PGPASSWORD', 'password'),
+    'port': 5432
+}
+TOKEN = "0xdAC17F958D2ee523a2206206994597C13D831ec7"
+
+
+def test_fact_key_store():
+    """测试key去重、保留最早的区块以及按类型还原"""
+    connection = psycopg2.connect(**DB_CONFIG)
+    store = FactKeyStore(lambda: connection)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS fact_keys")
+            FactKeyStore.create_tables(cursor)
+            store.add_keys(cursor, {"_balances": {TOKEN.lower(): 20}, "_allowances": {(TOKEN, 7): 30}, "_ids": {b"\x01" * 32: None}})
+            # 小写地址和checksum地址是同一个key，保留较早的区块
+            store.add_keys(cursor, {"_balances": {TOKEN: 10}, "_allowances": {(TOKEN, 7): 40}})
+            cursor.execute("SELECT entity, key1, key2, first_seen_block FROM fact_keys ORDER BY entity")
+            assert cursor.fetchall() == [("_allowances", TOKEN, "7", 30), ("_balances", TOKEN, "", 10), ("_ids", "0x" + "01" * 32, "", None)]
+        connection.commit()
+
+        fact_keys = store.load({"_balances": ["address"], "_allowances": ["address", "uint256"], "_ids": ["bytes32"]})
+        assert fact_keys == {"_balances": {TOKEN}, "_allowances": {(TOKEN, 7)}, "_ids": {b"\x01" * 32}}
+        # meta.json中已经没有的entity不会被读取
+        assert store.load({"_balances": ["address"]}) == {"_balances": {TOKEN}}
+        print("✓ fact_keys表测试通过")
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS fact_keys")
+        connection.commit()
+        connection.close()
+
+
+if __name__ == "__main__":
+    test_fact_key_store()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+测试多个合约之间按落后区块数公平分配并发数
+"""
+
+import sys
+import os
+import asyncio
+import threading
+import time
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+
+from slither.tools.contract_abstract.onchain.fair_scheduler import FairScheduler
+
+
+def test_share_by_backlog():
+    """落后多的合约得到更多的份额，已经追上链头的合约也会被执行"""
+    scheduler = FairScheduler(1)
+    order = []
+
+    async def worker(name, backlog, count):
+        for _ in range(count):
+            await scheduler.run(name, backlog, lambda: (order.append(name), time.sleep(0.001)))
+
+    async def main():
+        # 每个合约的流水线有多个阶段同时等待
+        await asyncio.gather(*[worker("behind", 1023, 15) for _ in range(4)], *[worker("live", 0, 15) for _ in range(4)])
+    asyncio.run(main())
+
+    # weight分别为11和1，前66次执行中大约60次是落后的合约
+    first = order[:66]
+    assert 50 <= first.count("behind") <= 62 and first.count("live") >= 4
+    assert scheduler.granted == {"behind": 60, "live": 60} and scheduler.running == 0
+    print("✓ 按落后区块数分配份额测试通过")
+
+
+def test_concurrency_limit():
+    scheduler = FairScheduler(2)
+    lock = threading.Lock()
+    state = {"running": 0, "max": 0}
+
+    def job():
+        with lock:
+            state["running"] += 1
+            state["max"] = max(state["max"], state["running"])
+        time.sleep(0.01)
+        with lock:
+            state["running"] -= 1
+
+    async def main():
+        await asyncio.gather(*(scheduler.run(f"contract{i % 3}", i, job) for i in range(12)))
+        # 等待中被取消的调用不占用并发数
+        blocker = asyncio.create_task(scheduler.run("a", 0, time.sleep, 0.05))
+        blocker2 = asyncio.create_task(scheduler.run("b", 0, time.sleep, 0.05))
+        waiting = asyncio.create_task(scheduler.run("c", 0, job))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.gather(blocker, blocker2, return_exceptions=True)
+        assert waiting.cancelled()
+        await scheduler.run("d", 0, job)
+    asyncio.run(main())
+    assert state["max"] == 2 and scheduler.running == 0
+    print("✓ 并发数限制测试通过")
+
+
+if __name__ == "__main__":
+    test_share_by_backlog()
+    test_concurrency_limit()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+测试链头跟踪的重组检测，以及重组之后storage表回滚到共同祖先区块
+"""
+
+import sys
+import os
+import psycopg2
+from web3 import Web3
+from web3.exceptions import BlockNotFound
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+sys.path.append(os.path.dirname(__file__))
+
+from slither.tools.contract_abstract.onchain.head_follower import HeadFollower
+from test_init_sync_progress import make_db_storage_info, drop_tables, DB_CONFIG, HOLDERS
+
+
+class FakeEth:
+    def __init__(self):
+        self.chain = {} # block_number -> {"hash", "parentHash"}
+
+    @property
+    def block_number(self):
+        return max(self.chain)
+
+    def get_block(self, block_number):
+        if block_number not in self.chain:
+            raise BlockNotFound(f"block {block_number} not found")
+        return self.chain[block_number]
+
+    def extend(self, fork, start_block, end_block):
+        """在start_block之后接上fork分叉的区块，丢弃更高的区块"""
+        for number in [number for number in self.chain if number >= start_block]:
+            del self.chain[number]
+        for number in range(start_block, end_block + 1):
+            parent = self.chain[number - 1]["hash"] if number - 1 in self.chain else bytes(32)
+            self.chain[number] = {"hash": bytes([fork]) + number.to_bytes(31, "big"), "parentHash": parent}
+
+
+class FakeWeb3:
+    def __init__(self):
+        self.eth = FakeEth()
+        self.to_hex = Web3.to_hex
+
+
+def test_follow_and_reorg():
+    w3 = FakeWeb3()
+    w3.eth.extend(1, 90, 100)
+    follower = HeadFollower(w3, revert_threshold=5)
+    assert follower.start(100) is None
+    assert follower.poll() is None
+
+    w3.eth.extend(1, 101, 103)
+    assert follower.poll() == ("advance", 101, 103)
+    assert len(follower.blocks) == 4
+
+    # 区块102和103被重组，新的分叉更长
+    w3.eth.extend(2, 102, 104)
+    assert follower.poll() == ("reorg", 101)
+    assert follower.is_canonical(101, Web3.to_hex(w3.eth.chain[101]["hash"]))
+    assert follower.poll() == ("advance", 102, 104)
+    assert follower.is_canonical(103, Web3.to_hex(w3.eth.chain[103]["hash"]))
+    assert not follower.is_canonical(103, Web3.to_hex(bytes([1]) + (103).to_bytes(31, "big")))
+
+    # 缓冲区只保留revert_threshold + 1个区块，更深的重组无法处理
+    w3.eth.extend(2, 105, 120)
+    assert follower.poll() == ("advance", 105, 120)
+    w3.eth.extend(3, 110, 121)
+    try:
+        follower.poll()
+        assert False, "应该无法处理"
+    except Exception as e:
+        assert "revert_threshold" in str(e)
+    print("✓ 链头跟踪和重组检测测试通过")
+
+
+def test_start_with_orphaned_data():
+    """测试启动时已经保存的数据所在的区块被重组"""
+    w3 = FakeWeb3()
+    w3.eth.extend(1, 90, 100)
+    known = {number: Web3.to_hex(w3.eth.chain[number]["hash"]) for number in [92, 95, 98, 100]}
+    w3.eth.extend(2, 97, 101)
+    follower = HeadFollower(w3, revert_threshold=10)
+    # 95是最高的仍然在链上的区块，96没有数据，也需要重新获取
+    assert follower.start(100, known) == 95
+    assert follower.poll() == ("advance", 96, 101)
+    print("✓ 启动时重组检测测试通过")
+
+
+def test_storage_rollback():
+    """测试重组之后在祖先区块上重新读取之后被写过的行，水位线退回到祖先区块"""
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        drop_tables(connection)
+        storage_info, _ = make_db_storage_info(connection)
+        storage_info.fact_keys_watermark_name = "fact_keys"
+        storage_info.preimage_watermark_name = "fact_keys_preimage"
+        # 读到的值是读取时固定的区块号
+        storage_info.pin_block = lambda block_number: setattr(storage_info, "pinned", block_number)
+        storage_info.entity.get_storage_values = lambda slots: [storage_info.pinned for _ in slots]
+        storage_info.init_syn_storage()
+
+        holder = sorted(HOLDERS)[0]
+        storage_info.apply_block_changes(103, "0x" + "03" * 32, {("_balances", (holder,)): {None}})
+        with connection.cursor() as cursor:
+            storage_info.watermark.set(cursor, "fact_keys", 103)
+        connection.commit()
+        assert storage_info.get_synced_block() == 103
+
+        storage_info.rollback_to_block(101)
+        assert storage_info.get_synced_block() == 101
+        assert storage_info.watermark.get("fact_keys")[0] == 101
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT lower(key1), value, block_number FROM _balances")
+            rows = {key: (int(value), block_number) for key, value, block_number in cursor.fetchall()}
+        assert rows[holder] == (101, 101)
+        assert all(rows[key] == (100, 100) for key in HOLDERS if key != holder)
+        storage_info.db_connection = None # 连接由测试关闭，StorageInfo析构时不关闭
+        print("✓ storage回滚测试通过")
+    finally:
+        drop_tables(connection)
+        connection.close()
+
+
+if __name__ == "__main__":
+    test_follow_and_reorg()
+    test_start_with_orphaned_data()
+    test_storage_rollback()
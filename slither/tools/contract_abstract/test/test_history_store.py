@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+测试storage历史表：按区块查询历史的值和区块范围内的改变、值没有变化时不产生新版本、重组回滚以及压缩
+"""
+
+import sys
+import os
+import psycopg2
+from web3 import Web3
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+sys.path.append(os.path.dirname(__file__))
+
+from slither.tools.contract_abstract.onchain.history_store import HistoryStore
+from test_init_sync_progress import DB_CONFIG, TABLES, make_db_storage_info, drop_tables
+from test_replay_engine import ALICE
+
+BLOCK_HASH = Web3.to_hex(b"\x0c" * 32)
+
+
+def drop_history_tables(connection):
+    with connection.cursor() as cursor:
+        for table_name in TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS {HistoryStore.get_history_table(table_name)}")
+    connection.commit()
+    drop_tables(connection)
+
+
+def test_history():
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        drop_history_tables(connection)
+        storage_info, _ = make_db_storage_info(connection, history={"retain_blocks": 40, "compact_interval": 10})
+        storage_info.revert_threshold = 12
+        assert storage_info.init_syn_storage() == 100
+        assert storage_info.history_store.is_versioned("_balances") and storage_info.history_store.is_versioned("simple_entities")
+
+        holders = sorted(row["key1"] for row in storage_info.read_elements_from_table("_balances", ["key1"], {}))
+        changed, unchanged = holders[0], holders[1]
+        original = storage_info.read_elements_from_table("_balances", ["value"], {"key1": changed})[0]["value"]
+        unchanged_value = storage_info.read_elements_from_table("_balances", ["value"], {"key1": unchanged})[0]["value"]
+
+        # 区块105改变一个余额和owner，另一个余额被重新读取但是值没有变化
+        storage_info._write_block_rows(105, BLOCK_HASH, {
+            ("_balances", (changed,)): {"key1": changed, "value": 7},
+            ("_balances", (unchanged,)): {"key1": unchanged, "value": unchanged_value},
+            ("simple_entities", None): {"id": 1, "owner": ALICE}})
+        # 区块110只推进区块，不产生新版本
+        with storage_info.table_writer.transaction():
+            storage_info._write_sync_block(110, BLOCK_HASH)
+        storage_info._write_block_rows(130, BLOCK_HASH, {("_balances", (changed,)): {"key1": changed, "value": 9}})
+
+        value_at = lambda block: storage_info.read_elements_at_block("_balances", ["value"], {"key1": changed}, block)[0]["value"]
+        assert [value_at(block) for block in [100, 104, 105, 129, 130, 200]] == [original, original, 7, 7, 9, 9]
+        changes = storage_info.read_element_changes("_balances", ["value"], {"key1": changed}, 100, 200)
+        assert [(row["value"], row["valid_from_block"], row["valid_to_block"]) for row in changes] == \
+            [(original, 100, 105), (7, 105, 130), (9, 130, None)]
+        assert len(storage_info.read_element_changes("_balances", ["value"], {"key1": unchanged}, 100, 200)) == 1
+        owners = storage_info.read_element_changes("simple_entities", ["owner"], {}, 100, 200)
+        assert [(row["owner"], row["valid_from_block"]) for row in owners] == [(storage_info.read_elements_at_block(
+            "simple_entities", ["owner"], {}, 100)[0]["owner"], 100), (ALICE, 105)]
+        # 整个表在某个区块的状态
+        assert len(storage_info.read_elements_at_block("_balances", [], {}, 120)) == len(holders)
+
+        # 重组回滚到区块120之后，130的版本被删除，105的版本重新成为当前版本
+        with connection.cursor() as cursor:
+            storage_info.history_store.rollback(cursor, 120)
+        connection.commit()
+        assert value_at(200) == 7
+        assert storage_info.read_element_changes("_balances", ["value"], {"key1": changed}, 100, 200)[-1]["valid_to_block"] is None
+
+        # 压缩不能超过重组阈值，压缩之后之前区块的状态不能查询
+        try:
+            storage_info.compact_history(125)
+            assert False, "应该超过重组阈值"
+        except Exception as e:
+            assert "重组阈值" in str(e)
+        assert storage_info.compact_history(105) == 2
+        assert value_at(105) == 7
+        try:
+            value_at(104)
+            assert False, "历史已经被压缩"
+        except Exception as e:
+            assert "已经被压缩" in str(e)
+
+        # 同步超过保留的区块数和压缩间隔之后自动压缩
+        with storage_info.table_writer.transaction():
+            storage_info._write_sync_block(150, BLOCK_HASH)
+        assert storage_info.history_store.get_compacted_block() == 105
+        with storage_info.table_writer.transaction():
+            storage_info._write_sync_block(160, BLOCK_HASH)
+        assert storage_info.history_store.get_compacted_block() == 120
+        assert storage_info.watermark.get("history_compacted")[0] == 120
+        storage_info.db_connection = None
+        print("✓ storage历史表测试通过")
+    finally:
+        drop_history_tables(connection)
+        connection.close()
+
+
+def test_enable_history_on_synced_tables():
+    """已经同步过的storage数据库开启历史时复制当前的行，历史开始之前的区块不能查询"""
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        drop_history_tables(connection)
+        storage_info, _ = make_db_storage_info(connection)
+        assert storage_info.init_syn_storage() == 100
+        holder = sorted(row["key1"] for row in storage_info.read_elements_from_table("_balances", ["key1"], {}))[0]
+        storage_info._write_block_rows(105, BLOCK_HASH, {("_balances", (holder,)): {"key1": holder, "value": 7}})
+        storage_info.db_connection = None
+
+        storage_info, _ = make_db_storage_info(connection, history={})
+        storage_info.revert_threshold = 12
+        rows = storage_info.read_elements_at_block("_balances", ["key1", "value"], {}, 105)
+        assert len(rows) == 25 and {row["key1"]: row["value"] for row in rows}[holder] == 7
+        changes = storage_info.read_element_changes("_balances", ["value"], {"key1": holder}, 105, 200)
+        assert [(row["value"], row["valid_from_block"], row["valid_to_block"]) for row in changes] == [(7, 105, None)]
+        assert storage_info.read_elements_at_block("simple_entities", ["owner"], {}, 105)
+        for read in [lambda: storage_info.read_elements_at_block("_balances", ["value"], {}, 104),
+                     lambda: storage_info.read_element_changes("_balances", ["value"], {"key1": holder}, 100, 200)]:
+            try:
+                read()
+                assert False, "历史开始之前的区块不能查询"
+            except Exception as e:
+                assert "开始记录" in str(e)
+
+        # 之后的改变正常记录，再次启动时不重复复制
+        storage_info._write_block_rows(120, BLOCK_HASH, {("_balances", (holder,)): {"key1": holder, "value": 8}})
+        storage_info.db_connection = None
+        storage_info, _ = make_db_storage_info(connection, history={})
+        changes = storage_info.read_element_changes("_balances", ["value"], {"key1": holder}, 105, 200)
+        assert [(row["value"], row["valid_from_block"], row["valid_to_block"]) for row in changes] == [(7, 105, 120), (8, 120, None)]
+        storage_info.db_connection = None
+        print("✓ 已同步的表开启历史测试通过")
+    finally:
+        drop_history_tables(connection)
+        connection.close()
+
+
+if __name__ == "__main__":
+    test_history()
+    test_enable_history_on_synced_tables()
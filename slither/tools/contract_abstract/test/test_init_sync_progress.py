@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+测试初始同步按分区提交进度，中断之后重新调用只处理没有完成的分区
+"""
+
+import sys
+import os
+import threading
+from types import SimpleNamespace
+import psycopg2
+from web3 import Web3
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+sys.path.append(os.path.dirname(__file__))
+
+from slither.tools.contract_abstract.onchain.table_writer import BufferedTableWriter
+from slither.tools.contract_abstract.onchain.table_catalog import TableCatalog
+from slither.tools.contract_abstract.onchain.sync_watermark import SyncWatermark
+from slither.tools.contract_abstract.onchain.fact_key_store import FactKeyStore
+from slither.tools.contract_abstract.onchain.init_sync_progress import InitSyncProgress
+from slither.tools.contract_abstract.onchain.history_store import HistoryStore
+from slither.tools.contract_abstract.contract.entity import Entity
+from test_replay_engine import make_storage_info, ENTITIES, SENDER, UINT, ADDRESS
+
+DB_CONFIG = {
+    'host': os.environ.get('PGHOST', 'localhost'),
+    'database': os.environ.get('PGDATABASE', 'test_ethereum_transactions'),
+    'user': 'postgres',
+    'password': os.environ.get('PGPASSWORD', 'password'),
+    'port': 5432
+}
+TABLES = list(ENTITIES) + ["simple_entities", "sync_watermarks", "fact_keys", "init_sync_progress"]
+BLOCK_HASH = b"\x0b" * 32
+HOLDERS = {"0x" + f"{i:040x}" for i in range(1, 26)}
+
+
+def make_db_storage_info(connection, fail_after=None, init_workers=1, history=None, entities=None, fact_keys=None):
+    """
+    连接真实数据库的StorageInfo，storage的值由slot计算得到，读取fail_after个分区之后抛出异常，
+    history不为None时作为HistoryStore的参数开启历史表，entities和fact_keys替换默认的合约storage和mapping的key
+    """
+    storage_info = make_storage_info({})
+    del storage_info.read_elements_from_table
+    if entities is not None:
+        storage_info.meta_json = dict(storage_info.meta_json, entities=entities)
+        storage_info.entity = Entity(SENDER, None, None, entities)
+    storage_info.db_config = DB_CONFIG
+    storage_info.db_connection = connection
+    storage_info.w3 = SimpleNamespace(to_hex=Web3.to_hex, eth=SimpleNamespace(block_number=100, get_block=lambda number: {"hash": BLOCK_HASH}))
+    storage_info.pin_block = lambda block_number: None
+    storage_info.table_catalog = TableCatalog(load_primary_keys=storage_info._get_table_primary_keys)
+    storage_info.watermark = SyncWatermark(lambda: connection)
+    if history is not None:
+        storage_info.history_store = HistoryStore(lambda: connection, storage_info.table_catalog, storage_info.watermark, **history)
+    storage_info.table_writer = BufferedTableWriter(lambda: connection, storage_info.table_catalog, batch_size=7, flush_interval=60,
+                                                    history=storage_info.history_store)
+    storage_info.fact_key_store = FactKeyStore(lambda: connection)
+    storage_info.init_progress = InitSyncProgress(lambda: connection)
+    storage_info.watermark_name = "storage"
+    storage_info.init_snapshot_name = "init_snapshot"
+    storage_info.snapshot_columns = ["block_number", "block_hash"]
+    storage_info.init_bucket_size = 10
+    storage_info.init_workers = init_workers
+    storage_info.fact_keys = {"_balances": set(HOLDERS)} if fact_keys is None else fact_keys
+    storage_info.create_init_tables()
+
+    reads = []
+    lock = threading.Lock()
+    def get_storage_values(slots):
+        with lock:
+            if fail_after is not None and len(reads) >= fail_after:
+                raise Exception("模拟RPC中断")
+            reads.append(len(slots))
+        return [SENDER if storage_type["dataType"] == "address" else slot_info["slot"] % 1000 for slot_info, storage_type in slots]
+    storage_info.entity.get_storage_values = get_storage_values
+    return storage_info, reads
+
+
+def drop_tables(connection):
+    with connection.cursor() as cursor:
+        for table_name in TABLES:
+            cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    connection.commit()
+
+
+def test_resume_init_sync():
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        drop_tables(connection)
+        # 25个key分成3个桶，加上简单类型一共4个分区，读取2个分区后中断
+        storage_info, reads = make_db_storage_info(connection, fail_after=2)
+        try:
+            storage_info.init_syn_storage()
+            assert False, "应该中断"
+        except Exception as e:
+            assert "模拟RPC中断" in str(e)
+        progress = storage_info.init_progress.load(100)
+        assert len(progress) == 4 and sum(state["completed"] for state in progress.values()) == 2
+        assert storage_info.get_synced_block() is None
+        storage_info.db_connection = None # 连接由测试关闭，StorageInfo析构时不关闭
+
+        # 重启之后只读取剩下的2个分区，分区并行完成
+        storage_info, reads = make_db_storage_info(connection, init_workers=2)
+        assert storage_info.get_synced_block() is None
+        assert storage_info.init_syn_storage() == 100
+        assert len(reads) == 2
+        assert storage_info.get_synced_block() == 100
+        assert all(state["completed"] for state in storage_info.init_progress.load(100).values())
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT key1, value, block_number FROM _balances")
+            rows = cursor.fetchall()
+            cursor.execute("SELECT owner, block_number, block_hash FROM simple_entities")
+            assert cursor.fetchall() == [(SENDER, 100, Web3.to_hex(BLOCK_HASH))]
+        assert {row[0].lower() for row in rows} == HOLDERS and all(row[2] == 100 for row in rows)
+        expected = {key: storage_info._get_mapping_slot("address", key, 1) % 1000 for key in HOLDERS}
+        assert {row[0].lower(): int(row[1]) for row in rows} == expected
+        storage_info.db_connection = None
+        print("✓ 初始同步断点续传测试通过")
+    finally:
+        drop_tables(connection)
+        connection.close()
+
+
+def test_struct_field_tables():
+    """mapping的struct值中有数组字段时，每个key的table_<slot>表由主线程在分区的事务中创建，工作线程不访问数据库"""
+    entities = {
+        "owner": ENTITIES["owner"],
+        "_positions": {"dataType": "mapping", "storageInfo": {"slot": 5, "offset": 0}, "dataMeta": {"key": ADDRESS, "value": {
+            "dataType": "struct", "dataMeta": {"name": "Position", "fields": [
+                {"name": "amount", "type": UINT},
+                {"name": "ids", "type": {"dataType": "staticArray", "dataMeta": {"elementType": UINT, "length": 2}}}]}}}},
+    }
+    holders = sorted(HOLDERS)[:4]
+    connection = psycopg2.connect(**DB_CONFIG)
+    tables = []
+    try:
+        drop_tables(connection)
+        storage_info, _ = make_db_storage_info(connection, init_workers=2, entities=entities, fact_keys={"_positions": set(holders)})
+        storage_info.init_bucket_size = 1
+        threads = []
+        create_table = storage_info.create_table
+        def record_create_table(table_name, attributes, primary_keys):
+            threads.append(threading.current_thread())
+            return create_table(table_name, attributes, primary_keys)
+        storage_info.create_table = record_create_table
+
+        assert storage_info.init_syn_storage() == 100
+        assert threads and all(thread is threading.main_thread() for thread in threads)
+        rows = storage_info.read_elements_from_table("_positions", ["key1", "amount", "ids"], {})
+        assert {row["key1"].lower() for row in rows} == set(holders)
+        tables = ["table_" + row["ids"] for row in rows]
+        for row in rows:
+            elements = storage_info.read_elements_from_table("table_" + row["ids"], ["key1", "value"], {})
+            element_slot = int(row["ids"])
+            assert sorted((element["key1"], int(element["value"])) for element in elements) == \
+                [(i, (element_slot + i) % 1000) for i in range(2)]
+        assert all(state["completed"] for state in storage_info.init_progress.load(100).values())
+        storage_info.db_connection = None
+        print("✓ struct字段表测试通过")
+    finally:
+        with connection.cursor() as cursor:
+            for table_name in tables + ["_positions"]:
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+        connection.commit()
+        drop_tables(connection)
+        connection.close()
+
+
+def test_mapping_only_contract():
+    """合约只有mapping时simple_entities仍然被创建，记录同步到的区块"""
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        drop_tables(connection)
+        storage_info, _ = make_db_storage_info(connection, entities={"_balances": ENTITIES["_balances"]})
+        assert storage_info.init_syn_storage() == 100
+        assert storage_info.read_elements_from_table("simple_entities", ["block_number"], {}) == [{"block_number": 100}]
+        assert len(storage_info.read_elements_from_table("_balances", ["key1"], {})) == len(HOLDERS)
+        storage_info.db_connection = None
+        print("✓ 只有mapping的合约测试通过")
+    finally:
+        drop_tables(connection)
+        connection.close()
+
+
+if __name__ == "__main__":
+    test_resume_init_sync()
+    test_struct_field_tables()
+    test_mapping_only_contract()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+测试按区块分区并行发现mapping的key
+"""
+
+import sys
+import os
+import json
+import psycopg2
+from eth_utils import keccak
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+sys.path.append(os.path.dirname(__file__))
+
+from slither.tools.contract_abstract.onchain.key_discovery import discover_fact_keys, plan_partitions
+from test_replay_engine import make_abi, make_tx
+
+DB_CONFIG = {
+    'host': os.environ.get('PGHOST', 'localhost'),
+    'database': os.environ.get('PGDATABASE', 'test_ethereum_transactions'),
+    'user': 'postgres',
+    'password': os.environ.get('PGPASSWORD', 'password'),
+    'port': 5432
+}
+TABLE_NAME = "test_key_discovery_transactions"
+
+
+def prepare_table(connection):
+    cursor = connection.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+    cursor.execute(f"""
+    CREATE TABLE {TABLE_NAME} (
+        hash VARCHAR(66) PRIMARY KEY,
+        block_number BIGINT,
+        transaction_index INTEGER,
+        from_address VARCHAR(42),
+        method_id VARCHAR(10),
+        input_data TEXT,
+        is_error INTEGER,
+        decoded_params JSONB
+    )
+    """)
+    # 前面的区块交易稀疏，后面的区块交易密集
+    rows = []
+    for i in range(400):
+        block_number = i * 10 if i < 100 else 1000 + i // 20
+        receiver = "0x" + f"{i % 150:040x}"
+        tx = make_tx("transfer(address,uint256)", [receiver, i])
+        rows.append((tx["hash"], block_number, i % 20, tx["from_address"], tx["method_id"], tx["input_data"], 0, None))
+    cursor.executemany(f"INSERT INTO {TABLE_NAME} VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", rows)
+    connection.commit()
+    cursor.close()
+
+
+def test_parallel_discovery():
+    """测试分区按交易数切分，并且并行结果与单进程结果相同"""
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        prepare_table(connection)
+        ranges = plan_partitions(connection, TABLE_NAME, 0, 2000, 8)
+        assert ranges[0][0] == 0 and ranges[-1][1] == 2000
+        assert all(ranges[i][1] + 1 == ranges[i + 1][0] for i in range(len(ranges) - 1))
+        # 交易密集的区块范围被切得更细
+        assert len([r for r in ranges if r[0] >= 1000]) > len([r for r in ranges if r[1] < 1000])
+
+        abi = json.dumps(make_abi())
+        all_keys = {"0x" + keccak(text="transfer(address,uint256)")[:4].hex(): {"_balances": {"to", "$msg_sender"}}}
+        serial = discover_fact_keys(DB_CONFIG, TABLE_NAME, abi, all_keys, 0, 2000, workers=1)
+        parallel = discover_fact_keys(DB_CONFIG, TABLE_NAME, abi, all_keys, 0, 2000, workers=3)
+        assert parallel == serial
+        assert len(serial["_balances"]) == 151
+        # 同一个key保留第一次出现的区块
+        assert serial["_balances"]["0x" + f"{99:040x}"] == 990
+        print("✓ 并行发现key测试通过")
+    finally:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+        connection.commit()
+        connection.close()
+
+
+if __name__ == "__main__":
+    test_parallel_discovery()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+测试交易表的键集分页
+"""
+
+import sys
+import os
+import psycopg2
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+
+from slither.tools.contract_abstract.onchain.transaction_info import iter_transaction_pages, KEYSET_ORDER
+
+DB_CONFIG = {
+    'host': os.environ.get('PGHOST', 'localhost'),
+    'database': os.environ.get('PGDATABASE', 'test_ethereum_transactions'),
+    'user': 'postgres',
+    'password': os.environ.get('PGPASSWORD', 'password'),
+    'port': 5432
+}
+TABLE_NAME = "test_keyset_transactions"
+
+
+def prepare_table(connection):
+    cursor = connection.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+    cursor.execute(f"""
+    CREATE TABLE {TABLE_NAME} (
+        hash VARCHAR(66) PRIMARY KEY,
+        block_number BIGINT,
+        transaction_index INTEGER
+    )
+    """)
+    cursor.execute(f"CREATE INDEX ON {TABLE_NAME}({KEYSET_ORDER})")
+    # 每个区块4笔交易，部分transaction_index为空
+    rows = [(f"0x{i:04d}", i // 4 + 1, None if i % 7 == 0 else i % 4) for i in range(103)]
+    cursor.executemany(f"INSERT INTO {TABLE_NAME} VALUES (%s, %s, %s)", rows)
+    connection.commit()
+    cursor.close()
+    return rows
+
+
+def test_keyset_pagination():
+    """测试升序、降序分页不重复不遗漏且保持顺序"""
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        rows = prepare_table(connection)
+        expected = sorted(rows, key=lambda row: (row[1], -1 if row[2] is None else row[2], row[0]))
+
+        pages = list(iter_transaction_pages(connection, TABLE_NAME, page_size=10, ascending=True))
+        assert len(pages) == 11
+        assert all(len(page) <= 10 for page in pages)
+        assert [tx["hash"] for page in pages for tx in page] == [row[0] for row in expected]
+
+        pages = list(iter_transaction_pages(connection, TABLE_NAME, page_size=7, ascending=False))
+        assert [tx["hash"] for page in pages for tx in page] == [row[0] for row in expected[::-1]]
+
+        pages = list(iter_transaction_pages(connection, TABLE_NAME, start_block=3, end_block=5, page_size=4))
+        assert [tx["hash"] for page in pages for tx in page] == [row[0] for row in expected if 3 <= row[1] <= 5]
+        print("✓ 键集分页测试通过")
+    finally:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE_NAME}")
+        connection.commit()
+        connection.close()
+
+
+if __name__ == "__main__":
+    test_keyset_pagination()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+测试从事件日志中发现mapping的key：事件参数和写mapping的参数的对应、日志解码以及eth_getLogs窗口的自适应切分
+"""
+
+import sys
+import os
+from eth_abi import encode
+from eth_utils import keccak
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+sys.path.append(os.path.dirname(__file__))
+
+from slither.tools.contract_abstract.onchain.log_key_discovery import LogFetcher, build_event_key_map, decode_log, discover_keys_from_logs
+from test_replay_engine import make_abi, make_storage_info, SENDER, ALICE
+
+TRANSFER = {"type": "event", "name": "Transfer", "anonymous": False, "inputs": [
+    {"name": "from", "type": "address", "indexed": True},
+    {"name": "to", "type": "address", "indexed": True},
+    {"name": "value", "type": "uint256", "indexed": False}]}
+APPROVAL = {"type": "event", "name": "Approval", "anonymous": False, "inputs": [
+    {"name": "owner", "type": "address", "indexed": True},
+    {"name": "spender", "type": "address", "indexed": True},
+    {"name": "value", "type": "uint256", "indexed": False}]}
+FUNCTION_EVENTS = {
+    "transfer(address,uint256)": [{"event": "Transfer(address,address,uint256)", "arguments": ["$msg_sender", "to", "amount"]}],
+    "approve(address,uint256)": [{"event": "Approval(address,address,uint256)", "arguments": ["$msg_sender", "spender", "amount"]}],
+}
+TRANSFER_TOPIC = "0x" + keccak(text="Transfer(address,address,uint256)").hex()
+APPROVAL_TOPIC = "0x" + keccak(text="Approval(address,address,uint256)").hex()
+
+
+class MockResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class MockLogFetcher(LogFetcher):
+    """节点最多接受max_range个区块的请求，日志由logs提供，rate_limited中的回复先依次返回"""
+
+    def __init__(self, logs, max_range, rate_limited=None, **kwargs):
+        super().__init__("http://localhost:8545", SENDER, rate_limit_delay=0, **kwargs)
+        self.logs = logs
+        self.max_range = max_range
+        self.rate_limited = list(rate_limited or [])
+        self.requests = []
+
+    def _post(self, payload):
+        params = payload["params"][0]
+        start, end = int(params["fromBlock"], 16), int(params["toBlock"], 16)
+        self.requests.append((start, end))
+        if self.rate_limited:
+            return self.rate_limited.pop(0)
+        if end - start + 1 > self.max_range:
+            return MockResponse({"jsonrpc": "2.0", "id": 1, "error": {"code": -32005, "message": "query returned more than 10000 results"}})
+        result = [log for log in self.logs if start <= int(log["blockNumber"], 16) <= end and log["topics"][0] in params["topics"][0]]
+        return MockResponse({"jsonrpc": "2.0", "id": 1, "result": result})
+
+
+def topic(address):
+    return "0x" + encode(["address"], [address]).hex()
+
+
+def make_log(topic0, first, second, value, block_number, removed=False):
+    return {"topics": [topic0, topic(first), topic(second)], "data": "0x" + encode(["uint256"], [value]).hex(),
+            "blockNumber": hex(block_number), "removed": removed}
+
+
+def test_build_event_key_map():
+    """测试$msg_sender和参数在事件中的位置，两层mapping对应两个位置"""
+    storage_info = make_storage_info({})
+    event_map = build_event_key_map(FUNCTION_EVENTS, storage_info.get_key_templates(), make_abi() + [TRANSFER, APPROVAL])
+    assert event_map[TRANSFER_TOPIC]["keys"] == {"_balances": {0, 1}}
+    assert event_map[APPROVAL_TOPIC]["keys"] == {"_allowances": {(0, 1)}}
+    print("✓ 事件key映射测试通过")
+
+
+def test_decode_log():
+    values = decode_log(TRANSFER, make_log(TRANSFER_TOPIC, SENDER, ALICE, 5, 10))
+    assert values == [SENDER, ALICE, 5]
+    print("✓ 日志解码测试通过")
+
+
+def test_discover_keys_from_logs():
+    """测试节点拒绝大范围请求时窗口减半，被移除的日志不产生key"""
+    storage_info = make_storage_info({})
+    event_map = build_event_key_map(FUNCTION_EVENTS, storage_info.get_key_templates(), make_abi() + [TRANSFER, APPROVAL])
+    bob = "0x4444444444444444444444444444444444444444"
+    logs = [
+        make_log(TRANSFER_TOPIC, SENDER, ALICE, 5, 120),
+        make_log(APPROVAL_TOPIC, ALICE, SENDER, 1, 150),
+        make_log(TRANSFER_TOPIC, ALICE, bob, 1, 160, removed=True),
+        make_log(TRANSFER_TOPIC, SENDER, ALICE, 5, 390),
+    ]
+    fetcher = MockLogFetcher(logs, max_range=100, initial_window=400)
+    fact_keys = discover_keys_from_logs(fetcher, event_map, 100, 499)
+    assert fact_keys == {"_balances": {SENDER: 120, ALICE: 120}, "_allowances": {(ALICE, SENDER): 150}}
+    # 400 -> 200 -> 100，之后窗口不会再增长到被拒绝过的大小
+    assert fetcher.requests == [(100, 499), (100, 299), (100, 199), (200, 299), (300, 399), (400, 499)]
+    print("✓ 日志key发现测试通过")
+
+
+def test_rate_limit_keeps_window():
+    """被限流时同一个窗口退避后重试，不缩小窗口"""
+    logs = [make_log(TRANSFER_TOPIC, SENDER, ALICE, 5, 120)]
+    rate_limited = [
+        MockResponse({"jsonrpc": "2.0", "id": 1, "error": {"code": -32005, "message": "daily request count exceeded, request rate limited"}}),
+        MockResponse({"jsonrpc": "2.0", "id": 1, "error": {"code": -32005, "message": "limit exceeded"}}),
+        MockResponse({}, status_code=429),
+    ]
+    fetcher = MockLogFetcher(logs, max_range=1000, rate_limited=rate_limited, initial_window=400)
+    assert [len(window) for window in fetcher.iter_logs(100, 499, [TRANSFER_TOPIC])] == [1]
+    assert fetcher.requests == [(100, 499)] * 4 and fetcher.window == 800 and fetcher.max_window == 100000
+
+    # 重试次数用完时抛出异常，而不是把窗口缩小到最小值
+    fetcher = MockLogFetcher(logs, max_range=1000, rate_limited=[MockResponse({}, status_code=429)] * 3,
+                             initial_window=400, rate_limit_retries=2)
+    try:
+        list(fetcher.iter_logs(100, 499, [TRANSFER_TOPIC]))
+        assert False, "应该被限流"
+    except Exception as e:
+        assert "被限流" in str(e)
+    assert fetcher.window == 400
+    print("✓ 限流重试测试通过")
+
+
+if __name__ == "__main__":
+    test_build_event_key_map()
+    test_decode_log()
+    test_discover_keys_from_logs()
+    test_rate_limit_keeps_window()
@@ -93,13 +93,9 @@ def test_single_page():
         
         print(f"测试区块范围: {start_block} - {end_block}")
         
-        # 获取普通交易
-        normal_txs = transaction_info._get_transactions(test_address, start_block, end_block, "txlist")
-        print(f"普通交易数量: {len(normal_txs)}")
-        
-        # 获取内部交易
-        internal_txs = transaction_info._get_transactions(test_address, start_block, end_block, "txlistinternal")
-        print(f"内部交易数量: {len(internal_txs)}")
+        # 通过限流的并发获取器获取普通交易和内部交易
+        for window_start, window_end, txs in transaction_info.iter_etherscan_windows(start_block, end_block):
+            print(f"区块 {window_start} - {window_end} 交易数量: {len(txs)}")
         
         return True
         
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+测试从structLogger的SHA3输入中恢复mapping的key
+设置ANVIL_RPC_URL（比如 anvil 默认的 http://127.0.0.1:8545）时会在本地节点上部署合约测试真实的trace
+"""
+
+import sys
+import os
+from eth_abi import encode
+from eth_utils import keccak
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+sys.path.append(os.path.dirname(__file__))
+
+from slither.tools.contract_abstract.onchain.preimage_key_tracer import PreimageKeyTracer
+from test_replay_engine import ENTITIES, SENDER, ALICE
+
+CONTRACT = "0xAbCdEf5555555555555555555555555555555555"
+OTHER = "0x9999999999999999999999999999999999999999"
+UINT = {"dataType": "uint256", "dataMeta": {"size": 32}}
+# 运行时代码: mstore(0, calldataload(0)); mstore(32, 1); sstore(keccak256(0, 64), 1)
+KECCAK_INIT_CODE = "0x6015600c60003960156000f3" + "600035600052600160205260406000206001905500"
+
+
+class MockResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class MockPreimageKeyTracer(PreimageKeyTracer):
+    """不发送HTTP请求，返回预先设置的structLogs"""
+
+    def __init__(self, traces, entities=ENTITIES):
+        super().__init__("http://localhost:8545", CONTRACT, entities, max_workers=2)
+        self.traces = traces
+
+    def _post(self, payload):
+        assert payload["method"] == "debug_traceTransaction"
+        return MockResponse({"jsonrpc": "2.0", "id": 1, "result": {"structLogs": self.traces[payload["params"][0]]}})
+
+
+def sha3_log(depth, data):
+    """SHA3前的structLog，memory从0开始存放data，栈顶是offset"""
+    memory = [data[i:i + 32].hex() for i in range(0, len(data), 32)]
+    return {"depth": depth, "op": "SHA3", "stack": [hex(len(data)), "0x0"], "memory": memory}
+
+
+def call_log(depth, op, address):
+    return {"depth": depth, "op": op, "stack": ["0x0", "0x0", "0x0", "0x0", "0x0", address, "0xffff"], "memory": []}
+
+
+def test_match_keys():
+    """测试一层mapping、两层mapping（第二层的slot是第一层的哈希）、非法编码以及非mapping的哈希"""
+    tracer = MockPreimageKeyTracer({}, dict(ENTITIES, _flags={"dataType": "mapping", "storageInfo": {"slot": 9, "offset": 0},
+                                                             "dataMeta": {"key": {"dataType": "uint8"}, "value": UINT}}))
+    outer = encode(["address", "uint256"], [SENDER, 2])
+    inputs = [
+        encode(["address", "uint256"], [ALICE, 1]),
+        outer,
+        encode(["address", "bytes32"], [ALICE, keccak(outer)]),
+        encode(["uint256", "uint256"], [300, 9]), # uint8的key不可能是300
+        encode(["uint256", "uint256"], [5, 100]),
+    ]
+    assert tracer.match_keys(inputs) == {"_balances": {ALICE}, "_allowances": {(SENDER, ALICE)}}
+    print("✓ SHA3输入匹配测试通过")
+
+
+def test_storage_context():
+    """测试只有合约自己以及DELEGATECALL中的SHA3被记录，CALL到其他合约的不记录"""
+    balance_of = lambda address: encode(["address", "uint256"], [address, 1])
+    bob = "0x4444444444444444444444444444444444444444"
+    traces = {"0x01": [
+        sha3_log(1, balance_of(SENDER)),
+        call_log(1, "CALL", OTHER),
+        sha3_log(2, balance_of(bob)), # 其他合约storage中的同名mapping
+        call_log(1, "DELEGATECALL", OTHER),
+        sha3_log(2, balance_of(ALICE)), # 代理合约调用逻辑合约
+    ], "0x02": [sha3_log(1, balance_of(bob))]}
+    tracer = MockPreimageKeyTracer(traces)
+    transactions = [
+        {"hash": "0x01", "to_address": CONTRACT.lower(), "block_number": 10, "is_error": 0},
+        {"hash": "0x02", "to_address": CONTRACT.lower(), "block_number": 11, "is_error": 1},
+    ]
+    assert tracer.discover_keys(transactions) == {"_balances": {SENDER: 10, ALICE: 10}}
+    print("✓ storage上下文测试通过")
+
+
+def test_anvil_preimage():
+    """在anvil上部署对abi.encode(key, 1)做keccak256的合约，恢复_balances的key"""
+    rpc_url = os.environ.get("ANVIL_RPC_URL")
+    if not rpc_url:
+        print("未设置ANVIL_RPC_URL，跳过anvil测试")
+        return
+    from web3 import Web3
+    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    account = w3.eth.accounts[0]
+    receipt = w3.eth.wait_for_transaction_receipt(w3.eth.send_transaction({"from": account, "data": KECCAK_INIT_CODE}))
+    address = receipt["contractAddress"]
+    tx_hash = w3.eth.send_transaction({"from": account, "to": address, "data": "0x" + encode(["address"], [ALICE]).hex(), "gas": 100000})
+    w3.eth.wait_for_transaction_receipt(tx_hash)
+
+    tracer = PreimageKeyTracer(rpc_url, address, ENTITIES)
+    keys = tracer.get_transaction_keys({"hash": "0x" + tx_hash.hex().removeprefix("0x"), "to_address": address})
+    assert keys == {"_balances": {ALICE}}
+    print("✓ anvil SHA3输入测试通过")
+
+
+if __name__ == "__main__":
+    test_match_keys()
+    test_storage_context()
+    test_anvil_preimage()
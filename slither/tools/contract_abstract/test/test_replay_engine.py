@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+测试重放时根据写storage模板计算被改变的行和需要读取的slot
+"""
+
+import sys
+import os
+import json
+from eth_abi import encode
+from eth_utils import keccak
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+
+from slither.tools.contract_abstract.contract.entity import Entity
+from slither.tools.contract_abstract.onchain.abi_decoder import AbiDecoder
+from slither.tools.contract_abstract.onchain.storage_info import StorageInfo
+
+UINT = {"dataType": "uint256", "dataMeta": {"size": 32}}
+ADDRESS = {"dataType": "address", "dataMeta": {"size": 20}}
+ENTITIES = {
+    "owner": {"dataType": "address", "dataMeta": {"size": 20}, "storageInfo": {"slot": 0, "offset": 0}},
+    "_balances": {"dataType": "mapping", "dataMeta": {"key": ADDRESS, "value": UINT}, "storageInfo": {"slot": 1, "offset": 0}},
+    "_allowances": {"dataType": "mapping", "storageInfo": {"slot": 2, "offset": 0},
+                    "dataMeta": {"key": ADDRESS, "value": {"dataType": "mapping", "dataMeta": {"key": ADDRESS, "value": UINT}}}},
+    "_reserves": {"dataType": "mapping", "storageInfo": {"slot": 3, "offset": 0}, "dataMeta": {"key": ADDRESS, "value": {
+        "dataType": "struct", "dataMeta": {"name": "ReserveData", "fields": [
+            {"name": "liquidityIndex", "type": {"dataType": "uint128", "dataMeta": {"size": 16}}},
+            {"name": "id", "type": {"dataType": "uint16", "dataMeta": {"size": 2}}},
+            {"name": "rate", "type": {"dataType": "uint128", "dataMeta": {"size": 16}}}]}}}},
+    "_reservesList": {"dataType": "mapping", "dataMeta": {"key": UINT, "value": ADDRESS}, "storageInfo": {"slot": 4, "offset": 0}},
+}
+FUNCTIONS = {
+    "transfer(address,uint256)": (["to", "amount"], ["_balances[$msg_sender]", "_balances[to]"]),
+    "approve(address,uint256)": (["spender", "amount"], ["_allowances[$msg_sender][spender]"]),
+    "initReserve(address)": (["asset"], ["_reserves[asset].id", "_reservesList[_reserves[asset].id]"]),
+    "dropReserves(uint256)": (["count"], ["_reservesList[i]", "owner"]),
+}
+SENDER = "0x1111111111111111111111111111111111111111"
+ALICE = "0x2222222222222222222222222222222222222222"
+ASSET = "0x3333333333333333333333333333333333333333"
+
+
+def make_abi():
+    abi = []
+    for signature, (names, _) in FUNCTIONS.items():
+        types = signature[signature.index("(") + 1:-1].split(",")
+        inputs = [{"name": name, "type": type} for name, type in zip(names, types)]
+        abi.append({"type": "function", "name": signature.split("(")[0], "inputs": inputs, "outputs": [], "stateMutability": "nonpayable"})
+    return abi
+
+
+def make_tx(signature, args, is_error=0):
+    types = signature[signature.index("(") + 1:-1].split(",")
+    method_id = "0x" + keccak(text=signature)[:4].hex()
+    return {"hash": "0x" + os.urandom(32).hex(), "from_address": SENDER, "method_id": method_id,
+            "input_data": method_id + encode(types, args).hex(), "is_error": is_error, "decoded_params": None}
+
+
+def make_storage_info(tables):
+    """不连接数据库和RPC，storage表的内容由tables提供"""
+    storage_info = StorageInfo.__new__(StorageInfo)
+    storage_info.db_connection = None
+    storage_info.meta_json = {"entities": ENTITIES, "function_write_storage": {
+        signature: {"parameters": names, "write_storages": writes} for signature, (names, writes) in FUNCTIONS.items()}}
+    storage_info.entity = Entity(SENDER, None, None, ENTITIES)
+    storage_info.abi_decoder = AbiDecoder(json.dumps(make_abi()))
+    storage_info.simple_table_name = "simple_entities"
+    storage_info.function_write_storage = {}
+    storage_info.fact_keys = {}
+    storage_info.pending_fact_keys = {}
+    storage_info.history_store = None
+    storage_info.deal_with_function_write_storage()
+
+    def read_elements_from_table(table_name, attribute_names, selector):
+        rows = [row for row in tables[table_name]
+                if all(row[column] in value if isinstance(value, list) else row[column] == value
+                       for column, value in selector.items())]
+        return [{name: row[name] for name in attribute_names} for row in rows]
+    storage_info.read_elements_from_table = read_elements_from_table
+    return storage_info
+
+
+def test_changed_slots():
+    """测试$msg_sender、参数、两层mapping、storage表达式作为index以及无法解析的index"""
+    tables = {"_reserves": [{"key1": ASSET, "id": 7}], "_reservesList": [{"key1": 0, "value": ASSET}, {"key1": 7, "value": ASSET}]}
+    storage_info = make_storage_info(tables)
+    transactions = [
+        make_tx("transfer(address,uint256)", [ALICE, 5]),
+        make_tx("approve(address,uint256)", [ALICE, 5]),
+        make_tx("initReserve(address)", [ASSET]),
+        make_tx("transfer(address,uint256)", [ASSET, 5], is_error=1), # 失败的交易没有写storage
+    ]
+    targets = storage_info.get_changed_slots(transactions)
+    assert targets == {
+        ("_balances", (SENDER,)): {None},
+        ("_balances", (ALICE,)): {None},
+        ("_allowances", (SENDER, ALICE)): {None},
+        ("_reserves", (ASSET,)): {"id"},
+        ("_reservesList", (7,)): {None},
+    }
+
+    # i是局部变量，只能重新读取表中已有的key
+    targets = storage_info.get_changed_slots([make_tx("dropReserves(uint256)", [2])])
+    assert targets == {("_reservesList", (0,)): {None}, ("_reservesList", (7,)): {None}, ("owner", None): {None}}
+    print("✓ 改变的行计算测试通过")
+
+
+def test_plan_changed_reads():
+    """测试规划出的slot与Entity按表达式计算的slot一致，并且只读取被写的字段"""
+    storage_info = make_storage_info({})
+    plan = storage_info.plan_changed_reads({
+        ("_allowances", (SENDER, ALICE)): {None},
+        ("_reserves", (ASSET,)): {"id"},
+        ("owner", None): {None},
+    })
+    reads = {(read["table"], tuple(sorted(read["keys"].items())), read["column"]): read["slot_info"] for read in plan["reads"]}
+    assert reads == {
+        ("_allowances", (("key1", SENDER), ("key2", ALICE)), "value"): storage_info.entity.get_storage_slot_info(f"_allowances[{SENDER}][{ALICE}]")[0],
+        ("_reserves", (("key1", ASSET),), "id"): storage_info.entity.get_storage_slot_info(f"_reserves[{ASSET}].id")[0],
+        ("simple_entities", (("id", 1),), "owner"): {"slot": 0, "offset": 0},
+    }
+    # 重放中出现的新key加入fact_keys
+    assert storage_info.fact_keys == {"_allowances": {(SENDER, ALICE)}, "_reserves": {ASSET}}
+    assert storage_info.pending_fact_keys == storage_info.fact_keys
+    print("✓ 读取规划测试通过")
+
+
+if __name__ == "__main__":
+    test_changed_slots()
+    test_plan_changed_reads()
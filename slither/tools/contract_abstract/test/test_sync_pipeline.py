@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+测试交易获取和storage同步的流水线：按区块顺序写入、在交易所在区块上读取、依赖表状态的区块等待上一个区块写入，以及重组回滚
+"""
+
+import sys
+import os
+import asyncio
+from contextlib import contextmanager
+from web3 import Web3
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+sys.path.append(os.path.dirname(__file__))
+
+from slither.tools.contract_abstract.onchain.head_follower import HeadFollower
+from slither.tools.contract_abstract.onchain.sync_pipeline import SyncPipeline, SyncCoordinator
+from test_replay_engine import make_storage_info, make_tx, SENDER, ALICE, ASSET
+from test_head_follower import FakeWeb3
+
+
+class FakeTransactionInfo:
+    """交易表和Etherscan都在内存中，etherscan中的交易保存之后才会出现在交易表中"""
+
+    def __init__(self, w3, rows, etherscan):
+        self.w3 = w3
+        self.rows = rows # block_number -> 交易表中的交易
+        self.etherscan = etherscan # block_number -> Etherscan上的交易
+        self.revert_threshold = 12
+        self.rollbacks = []
+
+    def block_hash(self, block_number):
+        return Web3.to_hex(self.w3.eth.chain[block_number]["hash"])
+
+    def get_latest_block_number(self):
+        return max(self.rows)
+
+    def get_contract_creation_block(self):
+        return 90
+
+    def get_block_hashes(self, start_block, end_block):
+        return {}
+
+    def get_etherscan_latest_block(self):
+        return max(self.w3.eth.chain)
+
+    def get_transactions_from_etherscan(self, start_block, end_block):
+        return [dict(tx, blockNumber=str(block), blockHash=self.block_hash(block))
+                for block in range(start_block, end_block + 1) for tx in self.etherscan.get(block, [])]
+
+    def save_transactions_to_db(self, txs):
+        for tx in txs:
+            block = int(tx["blockNumber"])
+            if all(row["hash"] != tx["hash"] for row in self.rows.get(block, [])):
+                self.rows.setdefault(block, []).append(dict(tx, block_number=block, block_hash=tx["blockHash"]))
+        return len(txs)
+
+    def iter_blocks(self, start_block, end_block, fetch_size=10000):
+        for block in sorted(self.rows):
+            if start_block <= block <= end_block:
+                yield block, self.rows[block]
+
+    def rollback_to_block(self, block_number):
+        self.rollbacks.append(block_number)
+        for block in [block for block in self.rows if block > block_number]:
+            del self.rows[block]
+
+
+def make_pipeline_storage_info(events, pipeline_holder):
+    tables = {"_reserves": [{"key1": ASSET, "id": 7}], "_reservesList": []}
+    storage_info = make_storage_info(tables)
+    read_table = storage_info.read_elements_from_table
+    def read_elements_from_table(table_name, attribute_names, selector):
+        # 记录读取表时storage已经写到的区块
+        events.append(("table", pipeline_holder[0].progress["write"]))
+        return read_table(table_name, attribute_names, selector)
+    storage_info.read_elements_from_table = read_elements_from_table
+
+    storage_info.synced_block = 100
+    storage_info.get_synced_block = lambda: storage_info.synced_block
+    storage_info.check_reorg = lambda: None
+    storage_info.replay_fetch_size = 100
+    storage_info.sync_mode = "template"
+    storage_info.table_writer = type("Writer", (), {"transaction": contextmanager(lambda self: (yield))})()
+
+    def get_storage_values(reads, block_identifier=None):
+        events.append(("read", block_identifier))
+        return [block_identifier for _ in reads]
+    storage_info.entity.get_storage_values = get_storage_values
+
+    def write_block_rows(block_number, block_hash, rows, tables=None):
+        events.append(("write", block_number, sorted(key for key, _ in rows), storage_info.pending_fact_keys))
+        storage_info.pending_fact_keys = {}
+        storage_info.synced_block = block_number
+    storage_info._write_block_rows = write_block_rows
+
+    def write_sync_block(block_number, block_hash):
+        events.append(("sync", block_number))
+        storage_info.synced_block = block_number
+    storage_info._write_sync_block = write_sync_block
+
+    def rollback_to_block(block_number):
+        events.append(("rollback", block_number))
+        storage_info.synced_block = min(storage_info.synced_block, block_number)
+    storage_info.rollback_to_block = rollback_to_block
+    return storage_info
+
+
+def with_block(tx, block, w3):
+    return dict(tx, block_number=block, block_hash=Web3.to_hex(w3.eth.chain[block]["hash"]))
+
+
+def test_table_dependent_methods():
+    storage_info = make_storage_info({})
+    transfer = make_tx("transfer(address,uint256)", [ALICE, 5])
+    init_reserve = make_tx("initReserve(address)", [ASSET])
+    drop_reserves = make_tx("dropReserves(uint256)", [2])
+    assert not storage_info.needs_table_state([transfer, make_tx("approve(address,uint256)", [ALICE, 5])])
+    # storage表达式作为index和无法解析的index都要读取storage表
+    assert storage_info.needs_table_state([transfer, init_reserve])
+    assert storage_info.needs_table_state([drop_reserves])
+    assert not storage_info.needs_table_state([make_tx("initReserve(address)", [ASSET], is_error=1)])
+    print("✓ 依赖storage表状态的函数识别测试通过")
+
+
+def test_pipeline():
+    w3 = FakeWeb3()
+    w3.eth.extend(1, 90, 103)
+    events = []
+    pipeline_holder = []
+    # 交易表中已经有101和103的交易，storage同步到100
+    rows = {101: [with_block(make_tx("transfer(address,uint256)", [ALICE, 5]), 101, w3)]}
+    etherscan = {103: [make_tx("transfer(address,uint256)", [ASSET, 1])], 105: [make_tx("initReserve(address)", [ASSET])]}
+    rows[103] = [with_block(etherscan[103][0], 103, w3)]
+    transaction_info = FakeTransactionInfo(w3, rows, etherscan)
+    storage_info = make_pipeline_storage_info(events, pipeline_holder)
+    follower = HeadFollower(w3, revert_threshold=5, poll_interval=0.01)
+    pipeline = SyncPipeline(transaction_info, storage_info, follower, name="token", queue_size=2)
+    pipeline_holder.append(pipeline)
+    coordinator = SyncCoordinator(follower, [pipeline], max_concurrency=2, status_interval=0.05)
+
+    async def wait_written(block_number):
+        while pipeline.progress["write"] is None or pipeline.progress["write"] < block_number:
+            await asyncio.sleep(0.01)
+
+    async def drive():
+        task = asyncio.create_task(coordinator.run())
+        try:
+            await asyncio.wait_for(wait_written(102), 5)
+            w3.eth.extend(1, 104, 105)
+            await asyncio.wait_for(wait_written(105), 5)
+            status = coordinator.get_status()["token"]
+            assert status["head"] == 105 and status["stages"]["write"]["lag"] == 0
+
+            # 区块105被重组，新的分叉在106有一个转账
+            etherscan[105] = []
+            etherscan[106] = [make_tx("transfer(address,uint256)", [SENDER, 2])]
+            w3.eth.extend(2, 105, 106)
+            await asyncio.wait_for(wait_written(106), 5)
+        finally:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    asyncio.run(drive())
+
+    writes = [event for event in events if event[0] in ("write", "sync", "rollback")]
+    assert [event[:2] for event in writes] == [("write", 101), ("sync", 102), ("write", 103), ("write", 105),
+                                               ("rollback", 104), ("write", 106)]
+    # 新出现的key和该区块的行一起写入
+    assert writes[0][3] == {"_balances": {SENDER, ALICE}} and writes[2][3] == {"_balances": {ASSET}}
+    assert writes[3][2] == ["_reserves", "_reservesList"]
+    # 每个区块在自己的区块上读取
+    assert [event[1] for event in events if event[0] == "read"] == [101, 103, 105, 106]
+    # 区块105的index从storage表中读取，此时103已经写入
+    assert [event[1] for event in events if event[0] == "table"] and all(event[1] >= 103 for event in events if event[0] == "table")
+    assert transaction_info.rollbacks == [104] and 105 not in transaction_info.rows
+    print("✓ 同步流水线测试通过")
+
+
+def test_multi_contract():
+    """两个合约共享链头跟踪和调度器，各自的交易写入各自的storage"""
+    w3 = FakeWeb3()
+    w3.eth.extend(1, 90, 101)
+    pipelines = []
+    follower = HeadFollower(w3, revert_threshold=5, poll_interval=0.01)
+    for name, receiver in [("token", ALICE), ("pool", ASSET)]:
+        events = []
+        rows = {100: [with_block(make_tx("transfer(address,uint256)", [receiver, 1]), 100, w3)]}
+        etherscan = {102: [make_tx("transfer(address,uint256)", [receiver, 2])]}
+        storage_info = make_pipeline_storage_info(events, pipelines)
+        pipeline = SyncPipeline(FakeTransactionInfo(w3, rows, etherscan), storage_info, follower, name=name, queue_size=2)
+        pipeline.events = events
+        pipelines.append(pipeline)
+    coordinator = SyncCoordinator(follower, pipelines, max_concurrency=1, status_interval=0.05)
+
+    async def drive():
+        task = asyncio.create_task(coordinator.run())
+        try:
+            while any(pipeline.progress["write"] is None or pipeline.progress["write"] < 101 for pipeline in pipelines):
+                await asyncio.sleep(0.01)
+            w3.eth.extend(1, 102, 102)
+            while any(pipeline.progress["write"] < 102 for pipeline in pipelines):
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    asyncio.run(asyncio.wait_for(drive(), 5))
+
+    for pipeline, receiver in zip(pipelines, [ALICE, ASSET]):
+        writes = [event for event in pipeline.events if event[0] in ("write", "sync")]
+        assert [event[:2] for event in writes] == [("sync", 101), ("write", 102)]
+        assert writes[1][3] == {"_balances": {SENDER, receiver}}
+    assert set(coordinator.scheduler.granted) == {"token", "pool"}
+    print("✓ 多合约同步测试通过")
+
+
+if __name__ == "__main__":
+    test_table_dependent_methods()
+    test_pipeline()
+    test_multi_contract()
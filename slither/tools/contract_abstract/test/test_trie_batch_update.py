@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+测试StorageProof批量更新与逐个更新得到相同的根
+"""
+
+import sys
+import os
+import random
+from trie import HexaryTrie
+
+# 添加slither路径到sys.path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'slither'))
+
+from slither.tools.contract_abstract.onchain.storage_proof import StorageProof
+
+
+def make_storage_proof():
+    """不连接数据库，只使用内存中的trie"""
+    storage_proof = StorageProof.__new__(StorageProof)
+    storage_proof.db_connection = None
+    storage_proof.trie = HexaryTrie({})
+    return storage_proof
+
+
+def test_batch_update_same_root():
+    """测试多个区块的批量更新与逐个更新的根一致"""
+    random.seed(7)
+    sequential = make_storage_proof()
+    batch = make_storage_proof()
+    for _ in range(5):
+        changes = [(random.randrange(300), random.choice([0, random.getrandbits(200)])) for _ in range(200)]
+        for slot, value in changes:
+            sequential.update_storage(slot, hex(value))
+        root = batch.update_storage_batch(changes)
+        assert root == sequential.get_local_root()
+    # 批量更新不保存中间节点
+    assert len(batch.trie.db) < len(sequential.trie.db)
+    print(f"✓ 批量更新测试通过，节点数 {len(batch.trie.db)} / {len(sequential.trie.db)}")
+
+
+def test_value_encoding():
+    """测试value按去掉前导0的bytes编码，值为0时删除"""
+    storage_proof = make_storage_proof()
+    storage_proof.update_storage_batch({0: "0x" + "00" * 31 + "01", 1: 0x1234})
+    assert storage_proof.get_value_from_trie(0) == b"\x01"
+    assert storage_proof.get_value_from_trie("0x1") == b"\x12\x34"
+
+    root = storage_proof.update_storage_batch([(0, 0), (1, b"\x00" * 32)])
+    assert root == "0x" + HexaryTrie.BLANK_NODE_HASH.hex()
+    assert storage_proof.get_value_from_trie(0) is None
+    print("✓ value编码测试通过")
+
+
+if __name__ == "__main__":
+    test_batch_update_same_root()
+    test_value_encoding()
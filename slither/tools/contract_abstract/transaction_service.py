@@ -6,6 +6,8 @@ from typing import Optional
 from argparse import ArgumentParser
 from slither.tools.contract_abstract.onchain.contract_info import ContractInfo
 from slither.tools.contract_abstract.onchain.transaction_info import TransactionInfo
+from slither.tools.contract_abstract.onchain.http_client import get_http_client
+from slither.tools.contract_abstract.onchain.head_follower import HeadFollower
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -22,6 +24,13 @@ def parse_args():
     parser.add_argument("--db-name", default="ethereum_transactions", help="数据库名称")
     parser.add_argument("--db-user", default="postgres", help="数据库用户名")
     parser.add_argument("--db-password", default="password", help="数据库密码")
+
+    # Etherscan请求参数
+    parser.add_argument("--etherscan-rate", type=float, default=5, help="Etherscan API每秒最多请求数")
+    parser.add_argument("--etherscan-workers", type=int, default=4, help="并发请求Etherscan的线程数")
+
+    # 链头跟踪参数
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="没有新区块时每隔多少秒查询一次RPC节点的最新区块")
     
     return parser.parse_args()
 
@@ -62,7 +71,9 @@ def main() -> None:
                 args.etherscan_apikey, 
                 contract_info, 
                 db_config=db_config,
-                logic_address=meta_json["logic_address"]
+                logic_address=meta_json["logic_address"],
+                etherscan_rate=args.etherscan_rate,
+                etherscan_workers=args.etherscan_workers
             )
             logger.info(f"使用代理合约模式，逻辑地址: {meta_json['logic_address']}")
         else:
@@ -70,7 +81,9 @@ def main() -> None:
                 meta_json["address"], 
                 args.etherscan_apikey, 
                 contract_info,
-                db_config=db_config
+                db_config=db_config,
+                etherscan_rate=args.etherscan_rate,
+                etherscan_workers=args.etherscan_workers
             )
             logger.info("使用普通合约模式")
         logger.info("交易信息初始化成功")
@@ -100,73 +113,82 @@ def main() -> None:
         logger.info(f"Etherscan最新区块: {etherscan_latest_block}")
         logger.info(f"合约部署区块: {deployment_block}")
 
-        # 先同步到最新区块，每次获取最多100000个区块的该合约的交易
-        every_batch_block = 5000
-        logger.info(f"开始批量同步，每批处理 {every_batch_block} 个区块")
+        # 先同步到最新区块，按窗口并发获取，窗口按区块顺序返回并写入
+        logger.info(f"开始批量同步，并发数 {args.etherscan_workers}，每秒最多 {args.etherscan_rate} 个请求")
         
-        for i in range(start_block, end_block, every_batch_block):
+        for window_start, window_end, txs in transaction_info.iter_etherscan_windows(start_block, end_block):
             try:
-                current_end = min(i + every_batch_block, end_block)
-                logger.info(f"处理区块范围: {i} - {current_end}")
-                
-                txs = transaction_info.get_transactions_from_etherscan(i, current_end)
                 if txs:
                     saved_count = transaction_info.save_transactions_to_db(txs)
                     logger.info(f"成功保存 {saved_count} 条交易记录")
                 else:
-                    logger.info(f"区块范围 {i} - {current_end} 中没有找到交易")
+                    logger.info(f"区块范围 {window_start} - {window_end} 中没有找到交易")
                     
             except Exception as e:
-                logger.error(f"处理区块范围 {i} - {current_end} 时发生错误: {e}")
-                raise Exception(f"处理区块范围 {i} - {current_end} 时发生错误: {e}")
+                logger.error(f"处理区块范围 {window_start} - {window_end} 时发生错误: {e}")
+                raise Exception(f"处理区块范围 {window_start} - {window_end} 时发生错误: {e}")
+
+        # 然后通过RPC节点跟踪链头，最近revert_threshold个区块被重组时删除这些区块的交易并重新获取
+        logger.info("开始跟踪链头...")
+        follower = HeadFollower(contract_info.w3, revert_threshold=transaction_info.revert_threshold,
+                                poll_interval=args.poll_interval)
+        synced_block = end_block
+        ancestor = follower.start(synced_block, transaction_info.get_block_hashes(
+            synced_block - transaction_info.revert_threshold, synced_block))
+        if ancestor is not None:
+            transaction_info.rollback_to_block(ancestor)
+            synced_block = ancestor
 
-        # 然后每12s查询一次最新区块，如果最新区块大于end_block，则继续获取该合约的交易
-        logger.info("开始监控新区块...")
         consecutive_errors = 0
         max_consecutive_errors = 5
-        time_interval = 12
-        
+
         while True:
             try:
-                time.sleep(time_interval)
+                event = follower.poll()
+                if event is None:
+                    time.sleep(args.poll_interval)
+                    continue
+                consecutive_errors = 0  # 重置错误计数
+
+                if event[0] == "reorg":
+                    ancestor = event[1]
+                    if ancestor < synced_block:
+                        transaction_info.rollback_to_block(ancestor)
+                        synced_block = ancestor
+                    continue
+
+                # Etherscan可能落后于RPC节点，只获取Etherscan已经索引的区块
                 etherscan_latest_block = transaction_info.get_etherscan_latest_block()
-                
                 if etherscan_latest_block is None:
-                    consecutive_errors += 1
-                    logger.error(f"无法获取Etherscan最新区块号 (错误次数: {consecutive_errors})")
-                    if consecutive_errors >= max_consecutive_errors:
-                        logger.error(f"连续 {max_consecutive_errors} 次获取失败，程序退出")
-                        break
+                    raise Exception("无法获取Etherscan最新区块号")
+                latest_block = min(event[2], etherscan_latest_block)
+                if latest_block <= synced_block:
                     continue
-                
-                consecutive_errors = 0  # 重置错误计数
-                
-                if etherscan_latest_block > end_block:
-                    logger.info(f"发现新区块: {etherscan_latest_block}，开始同步...")
-                    try:
-                        txs = transaction_info.get_transactions_from_etherscan(end_block, etherscan_latest_block)
-                        if txs:
-                            saved_count = transaction_info.save_transactions_to_db(txs)
-                            logger.info(f"成功保存 {saved_count} 条新区块交易记录")
-                        else:
-                            logger.info(f"新区块范围 {end_block} - {etherscan_latest_block} 中没有找到交易")
-                    except Exception as e:
-                        logger.error(f"同步新区块时发生错误: {e}")
-                        continue
-                    
-                    end_block = etherscan_latest_block
+
+                logger.info(f"发现新区块: {latest_block}，开始同步...")
+                txs = transaction_info.get_transactions_from_etherscan(synced_block + 1, latest_block)
+                orphaned = [tx for tx in txs if not follower.is_canonical(int(tx["blockNumber"]), tx.get("blockHash"))]
+                if orphaned:
+                    # Etherscan还没有更新重组之后的区块，下次再获取
+                    logger.warning(f"Etherscan返回了 {len(orphaned)} 条已经被重组的交易，稍后重试")
+                    continue
+                if txs:
+                    saved_count = transaction_info.save_transactions_to_db(txs)
+                    logger.info(f"成功保存 {saved_count} 条新区块交易记录")
                 else:
-                    logger.debug(f"当前最新区块: {etherscan_latest_block}，无需同步")
-                    
+                    logger.info(f"新区块范围 {synced_block + 1} - {latest_block} 中没有找到交易")
+                synced_block = latest_block
+
             except KeyboardInterrupt:
                 logger.info("收到中断信号，程序正在退出...")
                 break
             except Exception as e:
                 consecutive_errors += 1
-                logger.error(f"监控过程中发生未知错误: {e} (错误次数: {consecutive_errors})")
+                logger.error(f"跟踪链头时发生错误: {e} (错误次数: {consecutive_errors})")
                 if consecutive_errors >= max_consecutive_errors:
                     logger.error(f"连续 {max_consecutive_errors} 次发生错误，程序退出")
                     break
+                time.sleep(args.poll_interval)
                 continue
 
     except FileNotFoundError:
@@ -179,6 +201,8 @@ def main() -> None:
         logger.error(f"程序初始化失败: {e}")
         sys.exit(1)
     finally:
+        # 输出各endpoint的请求延迟和错误数
+        get_http_client().log_metrics()
         # 清理资源
         if transaction_info:
             try: